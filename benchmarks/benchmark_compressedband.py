@@ -0,0 +1,27 @@
+""" Measure CompressedBand throughput as a function of worker thread count.
+
+Usage: python benchmark_compressedband.py [size]
+"""
+import sys
+import timeit
+
+size = int(sys.argv[1]) if len(sys.argv) > 1 else 8192
+
+setup = """
+import numpy as np
+from karta.raster.band import CompressedBand
+x, y = np.meshgrid(np.linspace(0, 1, {size}), np.linspace(0, 1, {size}))
+values = np.sin(20*x) * np.cos(13*y)
+band = CompressedBand(({size}, {size}), np.float64, nthreads={nthreads})
+band.setblock(0, 0, values)
+""".replace("{size}", str(size))
+
+print("{0} x {0} float64 band".format(size))
+print("threads    setblock (s)    getblock (s)")
+for nthreads in (1, 2, 4, 8, 16):
+    _setup = setup.replace("{nthreads}", str(nthreads))
+    tset = timeit.timeit(stmt="band.setblock(0, 0, values)", setup=_setup,
+                         number=3) / 3
+    tget = timeit.timeit(stmt="band.getblock(0, 0, {0}, {0})".format(size),
+                         setup=_setup, number=3) / 3
+    print("{0:>7d}    {1:>12.3f}    {2:>12.3f}".format(nthreads, tset, tget))
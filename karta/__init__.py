@@ -17,7 +17,7 @@ from .vector import (Point, Line, Polygon, Multipoint, Multiline, Multipolygon,
                      read_shapefile, write_shapefile,
                      geometry)
 
-from .raster import (RegularGrid, SimpleBand, CompressedBand,
+from .raster import (RegularGrid, SimpleBand, CompressedBand, MmapBand,
                      read_aai, read_geotiff, read_gtiff, from_geotiffs,
                      grid, misc)
 
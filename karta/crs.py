@@ -16,6 +16,8 @@ CRS objects should be immutable. It is possible for multiple CRS objects to
 implement the same system, and tests for equality may fail.
 """
 
+import threading
+from collections import OrderedDict
 from math import pi
 import numpy as np
 import pyproj
@@ -76,6 +78,105 @@ ELLIPSOID_DATA = {
  "WGS84": (6378137.0, None, 298.257223563, "WGS 84"),
  "sphere": (6370997.0, 6370997.0, None, "Normal Sphere (r=6370997)")}
 
+class TransformerCache(object):
+    """ Least-recently-used store of coordinate transformers between pairs of
+    CRS instances, keyed by their proj.4 definitions. Building a transformer
+    resolves a PROJ pipeline, which is slow compared to transforming a few
+    coordinates, so `CRS.transform` reuses transformers from `TRANSFORMERS`.
+
+    Attributes
+    ----------
+    maxsize : int
+        maximum number of transformers held
+    hits : int
+        number of lookups satisfied from the cache
+    misses : int
+        number of lookups that required building a transformer
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._transformers = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self._transformers)
+
+    def get(self, src, dst):
+        """ Return a function ``f(x, y, z=None, inplace=False)`` transforming
+        coordinates from CRS *src* to CRS *dst*. """
+        key = (src.get_proj4(), dst.get_proj4())
+        with self._lock:
+            transformer = self._transformers.pop(key, None)
+            if transformer is not None:
+                self.hits += 1
+                self._transformers[key] = transformer
+                return transformer
+            self.misses += 1
+
+        transformer = _build_transformer(src._proj, dst._proj)
+        with self._lock:
+            self._transformers[key] = transformer
+            while len(self._transformers) > self.maxsize:
+                self._transformers.popitem(last=False)
+        return transformer
+
+    def clear(self):
+        """ Drop all stored transformers. Counters are not reset. """
+        with self._lock:
+            self._transformers.clear()
+        return
+
+    def reset_counters(self):
+        """ Set hit and miss counters to zero. """
+        self.hits = 0
+        self.misses = 0
+        return
+
+    @property
+    def hit_ratio(self):
+        """ Fraction of lookups satisfied from the cache """
+        n = self.hits + self.misses
+        return self.hits / float(n) if n != 0 else 0.0
+
+if hasattr(pyproj, "Transformer"):
+    def _build_transformer(src, dst):
+        transform = pyproj.Transformer.from_proj(src, dst, always_xy=True).transform
+        def transformer(x, y, z=None, inplace=False):
+            if z is None:
+                return transform(x, y, inplace=inplace)
+            return transform(x, y, z, inplace=inplace)
+        return transformer
+else:
+    # pyproj < 2.1
+    def _build_transformer(src, dst):
+        def transformer(x, y, z=None, inplace=False):
+            out = pyproj.transform(src, dst, x, y, z=z)
+            if inplace:
+                for a, b in zip((x, y, z), out):
+                    a[:] = b
+            return out
+        return transformer
+
+# Transformers shared by all CRS instances
+TRANSFORMERS = TransformerCache()
+
+def _transform_inplace(src, dst, x, y, z=None):
+    """ Transform contiguous float64 coordinate arrays in place """
+    arrays = (x, y) if z is None else (x, y, z)
+    for a in arrays:
+        if not (isinstance(a, np.ndarray) and a.dtype == np.float64 and
+                a.flags.c_contiguous and a.flags.writeable):
+            raise ValueError("coordinates must be writeable C-contiguous "
+                             "float64 arrays")
+    if len(set(a.shape for a in arrays)) != 1:
+        raise ValueError("coordinate arrays must have the same shape")
+    TRANSFORMERS.get(src, dst)(x, y, z=z, inplace=True)
+    return arrays
+
 class Ellipsoid(object):
     def __init__(self, name, a=None, b=None, f=None, rf=None):
         if a is None:
@@ -103,6 +204,7 @@ class CRS(object):
     - name attribute
     - project(x, y, inverse=False) method
     - transform(other, x, y) method
+    - transform_inplace(other, x, y) method, if the CRS can be transformed
     - forward(x, y, azimuth, distance) method
     - inverse(x0, y0, x1, y1) method
 
@@ -243,7 +345,17 @@ class GeographicalCRS(CRS):
         return az, baz, dist
 
     def transform(self, other, x, y):
-        return pyproj.transform(self._proj, other._proj, x, y)
+        return TRANSFORMERS.get(self, other)(x, y)
+
+    def transform_inplace(self, other, x, y):
+        """ Transform coordinates to *other*, overwriting *x* and *y*, which
+        must be writeable C-contiguous float64 arrays.
+
+        Returns
+        -------
+        (x, y)
+        """
+        return _transform_inplace(self, other, x, y)
 
 class ProjectedCRS(CartesianCRS):
     """ Projected reference systems backed by a *pypoj.Proj* instance or a
@@ -295,7 +407,17 @@ class ProjectedCRS(CartesianCRS):
         return az, baz, dist
 
     def transform(self, other, x, y, z=None):
-        return pyproj.transform(self._proj, other._proj, x, y, z=z)
+        return TRANSFORMERS.get(self, other)(x, y, z=z)
+
+    def transform_inplace(self, other, x, y, z=None):
+        """ Transform coordinates to *other*, overwriting *x*, *y*, and *z*,
+        which must be writeable C-contiguous float64 arrays.
+
+        Returns
+        -------
+        (x, y) or (x, y, z)
+        """
+        return _transform_inplace(self, other, x, y, z=z)
 
 def parse_ellipsoid(projstring):
     ename, ela, elb, elrf = None, None, None, None
@@ -16,6 +16,10 @@ import warnings
 # Miscellaneous functions
 # ---------------------------------
 
+def _isvector(*args):
+    """ Return whether any argument is a sequence or array """
+    return any(np.ndim(a) != 0 for a in args)
+
 def recurse_iterables(f, *args, **kwargs):
     def func(*args, **kwargs):
         if hasattr(args[0], "__iter__"):
@@ -113,7 +117,16 @@ def sphere_azimuth(lon1, lat1, lon2, lat2):
     return atan2(sin(_radians(dlon)), cos(_radians(lat1)) * tan(_radians(lat2)) - sin(_radians(lat1)) * cos(_radians(dlon)))
 
 def spherical_area(r, x1, y1, x2, y2):
-    """ Area between a geodesic and the equator on a sphere """
+    """ Area between a geodesic and the equator on a sphere. Array arguments
+    are broadcast and solved together. """
+    if _isvector(x1, y1, x2, y2):
+        x1, y1, x2, y2 = np.broadcast_arrays(
+                *[np.asarray(v, dtype=np.float64) for v in (x1, y1, x2, y2)])
+        reverse = np.where(x2 < x1, -1, 1)
+        _, x1, y1, x2, y2 = _canonical_configuration_vec(x1, y1, x2, y2)
+        alpha1, alpha2, _ = _solve_vincenty_vec(r, 0, (x2-x1)*pi/180.0,
+                                                y1*pi/180.0, y2*pi/180.0)
+        return reverse * r**2 * (alpha2-alpha1)
     if x2 < x1:
         reverse = -1
     else:
@@ -309,7 +322,8 @@ def _canonical_configuration(x1, y1, x2, y2):
 
 def ellipsoidal_forward(a, b, x, y, azimuth, distance):
     """ Compute the destination reached starting from a point and travelling
-    in a specified direction.
+    in a specified direction. Array arguments are broadcast and solved
+    together.
 
     Parameters
     ----------
@@ -337,6 +351,8 @@ def ellipsoidal_forward(a, b, x, y, azimuth, distance):
 
     Algorithm due to Karney, C.F.F. "Algorithms for geodesics", J. Geod (2013)
     """
+    if _isvector(x, y, azimuth, distance):
+        return _ellipsoidal_forward_vec(a, b, x, y, azimuth, distance)
     f = (a-b) / a
 
     phi1 = pi*y/180.0
@@ -430,7 +446,9 @@ def _ellipsoidal_inverse_equatorial(a, x1, x2):
     return az, baz, s12
 
 def ellipsoidal_inverse(a, b, x1, y1, x2, y2, tol=None):
-    """ Compute the shortest path (geodesic) between two points.
+    """ Compute the shortest path (geodesic) between two points. Array
+    arguments are broadcast and solved together, e.g. to compute a distance
+    matrix.
 
     Parameters
     ----------
@@ -458,6 +476,8 @@ def ellipsoidal_inverse(a, b, x1, y1, x2, y2, tol=None):
 
     Algorithm due to Karney, C.F.F. "Algorithms for geodesics", J. Geod (2013)
     """
+    if _isvector(x1, y1, x2, y2):
+        return _ellipsoidal_inverse_vec(a, b, x1, y1, x2, y2, tol=tol)
     niter = 0
     maxiter = 100
     if tol is None:
@@ -634,6 +654,32 @@ def ellipsoidal_inverse(a, b, x1, y1, x2, y2, tol=None):
     backaz = ((alpha2+pi)*180/pi + 180) % 360 - 180
     return az, backaz, s12
 
+def _C4(ep2, k2):
+    """ Coefficients of the series for the ellipsoidal area correction """
+    C40 = (2.0/3 - ep2/15 + 4*ep2**2/105 - 8*ep2**3/315 + 64*ep2**4/3465 - 128*ep2**5/9009) \
+        - (1.0/20 - ep2/35 + 2*ep2**2/105 - 16*ep2**3/1155 + 32*ep2**4/3003) * k2 \
+        + (1.0/42 - ep2/63 + 8*ep2**2/693 - 90*ep2**3/9009) * k2**2 \
+        - (1.0/72 - ep2/99 + 10*ep2**2/1287) * k2**3 \
+        + (1.0/110 - ep2/143) * k2**4 - k2**5/156
+
+    C41 = (1.0/180 - ep2/315 + 2*ep2**2/945 - 16*ep2**3/10395 + 32*ep2**4/27027) * k2 \
+        - (1.0/252 - ep2/378 + 4*ep2**2/2079 - 40*ep2**3/27027) * k2**2 \
+        + (1.0/360 - ep2/495 + 2*ep2**2/1287) * k2**3 \
+        - (1.0/495 - 2*ep2/1287) * k2**4 + 5*k2**5/3276
+
+    C42 = (1.0/2100 - ep2/3150 + 4*ep2**2/17325 - 8*ep2**3/45045) * k2**2 \
+        - (1.0/1800 - ep2/2475 + 2*ep2**2/6435) * k2**3 \
+        + (1.0/1925 - 2*ep2/5005) * k2**4 - k2**5/2184
+
+    C43 = (1.0/17640 - ep2/24255 + 2*ep2**2/63063) * k2**3 \
+        - (1.0/10780 - ep2/14014) * k2**4 + 5*k2**5/45864
+
+    C44 = (1.0/124740 - ep2/162162) * k2**4 - 1*k2**5/58968
+
+    C45 = k2**5/792792
+
+    return [C40, C41, C42, C43, C44, C45]
+
 def _ellipsoidal_area(a, b, lambda12, phi1, phi2, alpha1, alpha2):
     """ Area of a single quatrilateral defined by two meridians, the equator,
     and another geodesic.
@@ -664,29 +710,7 @@ def _ellipsoidal_area(a, b, lambda12, phi1, phi2, alpha1, alpha2):
     # compute integrals for ellipsoidal correction
     k2 = ep2*cos(alpha0)**2
 
-    C40 = (2.0/3 - ep2/15 + 4*ep2**2/105 - 8*ep2**3/315 + 64*ep2**4/3465 - 128*ep2**5/9009) \
-        - (1.0/20 - ep2/35 + 2*ep2**2/105 - 16*ep2**3/1155 + 32*ep2**4/3003) * k2 \
-        + (1.0/42 - ep2/63 + 8*ep2**2/693 - 90*ep2**3/9009) * k2**2 \
-        - (1.0/72 - ep2/99 + 10*ep2**2/1287) * k2**3 \
-        + (1.0/110 - ep2/143) * k2**4 - k2**5/156
-
-    C41 = (1.0/180 - ep2/315 + 2*ep2**2/945 - 16*ep2**3/10395 + 32*ep2**4/27027) * k2 \
-        - (1.0/252 - ep2/378 + 4*ep2**2/2079 - 40*ep2**3/27027) * k2**2 \
-        + (1.0/360 - ep2/495 + 2*ep2**2/1287) * k2**3 \
-        - (1.0/495 - 2*ep2/1287) * k2**4 + 5*k2**5/3276
-
-    C42 = (1.0/2100 - ep2/3150 + 4*ep2**2/17325 - 8*ep2**3/45045) * k2**2 \
-        - (1.0/1800 - ep2/2475 + 2*ep2**2/6435) * k2**3 \
-        + (1.0/1925 - 2*ep2/5005) * k2**4 - k2**5/2184
-
-    C43 = (1.0/17640 - ep2/24255 + 2*ep2**2/63063) * k2**3 \
-        - (1.0/10780 - ep2/14014) * k2**4 + 5*k2**5/45864
-
-    C44 = (1.0/124740 - ep2/162162) * k2**4 - 1*k2**5/58968
-
-    C45 = k2**5/792792
-
-    Cs = [C40, C41, C42, C43, C44, C45]
+    Cs = _C4(ep2, k2)
     I4s1 = sum(c*cos((2*i+1)*sigma1) for i,c in enumerate(Cs))
     I4s2 = sum(c*cos((2*i+1)*sigma2) for i,c in enumerate(Cs))
 
@@ -713,7 +737,10 @@ def ellipsoidal_area(a, b, x1, y1, x2, y2):
     y2 : float (degrees)
         latitude of geodesic segment end
 
+    Array arguments are broadcast and solved together.
     """
+    if _isvector(x1, y1, x2, y2):
+        return _ellipsoidal_area_vec(a, b, x1, y1, x2, y2)
     if x2 < x1:
         reverse = -1
     else:
@@ -728,6 +755,356 @@ def ellipsoidal_area(a, b, x1, y1, x2, y2):
     alpha2 = (baz-pi) * pi/180
     return reverse * _ellipsoidal_area(a, b, lambda12, phi1, phi2, alpha1, alpha2)
 
+# ---------------------------------
+# Vectorized ellipsoidal geodesy
+# ---------------------------------
+#
+# These follow the scalar functions above step by step, operating on arrays of
+# geodesics. Iterative solutions track convergence for each element.
+#
+
+def _series(C, sigma, f=np.sin):
+    """ Evaluate sum(C[i] * f(2*(i+1)*sigma)) """
+    return sum(c*f(2*(i+1)*sigma) for i, c in enumerate(C))
+
+def _A1C1(eps):
+    A1 = 1.0/(1-eps) * (1 + eps**2/4 + eps**4/64 + eps**6/256)
+    C1 = [-1.0/2*eps + 3.0/16*eps**3 - 1.0/32*eps**5,
+          -1.0/16*eps**2 + 1.0/32*eps**4 - 9.0/2048*eps**6,
+          -1.0/48*eps**3 + 3.0/256*eps**5,
+          -5.0/512*eps**4 + 3.0/512*eps**6,
+          -7.0/1280*eps**5,
+          -7.0/2048*eps**6]
+    return A1, C1
+
+def _A2C2(eps):
+    A2 = (1-eps) * (1 + 1.0/4*eps**2 + 9.0/64*eps**4 + 25.0/256*eps**6)
+    C2 = [1.0/2*eps + 1.0/16*eps**3 + 1.0/32*eps**5,
+          3.0/16*eps**2 + 1.0/32*eps**4 + 35.0/2048*eps**6,
+          5.0/48*eps**3 + 5.0/256*eps**5,
+          35.0/512*eps**4 + 7.0/512*eps**6,
+          63.0/1280*eps**5,
+          77.0/2048*eps**6]
+    return A2, C2
+
+def _A3C3(eps, n):
+    n2 = n*n
+    A3 = 1.0 - (1.0/2 - 1.0/2*n)*eps - (1.0/4 + 1.0/8*n - 3.0/8*n2)*eps**2 \
+        - (1.0/16 + 3.0/16*n + 1.0/16*n2)*eps**3 - (3.0/64 + 1.0/32*n)*eps**4 \
+        - 3.0/128*eps**5
+    C3 = [(1.0/4 - n/4)*eps + (1.0/8 - n2/8)*eps**2 + (3.0/64 + 3.0*n/64 - n2/64)*eps**3 \
+            + (5.0/128 + n/64)*eps**4 + 3.0/128*eps**5,
+          (1.0/16 - 3.0*n/32 + n2/32)*eps**2 + (3.0/64 - n/32 - 3*n2/64)*eps**3 \
+            + (3.0/128 + n/128)*eps**4 + 5.0/256*eps**5,
+          (5.0/192 - 3.0*n/64 + 5.0*n2/192)*eps**3 + (3.0/128 - 5.0*n/192)*eps**4 \
+            + 7.0/512*eps**5,
+          (7.0/512 - 7.0*n/256)*eps**4 + 7.0*eps**5/512,
+          21.0*eps**5/2560]
+    return A3, C3
+
+def _eps(k2):
+    _rad = np.sqrt(1+k2)
+    return (_rad - 1) / (_rad + 1)
+
+def _alpha0_vec(alpha1, beta1):
+    _i = np.sqrt(np.cos(alpha1)**2 + (np.sin(alpha1)*np.sin(beta1))**2)
+    return np.arctan2(np.sin(alpha1)*np.cos(beta1), _i)
+
+def _solve_NEA_vec(alpha0, alpha1, beta1):
+    sigma1 = np.arctan2(np.sin(beta1), np.cos(alpha1)*np.cos(beta1))
+    omega1 = np.arctan2(np.sin(alpha0)*np.sin(sigma1), np.cos(sigma1))
+    return sigma1, omega1
+
+def _solve_NEB_vec(alpha0, alpha1, beta1, beta2):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        inner = np.cos(alpha1)**2*np.cos(beta1)**2 + (np.cos(beta2)**2 -
+                                                      np.cos(beta1)**2)
+        arg = np.sqrt(inner) / np.cos(beta2)
+        valid = (inner >= 0) & (np.abs(arg) <= 1)
+        alpha2 = np.where(valid, np.arccos(np.where(valid, arg, 0.0)),
+                          np.arcsin(np.sin(alpha0) / np.cos(beta2)))
+    sigma2 = np.arctan2(np.sin(beta2), np.cos(alpha2)*np.cos(beta2))
+    omega2 = np.arctan2(np.sin(alpha0)*np.sin(sigma2), np.cos(sigma2))
+    return alpha2, sigma2, omega2
+
+def _canonical_configuration_vec(x1, y1, x2, y2):
+    """ Vectorized `_canonical_configuration` """
+    yflip = np.abs(y1) < np.abs(y2)
+    y1, y2 = np.where(yflip, y2, y1), np.where(yflip, y1, y2)
+
+    ysignswap = y1 > 0
+    y1 = np.where(ysignswap, -y1, y1)
+    y2 = np.where(ysignswap, -y2, y2)
+
+    x2 = reduce_deg(x2-x1)
+    x1 = np.zeros_like(x2)
+
+    xflip = (x2 < 0) | (x2 > 180)
+    x2 = np.where(xflip, -x2, x2)
+    return (yflip, xflip, ysignswap), x1, y1, x2, y2
+
+def _solve_vincenty_vec(a, f, lambda12, phi1, phi2):
+    """ Vectorized `solve_vincenty` """
+    eccn2 = f*(2-f)
+    beta1 = np.arctan((1-f) * np.tan(phi1))
+    beta2 = np.arctan((1-f) * np.tan(phi2))
+    w = np.sqrt(1 - eccn2 * (0.5 * (np.cos(beta1) + np.cos(beta2)))**2)
+    omega12 = lambda12 / w
+
+    z1_r = np.cos(beta1)*np.sin(beta2) - np.sin(beta1)*np.cos(beta2)*np.cos(omega12)
+    z1_i = np.cos(beta2)*np.sin(omega12)
+    z1 = np.sqrt(z1_r**2 + z1_i**2)
+    sigma12 = np.arctan2(z1, np.sin(beta1)*np.sin(beta2) +
+                             np.cos(beta1)*np.cos(beta2)*np.cos(omega12))
+    z2_r = -np.sin(beta1)*np.cos(beta2) + np.cos(beta1)*np.sin(beta2)*np.cos(omega12)
+    z2_i = np.cos(beta1)*np.sin(omega12)
+
+    alpha1 = np.arctan2(z1_i, z1_r)
+    alpha2 = np.arctan2(z2_i, z2_r)
+    s12 = a*w*sigma12
+    return alpha1, alpha2, s12
+
+def _ellipsoidal_forward_vec(a, b, x, y, azimuth, distance):
+    """ Vectorized `ellipsoidal_forward` """
+    x, y, azimuth, distance = np.broadcast_arrays(
+            *[np.asarray(v, dtype=np.float64) for v in (x, y, azimuth, distance)])
+    f = (a-b) / a
+
+    phi1 = pi*y/180.0
+    alpha1 = pi*azimuth/180.0
+
+    beta1 = np.arctan((1-f)*np.tan(phi1))
+    alpha0 = _alpha0_vec(alpha1, beta1)
+    sigma1, omega1 = _solve_NEA_vec(alpha0, alpha1, beta1)
+
+    eccn2 = (f*(2-f))
+    second_eccn2 = eccn2 / (1-eccn2)
+    k2 = second_eccn2*np.cos(alpha0)**2
+    eps = _eps(k2)
+    A1, C1 = _A1C1(eps)
+
+    I1 = A1 * (sigma1 + _series(C1, sigma1))
+    s1 = I1 * b
+    s2 = s1 + distance
+    tau2 = s2 / (b*A1)
+
+    C1p = [eps/2 - 9.0/32*eps**3 + 205.0/1536*eps**5,
+           5.0/16*eps**2 - 37.0/96*eps**4 + 1335.0/4096*eps**6,
+           29.0/96*eps**3 - 75.0/128*eps**5,
+           539.0/1536*eps**4 - 2391.0/2560*eps**6,
+           3467.0/7680*eps**5,
+           38081.0/61440*eps**6]
+
+    sigma2 = tau2 + _series(C1p, tau2)
+
+    alpha2 = np.arctan2(np.sin(alpha0), np.cos(alpha0)*np.cos(sigma2))
+    _j = np.sqrt((np.cos(alpha0)*np.cos(sigma2))**2 + np.sin(alpha0)**2)
+    beta2 = np.arctan2(np.cos(alpha0)*np.sin(sigma2), _j)
+    omega2 = np.arctan2(np.sin(alpha0)*np.sin(sigma2), np.cos(sigma2))
+
+    A3, C3 = _A3C3(eps, f / (2.0-f))
+    I3s1 = A3 * (sigma1 + _series(C3, sigma1))
+    I3s2 = A3 * (sigma2 + _series(C3, sigma2))
+
+    lambda1 = omega1 - f*np.sin(alpha0)*I3s1
+    lambda2 = omega2 - f*np.sin(alpha0)*I3s2
+    lambda12 = lambda2 - lambda1
+
+    phi2 = np.arctan(np.tan(beta2) / (1-f))
+    x2 = x + lambda12*180.0/pi
+    x2 = np.where(x2 >= 180.0, x2-360.0, x2)
+    y2 = phi2*180.0/pi
+    backaz = (alpha2+pi)*180/pi
+    x2 = (x2+180) % 360 - 180
+    backaz = (backaz+180) % 360 - 180
+    return x2, y2, backaz
+
+def _ellipsoidal_inverse_vec(a, b, x1, y1, x2, y2, tol=None, maxiter=100):
+    """ Vectorized `ellipsoidal_inverse`. The Newton iteration proceeds for
+    each geodesic until it converges, so that the cost of each iteration
+    decreases as geodesics are solved. """
+    if tol is None:
+        tol = 1e-12
+    x1, y1, x2, y2 = np.broadcast_arrays(
+            *[np.asarray(v, dtype=np.float64) for v in (x1, y1, x2, y2)])
+    shape = x1.shape
+    x1, y1, x2, y2 = [v.ravel() for v in (x1, y1, x2, y2)]
+
+    az = np.empty(x1.shape)
+    backaz = np.empty(x1.shape)
+    s12 = np.empty(x1.shape)
+
+    # Equatorial case
+    equatorial = (y1 == 0) & (y2 == 0)
+    diff = (x2-x1 + 180) % 360 - 180
+    az[equatorial] = np.where(diff[equatorial] < 0, -90.0, 90.0)
+    backaz[equatorial] = -az[equatorial]
+    s12[equatorial] = 2 * pi * a * np.abs(x1-x2)[equatorial]/360.0
+
+    general = ~equatorial
+    x1, y1, x2, y2 = x1[general], y1[general], x2[general], y2[general]
+    (yflip, xflip, ysignswap), x1, y1, x2, y2 = \
+            _canonical_configuration_vec(x1, y1, x2, y2)
+
+    phi1 = y1*pi/180.0
+    phi2 = y2*pi/180.0
+    lambda12 = (x2-x1)*pi/180.0
+    f = (a-b) / a
+    n = f/(2-f)
+
+    beta1 = np.arctan((1-f)*np.tan(phi1))
+    beta2 = np.arctan((1-f)*np.tan(phi2))
+
+    eccn2 = f*(2-f)
+    second_eccn2 = eccn2 / (1-eccn2)
+
+    alpha0 = np.zeros_like(phi1)
+    alpha1 = np.zeros_like(phi1)
+    alpha2 = np.zeros_like(phi1)
+    sigma1 = np.zeros_like(phi1)
+    sigma2 = np.zeros_like(phi1)
+
+    # Meridional case 1
+    meridional1 = x1 == x2
+    if meridional1.any():
+        m = meridional1
+        alpha0[m] = _alpha0_vec(alpha1[m], beta1[m])
+        sigma1[m], _ = _solve_NEA_vec(alpha0[m], alpha1[m], beta1[m])
+        _, sigma2[m], _ = _solve_NEB_vec(alpha0[m], alpha1[m], beta1[m], beta2[m])
+
+    # Meridional case 2
+    meridional2 = ~meridional1 & (np.abs(lambda12 % (2*pi) - pi) < 1e-12)
+    if meridional2.any():
+        m = meridional2
+        north = y1 + y2 > 0
+        alpha0[m] = alpha1[m] = np.where(north[m], 0.0, pi)
+        alpha2[m] = np.where(north[m], pi, 0.0)
+        sigma1[m], _ = _solve_NEA_vec(alpha0[m], alpha1[m], beta1[m])
+        _, sigma2[m], _ = _solve_NEB_vec(alpha0[m], alpha1[m], beta1[m], beta2[m])
+
+    # Newton iteration
+    newton = ~(meridional1 | meridional2)
+    antipodal = newton & ~((np.abs(lambda12-pi) > 0.0087) &
+                           (np.abs(phi1+phi2) > 0.0087))
+    alpha1[newton], _, _ = _solve_vincenty_vec(a, f, lambda12[newton],
+                                               phi1[newton], phi2[newton])
+    for i in np.nonzero(antipodal)[0]:
+        # failures propagate, as in the scalar solution
+        alpha1[i] = solve_astroid(a, f, lambda12[i], phi1[i], phi2[i])
+
+    active = np.nonzero(newton)[0]
+    niter = 0
+    while len(active) != 0 and niter != maxiter:
+        _alpha1 = alpha1[active]
+        _beta1 = beta1[active]
+        _beta2 = beta2[active]
+
+        # Solve triangles
+        _alpha0 = _alpha0_vec(_alpha1, _beta1)
+        _sigma1, _omega1 = _solve_NEA_vec(_alpha0, _alpha1, _beta1)
+        _alpha2, _sigma2, _omega2 = _solve_NEB_vec(_alpha0, _alpha1, _beta1, _beta2)
+        alpha0[active] = _alpha0
+        alpha2[active] = _alpha2
+        sigma1[active] = _sigma1
+        sigma2[active] = _sigma2
+
+        # Determine lambda12
+        k2 = second_eccn2 * np.cos(_alpha0)**2
+        eps = _eps(k2)
+        A3, C3 = _A3C3(eps, n)
+        I3s1 = A3 * (_sigma1 + _series(C3, _sigma1))
+        I3s2 = A3 * (_sigma2 + _series(C3, _sigma2))
+
+        lambda1 = _omega1 - f*np.sin(_alpha0)*I3s1
+        lambda2 = _omega2 - f*np.sin(_alpha0)*I3s2
+        dlambda12 = (lambda2 - lambda1) - lambda12[active]
+
+        # Refine alpha1 where not converged
+        refine = np.abs(dlambda12) > tol
+        if refine.any():
+            r = refine
+            eps = eps[r]
+            A1, C1 = _A1C1(eps)
+            A2, C2 = _A2C2(eps)
+            s1, s2 = _sigma1[r], _sigma2[r]
+            Js1 = A1*(s1 + _series(C1, s1)) - A2*(s1 + _series(C2, s1))
+            Js2 = A1*(s2 + _series(C1, s2)) - A2*(s2 + _series(C2, s2))
+
+            m12 = b * (np.sqrt(1 + k2[r]*np.sin(s2)**2) * np.cos(s1)*np.sin(s2) \
+                     - np.sqrt(1 + k2[r]*np.sin(s1)**2) * np.sin(s1)*np.cos(s2) \
+                     - np.cos(s1) * np.cos(s2) * (Js2-Js1))
+            dlambda12_dalpha1 = m12/(a * np.cos(_alpha2[r])*np.cos(_beta2[r]))
+            dalpha1 = -dlambda12[r] / dlambda12_dalpha1
+            alpha1[active[r]] = (_alpha1[r] + dalpha1) % (2*pi)
+
+        active = active[refine]
+        niter += 1
+
+    if len(active) != 0:
+        warnings.warn("Convergence failure for %d geodesics" % len(active),
+                      RuntimeWarning)
+
+    # Determine s12
+    k2 = second_eccn2 * np.cos(alpha0)**2
+    eps = _eps(k2)
+    A1, C1 = _A1C1(eps)
+    I1s1 = A1 * (sigma1 + _series(C1, sigma1))
+    I1s2 = A1 * (sigma2 + _series(C1, sigma2))
+
+    alpha1 = np.where(xflip, -alpha1, alpha1)
+    alpha2 = np.where(xflip, -alpha2, alpha2)
+    alpha1, alpha2 = (np.where(yflip, pi-alpha2, alpha1),
+                      np.where(yflip, pi-alpha1, alpha2))
+    alpha1 = np.where(ysignswap, pi-alpha1, alpha1)
+    alpha2 = np.where(ysignswap, pi-alpha2, alpha2)
+
+    az[general] = (alpha1*180/pi + 180) % 360 - 180
+    backaz[general] = ((alpha2+pi)*180/pi + 180) % 360 - 180
+    s12[general] = I1s2*b - I1s1*b
+    return az.reshape(shape), backaz.reshape(shape), s12.reshape(shape)
+
+def _ellipsoidal_area_vec(a, b, x1, y1, x2, y2):
+    """ Vectorized `ellipsoidal_area` """
+    x1, y1, x2, y2 = np.broadcast_arrays(
+            *[np.asarray(v, dtype=np.float64) for v in (x1, y1, x2, y2)])
+    reverse = np.where(x2 < x1, -1, 1)
+    _, x1, y1, x2, y2 = _canonical_configuration_vec(x1, y1, x2, y2)
+    phi1 = y1*pi/180.0
+    phi2 = y2*pi/180.0
+    lambda12 = (x2-x1)*pi/180.0
+
+    az, baz, _ = _ellipsoidal_inverse_vec(a, b, x1, y1, x2, y2)
+    alpha1 = az * pi/180
+    alpha2 = (baz-pi) * pi/180
+
+    f = (a-b)/a
+    e2 = f*(2-f)
+    ep2 = e2/(1-e2)
+    e = sqrt(e2)
+
+    # Authalic radius
+    c = sqrt(a**2/2 + b**2/2*atanh(e)/e)
+
+    beta1 = np.arctan((1-f)*np.tan(phi1))
+    beta2 = np.arctan((1-f)*np.tan(phi2))
+
+    alpha0 = _alpha0_vec(alpha1, beta1)
+    sigma1, omega1 = _solve_NEA_vec(alpha0, alpha1, beta1)
+    _, sigma2, omega2 = _solve_NEB_vec(alpha0, alpha1, beta1, beta2)
+    omega12 = omega2 - omega1
+
+    # Bessel identity for alpha2 - alpha1
+    alpha12 = 2*np.arctan(np.sin(0.5*beta1+0.5*beta2)/np.cos(0.5*beta2-0.5*beta1) \
+            * np.tan(0.5*omega12))
+    sph_term = c**2 * alpha12
+
+    k2 = ep2*np.cos(alpha0)**2
+    Cs = _C4(ep2, k2)
+    I4s1 = sum(c_*np.cos((2*i+1)*sigma1) for i, c_ in enumerate(Cs))
+    I4s2 = sum(c_*np.cos((2*i+1)*sigma2) for i, c_ in enumerate(Cs))
+
+    S12 = sph_term + e**2*a**2 * np.cos(alpha0)*np.sin(alpha0) * (I4s2-I4s1)
+    return reverse * S12
 
 ###### Root-finding ######
 
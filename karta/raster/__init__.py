@@ -11,8 +11,8 @@ numbers.Integral.register(numpy.integer)
 from . import grid
 from . import misc
 
-from .grid import RegularGrid, merge, gridpoints, mask_poly
-from .band import SimpleBand, CompressedBand
+from .grid import RegularGrid, merge, gridpoints, mask_poly, rasterize
+from .band import SimpleBand, CompressedBand, MmapBand, ChunkCache
 from .read import read_aai, read_geotiff, read_gtiff, from_geotiffs
 from .misc import (normed_potential_vectors,
                    slope, aspect, gradient, divergence, hillshade)
@@ -1,10 +1,13 @@
 """ IO interface to GeoTiffs using GDAL. """
 
+import itertools
 import struct
 import sys
 from math import ceil
+from numbers import Integral
 import numpy as np
-from .band import CompressedBand
+from multiprocessing.pool import ThreadPool
+from .band import CompressedBand, ChunkCache, ChunkStats
 from .. import errors
 
 import osgeo.gdal
@@ -14,39 +17,162 @@ osgeo.gdal.UseExceptions()
 
 ALL = -1
 
+# Byte budget of the block cache created for each GdalFileBand
+BLOCK_CACHE_BYTES_DEFAULT = 32*1024*1024
+
 class GdalFileBand(object):
-    """ Read-only raster Band interface the reads data from a disk-bound
+    """ Raster Band interface that reads and writes data from a disk-bound
     datasource.
+
+    Reads are aligned to the native block size of the datasource, and recently
+    read blocks are kept in a ChunkCache. Written blocks are buffered in memory
+    and written to the datasource by `flush()` or `close()`, or when the
+    buffered blocks exceed the cache byte budget.
     """
-    def __init__(self, band, dataset):
+    _cachekeys = itertools.count()
+
+    def __init__(self, band, dataset, update=False, cache=None):
         """
         Parameters
         ----------
         band : osgeo.gdal.Band
         dataset : osgeo.gdal.Dataset
+        update : bool, optional
+            whether *dataset* was opened for writing (default False)
+        cache : ChunkCache or int, optional
+            cache for blocks read from the datasource. An integer creates a
+            private cache with that byte budget. If None (default), a private
+            cache of BLOCK_CACHE_BYTES_DEFAULT bytes is created.
         """
         self.gdalband = band
         self.dataset = dataset
+        self.update = update
+
+        if cache is None:
+            cache = ChunkCache(BLOCK_CACHE_BYTES_DEFAULT)
+        elif isinstance(cache, Integral):
+            cache = ChunkCache(cache)
+        self._cache = cache
+        self._cachekey = next(self._cachekeys)
+
+        # Modified blocks awaiting a flush, keyed by (block row, block column)
+        self._dirty = {}
+        self._dirtybytes = 0
+
+        bx, by = band.GetBlockSize()
+        self._blocksize = (by, bx)
+
+        # statistics are computed from the datasource when first requested
+        self.chunkstats = ChunkStats(self.size, self._blocksize, self.dtype)
         return
 
     def __del__(self):
-        self.dataset = None
-        self.gdalband = None
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _blocks(self, r0, c0, nr, nc):
+        """ Return a generator of tuples identifying the datasource blocks
+        covering a region in file (top-down) row order. The tuples contain
+        (block_row, block_col, ystart, yend, xstart, xend) for each block. """
+        by, bx = self._blocksize
+        ny, nx = self.size
+        for bi in range(r0 // by, (r0+nr-1) // by + 1):
+            for bj in range(c0 // bx, (c0+nc-1) // bx + 1):
+                yield (bi, bj, bi*by, min((bi+1)*by, ny),
+                       bj*bx, min((bj+1)*bx, nx))
+
+    def _readblock(self, bi, bj):
+        """ Return a datasource block in file (top-down) row order. """
+        block = self._dirty.get((bi, bj), None)
+        if block is not None:
+            return block
+
+        key = (self._cachekey, bi, bj)
+        block = self._cache.get(key)
+        if block is None:
+            by, bx = self._blocksize
+            ny, nx = self.size
+            x0 = bj*bx
+            y0 = bi*by
+            block = self.gdalband.ReadAsArray(x0, y0, min(bx, nx-x0),
+                                              min(by, ny-y0))
+            if block is None:
+                raise IOError("failure reading block from GDAL backend")
+            block.flags.writeable = False
+            self._cache.put(key, block)
+        return block
 
     def getblock(self, yoff, xoff, ny, nx):
-        # Note that GDAL uses the alternative x,y convention
+        # Note that GDAL uses the alternative x,y convention, and counts rows
+        # from the top of the raster
         grid_ny, grid_nx = self.size
-        chunk = self.gdalband.ReadAsArray(xoff, grid_ny - yoff - ny, nx, ny)
-        if chunk is None:
-            raise IOError("failure reading slice from GDAL backend")
-        return chunk[::-1]
+        r0 = grid_ny - yoff - ny
+        result = np.empty((ny, nx), dtype=self.dtype)
+        for bi, bj, yst, yen, xst, xen in self._blocks(r0, xoff, ny, nx):
+            block = self._readblock(bi, bj)
+            y0, y1 = max(r0, yst), min(r0+ny, yen)
+            x0, x1 = max(xoff, xst), min(xoff+nx, xen)
+            result[y0-r0:y1-r0, x0-xoff:x1-xoff] = \
+                    block[y0-yst:y1-yst, x0-xst:x1-xst]
+        return result[::-1]
 
     def setblock(self, yoff, xoff, array):
-        raise NotImplementedError()
+        if not self.update:
+            raise IOError("GDAL datasource opened read-only")
+        grid_ny, grid_nx = self.size
+        ny, nx = array.shape
+        r0 = grid_ny - yoff - ny
+        array = array[::-1]
+        for bi, bj, yst, yen, xst, xen in self._blocks(r0, xoff, ny, nx):
+            y0, y1 = max(r0, yst), min(r0+ny, yen)
+            x0, x1 = max(xoff, xst), min(xoff+nx, xen)
+
+            block = self._dirty.get((bi, bj), None)
+            if block is None:
+                if (y0, y1, x0, x1) == (yst, yen, xst, xen):
+                    block = np.empty((yen-yst, xen-xst), dtype=self.dtype)
+                else:
+                    block = self._readblock(bi, bj).copy()
+                self._cache.invalidate((self._cachekey, bi, bj))
+                self._dirty[(bi, bj)] = block
+                self._dirtybytes += block.nbytes
+
+            block[y0-yst:y1-yst, x0-xst:x1-xst] = \
+                    array[y0-r0:y1-r0, x0-xoff:x1-xoff]
+
+        self.chunkstats.invalidate_window(yoff, xoff, ny, nx)
+        if self._dirtybytes > self._cache.maxbytes:
+            self.flush()
+        return
+
+    def flush(self):
+        """ Write buffered blocks to the datasource file. """
+        by, bx = self._blocksize
+        for (bi, bj), block in self._dirty.items():
+            self.gdalband.WriteArray(block, bj*bx, bi*by)
+            block.flags.writeable = False
+            self._cache.put((self._cachekey, bi, bj), block)
+        self._dirty = {}
+        self._dirtybytes = 0
+        # flushing the dataset also writes GDAL's cached blocks to the file
+        self.dataset.FlushCache()
+        return
+
+    def close(self):
+        """ Flush buffered blocks and release the datasource. """
+        if self.gdalband is not None and len(self._dirty) != 0:
+            self.flush()
+        self._cache.clear()
+        self.gdalband = None
+        self.dataset = None
+        return
 
     def __iter__(self):
+        nx = self.size[1]
         for i in range(self.dataset.RasterYSize):
-            yield self[i,:]
+            yield self.getblock(i, 0, 1, nx)
 
     @property
     def size(self):
@@ -111,7 +237,7 @@ def gdal_type(dtype):
     else:
         raise TypeError("GDAL equivalent to type {0} unknown".format(dtype))
 
-def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand):
+def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand, update=False):
     """ Read a GeoTiff file and return a numpy array and a dictionary of header
     information.
 
@@ -125,11 +251,17 @@ def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand):
         band number (1...)
     bandclass : karta.raster.band class
         if *in_memory* is `False`, use this class for band storage
+    update : bool, optional
+        if *in_memory* is `False`, open the datasource for writing (default
+        False). Changes are written when bands are flushed or closed.
 
     Returns an band object and a dictionary of metadata
     """
+    if update and in_memory:
+        raise ValueError("update requires in_memory to be False")
+
     hdr = dict()
-    dataset = osgeo.gdal.Open(fnm, gc.GA_ReadOnly)
+    dataset = osgeo.gdal.Open(fnm, gc.GA_Update if update else gc.GA_ReadOnly)
 
     if ibands == ALL:
         ibands = list(range(1, dataset.RasterCount+1))
@@ -180,7 +312,7 @@ def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand):
                     raise IOError("error reading GDAL band {}".format(i+1))
                 bands[i].setblock(0, 0, _arr.squeeze()[::-1])
         else:
-            bands = [GdalFileBand(rb, dataset) for rb in rasterbands]
+            bands = [GdalFileBand(rb, dataset, update=update) for rb in rasterbands]
 
     finally:
         if in_memory:
@@ -194,9 +326,87 @@ def srs_from_crs(crs):
     srs.ImportFromProj4(proj4)
     return srs
 
-def write(fnm, grid, compress=None, tiled=False, **kw):
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+def _lcm(*args):
+    out = 1
+    for a in args:
+        out = out * a // _gcd(out, a)
+    return out
+
+def _downsample(array, factor, method, nodata):
+    """ Reduce the resolution of *array* by an integer *factor*. Partial cells
+    at the trailing edges are retained, so the output has shape
+    ``ceil(ny/factor), ceil(nx/factor)``. The "nearest" method takes the
+    centre cell of each block, as GDAL's NEAREST overviews do.
+
+    Parameters
+    ----------
+    array : ndarray
+    factor : int
+    method : str
+        "nearest", "average", or "mode"
+    nodata : number
+        value excluded from averages and modes
+    """
+    if method == "nearest":
+        ny, nx = array.shape
+        iy = np.minimum(np.arange(0, ny, factor) + factor//2, ny-1)
+        ix = np.minimum(np.arange(0, nx, factor) + factor//2, nx-1)
+        return array[np.ix_(iy, ix)]
+    elif method == "average":
+        ny, nx = array.shape
+        my = -(-ny // factor)
+        mx = -(-nx // factor)
+        padded = np.full((my*factor, mx*factor), np.nan, dtype=np.float64)
+        padded[:ny, :nx] = array
+        if not np.isnan(nodata):
+            padded[padded == nodata] = np.nan
+        blocks = padded.reshape(my, factor, mx, factor)
+        counts = np.sum(~np.isnan(blocks), axis=(1, 3))
+        sums = np.nansum(blocks, axis=(1, 3))
+        out = np.full((my, mx), nodata, dtype=np.float64)
+        valid = counts != 0
+        out[valid] = sums[valid] / counts[valid]
+        if np.issubdtype(array.dtype, np.integer):
+            out = np.round(out)
+        return out.astype(array.dtype)
+    elif method == "mode":
+        ny, nx = array.shape
+        my = -(-ny // factor)
+        mx = -(-nx // factor)
+        padded = np.full((my*factor, mx*factor), np.nan, dtype=np.float64)
+        padded[:ny, :nx] = array
+        if not np.isnan(nodata):
+            padded[padded == nodata] = np.nan
+        blocks = padded.reshape(my, factor, mx, factor).transpose(0, 2, 1, 3)
+        blocks = np.sort(blocks.reshape(my, mx, factor*factor), axis=-1)
+        # length of the run of equal values ending at each position; NaNs
+        # sort last and have zero length, and ties go to the smallest value
+        valid = ~np.isnan(blocks)
+        runs = valid.astype(np.intp)
+        for k in range(1, factor*factor):
+            same = blocks[:,:,k] == blocks[:,:,k-1]
+            runs[:,:,k] += same * runs[:,:,k-1]
+        imax = np.argmax(runs, axis=-1)[:,:,np.newaxis]
+        out = np.take_along_axis(blocks, imax, axis=-1)[:,:,0]
+        out[~valid[:,:,0]] = nodata
+        return out.astype(array.dtype)
+    else:
+        raise ValueError("overview method '{0}' not available".format(method))
+
+def write(fnm, grid, compress=None, tiled=False, overviews=None,
+          overview_method="average", nthreads=1, max_memory=64*1024*1024,
+          **kw):
     """ Write a grid-like object with the GTiff driver.
 
+    Data are streamed from the grid bands in windows aligned with the blocks
+    of the output file, so that at most about *max_memory* bytes per band are
+    held in memory at once.
+
     Parameters
     ----------
     fnm : string
@@ -208,6 +418,17 @@ def write(fnm, grid, compress=None, tiled=False, **kw):
         'DEFLATE', and 'LZMA' supported.
     tiled : bool, optional
         whether to write a tiled dataset (default False)
+    overviews : list of ints, optional
+        decimation factors of internal overviews to compute while writing,
+        e.g. [2, 4, 8]
+    overview_method : str, optional
+        "average" (default) or "nearest"
+    nthreads : int, optional
+        number of threads used to read windows from the grid bands
+        concurrently (default 1). Writing to the GTiff is always serial.
+    max_memory : int, optional
+        approximate limit on the size in bytes of each band window (default
+        64 MiB). At least one output block is always read at a time.
 
     Additional keyword arguments passed directly to GDAL driver as creation
     options.
@@ -232,20 +453,95 @@ def write(fnm, grid, compress=None, tiled=False, **kw):
     for k, v in kw.items():
         co.append("{0}={1}".format(k,v))
 
+    if overviews is None:
+        overviews = []
+    overviews = sorted(set(int(f) for f in overviews))
+    if overview_method not in ("average", "nearest"):
+        raise ValueError("overview method '{0}' not available".format(overview_method))
+
     driver = osgeo.gdal.GetDriverByName("GTiff")
     ny, nx = grid.size
-    dataset = driver.Create(fnm, nx, ny, len(grid.bands), gdal_type(grid.values.dtype), co)
+    dtype = grid.values.dtype
+    dataset = driver.Create(fnm, nx, ny, len(grid.bands), gdal_type(dtype), co)
     t = grid.transform
     dataset.SetGeoTransform([t[0] + ny*t[4], t[2], -t[4],
                              t[1] + ny*t[3], t[5], -t[3]])
     srs = srs_from_crs(grid.crs)
     dataset.SetProjection(srs.ExportToWkt())
+
+    if len(overviews) != 0:
+        # create empty overview levels, which are filled while streaming
+        dataset.BuildOverviews("NONE", overviews)
+
+    # overview bands of each output band, keyed by factor and identified by
+    # their size, since GDAL may reorder the levels
+    gdalbands = []
+    ovbands = []
     for i, _ in enumerate(grid.bands):
         band = dataset.GetRasterBand(i+1)
         band.SetNoDataValue(grid.nodata)
-        band.WriteArray(grid[::-1,:,i])
+        levels = [band.GetOverview(j) for j in range(band.GetOverviewCount())]
+        bandovs = {}
+        for factor in overviews:
+            size = (-(-ny // factor), -(-nx // factor))
+            for ovband in levels:
+                if (ovband.YSize, ovband.XSize) == size:
+                    ovband.SetNoDataValue(grid.nodata)
+                    bandovs[factor] = ovband
+                    break
+            else:
+                raise IOError("GDAL did not create an overview "
+                              "with factor {0}".format(factor))
+        gdalbands.append(band)
+        ovbands.append(bandovs)
+
+    # Choose a window that is a multiple of the file block size and of every
+    # overview factor, and fits within max_memory when possible
+    bx, by = gdalbands[0].GetBlockSize()
+    itemsize = np.dtype(dtype).itemsize
+    wy = _lcm(by, *overviews)
+    wx = _lcm(bx, *overviews)
+    if wx < nx:
+        nwx = max(1, max_memory // (wy * wx * itemsize))
+        wx = min(nx, wx*nwx)
+    else:
+        wx = nx
+    nwy = max(1, max_memory // (wy * wx * itemsize))
+    wy = wy*nwy
+
+    # Band reads use a private pool, because bands such as CompressedBand
+    # may themselves map over the shared pools
+    if nthreads > 1 and len(grid.bands) > 1:
+        pool = ThreadPool(nthreads)
+        mapper = pool.map
+    else:
+        pool = None
+        mapper = lambda f, seq: [f(a) for a in seq]
+
+    try:
+        # Windows are in file (top-down) row order
+        for r0 in range(0, ny, wy):
+            r1 = min(r0+wy, ny)
+            for c0 in range(0, nx, wx):
+                c1 = min(c0+wx, nx)
+                windows = mapper(lambda b: b.getblock(ny-r1, c0, r1-r0, c1-c0)[::-1],
+                                 grid.bands)
+                for band, bandovs, window in zip(gdalbands, ovbands, windows):
+                    band.WriteArray(window, c0, r0)
+                    for factor in overviews:
+                        ovband = bandovs[factor]
+                        ov = _downsample(window, factor, overview_method, grid.nodata)
+                        oy = r0 // factor
+                        ox = c0 // factor
+                        ov = ov[:ovband.YSize-oy, :ovband.XSize-ox]
+                        ovband.WriteArray(ov, ox, oy)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     band = None
+    gdalbands = None
+    ovbands = None
     dataset = None
     return grid
-
@@ -10,6 +10,12 @@ Overview
 
 `CompressedBand` uses blosc compression to reduce in-memory footprint
 
+`ChunkCache` holds recently decompressed `CompressedBand` chunks
+
+`ChunkStats` holds summary statistics of the chunks of a band
+
+`MmapBand` uses a memory-mapped file for storage larger than memory
+
 Implementation
 --------------
 
@@ -21,6 +27,8 @@ Bands are expected to implement the following methods:
 Attributes:
     - `dtype`
     - `size`
+    - `chunkstats` (optional), a `ChunkStats` instance kept current by
+      `setblock`
 
 The following methods are deprecated:
     - `__getitem__(self, key)`, accepting as *key* any of
@@ -32,11 +40,62 @@ The following methods are deprecated:
       possibilities as __getitem__
 """
 
+import copy
+import itertools
+import os
+import tempfile
+import threading
 import blosc
 import numpy as np
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from numbers import Real, Integral
 from math import ceil
 
+# ChunkCache instance used by CompressedBands constructed without an explicit
+# *cache* argument. Assigning a ChunkCache here shares a single process-wide
+# cache between all new bands.
+CHUNK_CACHE_DEFAULT = None
+
+# Chunk size of the statistics kept by bands that are not stored in chunks
+STATS_CHUNKSIZE_DEFAULT = (256, 256)
+
+# Number of worker threads used by CompressedBands constructed without an
+# explicit *nthreads* argument to compress and decompress chunks. blosc
+# releases the GIL, so chunks are processed concurrently.
+NTHREADS_DEFAULT = 1
+
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+# Marks the worker threads of shared pools
+_worker_state = threading.local()
+
+def _mark_worker():
+    _worker_state.in_pool = True
+
+def _in_pool_worker():
+    """ Return whether the current thread is a worker of a shared pool """
+    return getattr(_worker_state, "in_pool", False)
+
+def _thread_pool(nthreads):
+    """ Return a shared ThreadPool with *nthreads* workers """
+    with _thread_pools_lock:
+        pool = _thread_pools.get(nthreads, None)
+        if pool is None:
+            pool = ThreadPool(nthreads, initializer=_mark_worker)
+            _thread_pools[nthreads] = pool
+    return pool
+
+def _pool_map(nthreads, func, seq):
+    """ Return ``[func(a) for a in seq]``, computed on a shared pool of
+    *nthreads* workers. Calls made from a shared pool worker run serially,
+    because a worker waiting on a pool that it belongs to can deadlock. """
+    seq = list(seq)
+    if nthreads > 1 and len(seq) > 1 and not _in_pool_worker():
+        return _thread_pool(nthreads).map(func, seq)
+    return [func(a) for a in seq]
+
 class BandIndexer(object):
 
     def __init__(self, bands):
@@ -191,7 +250,7 @@ class BandIndexer(object):
             else:
                 mask_ = mask
 
-            tmp = band.getblock(0, 0, *band.size)
+            tmp = band.getblock(0, 0, *band.size).copy()
             if isinstance(value, Real) or (value.ndim == 1):
                 tmp[mask_] = value
             else:
@@ -232,21 +291,458 @@ class SimpleBand(object):
         else:
             self._array = np.full(size, initval, dtype=dtype)
         self.dtype = dtype
+        self.chunkstats = ChunkStats(size, STATS_CHUNKSIZE_DEFAULT, dtype,
+                                     initval=initval)
+
+    def getblock(self, yoff, xoff, ny, nx):
+        # read-only, so that writes go through setblock and keep the chunk
+        # statistics current
+        block = self._array[yoff:yoff+ny, xoff:xoff+nx]
+        block.flags.writeable = False
+        return block
+
+    def setblock(self, yoff, xoff, array):
+        (ny, nx) = array.shape
+        self._array[yoff:yoff+ny, xoff:xoff+nx] = array
+        self.chunkstats.invalidate_window(yoff, xoff, ny, nx)
+        return
+
+class MmapBand(object):
+    """ MmapBand stores values in a memory-mapped file on local disk, in
+    row-major order. Blocks are returned as read-only views into the mapping, so
+    reads are zero-copy and the operating system page cache is reused. """
+
+    def __init__(self, size, dtype, initval=None, filename=None, mode="w+",
+                 offset=0):
+        """ Initialize a MmapBand instance.
+
+        Parameters
+        ----------
+        size : tuple of two ints
+            size of band in pixels
+        dtype : type
+            data type of pixel values
+        initval : value, optional
+            if set, the entire band is initialized with this value. Ignored
+            when an existing file is opened.
+        filename : str, optional
+            path of the backing file. If None (default), an anonymous temporary
+            file is created in `tempfile.gettempdir()`, and removed when the
+            band is garbage collected.
+        mode : str, optional
+            "w+" (default) creates or overwrites *filename*, "r+" opens an
+            existing file for reading and writing, and "r" opens an existing
+            file read-only
+        offset : int, optional
+            byte offset of the band data within *filename* (default 0)
+        """
+        assert len(size) == 2
+        self.size = tuple(size)
+        self.dtype = dtype
+        self.filename = filename
+        self.mode = mode
+
+        if filename is None:
+            if mode != "w+":
+                raise ValueError("a filename is required to open an existing "
+                                 "MmapBand")
+            self._file = tempfile.TemporaryFile()
+            target = self._file
+        else:
+            self._file = None
+            target = filename
+
+        self._array = np.memmap(target, dtype=dtype, mode=mode, offset=offset,
+                                shape=self.size)
+
+        if mode == "w+" and initval is not None and initval != 0:
+            # fill in row strips to avoid allocating a full-size temporary
+            nrows = max(1, (1 << 24) // max(1, self._array.strides[0]))
+            for i in range(0, self.size[0], nrows):
+                self._array[i:i+nrows] = initval
+
+        # new files are zero-filled, and existing files are summarized when
+        # statistics are first requested
+        if mode == "w+":
+            initval = 0 if initval is None else initval
+        else:
+            initval = None
+        self.chunkstats = ChunkStats(self.size, STATS_CHUNKSIZE_DEFAULT, dtype,
+                                     initval=initval)
+        return
+
+    def __deepcopy__(self, memo):
+        # Copies are backed by a new anonymous temporary file
+        new = MmapBand(self.size, self.dtype)
+        memo[id(self)] = new
+        nrows = max(1, (1 << 24) // max(1, self._array.strides[0]))
+        for i in range(0, self.size[0], nrows):
+            new._array[i:i+nrows] = self._array[i:i+nrows]
+        new.chunkstats = copy.deepcopy(self.chunkstats, memo)
+        return new
 
     def getblock(self, yoff, xoff, ny, nx):
-        return self._array[yoff:yoff+ny, xoff:xoff+nx]
+        # read-only, so that writes go through setblock and keep the chunk
+        # statistics current
+        block = self._array[yoff:yoff+ny, xoff:xoff+nx]
+        block.flags.writeable = False
+        return block
 
     def setblock(self, yoff, xoff, array):
         (ny, nx) = array.shape
         self._array[yoff:yoff+ny, xoff:xoff+nx] = array
+        self.chunkstats.invalidate_window(yoff, xoff, ny, nx)
+        return
+
+    def flush(self):
+        """ Write pending changes to disk """
+        if self.mode != "r":
+            self._array.flush()
+        return
+
+class ChunkCache(object):
+    """ Least-recently-used store of decompressed chunks, bounded by a byte
+    budget. A ChunkCache may be private to a single CompressedBand or shared
+    between many bands.
+
+    Attributes
+    ----------
+    maxbytes : int
+        maximum number of bytes of decompressed data held
+    nbytes : int
+        number of bytes of decompressed data currently held
+    hits : int
+        number of lookups satisfied from the cache
+    misses : int
+        number of lookups that required a decompression
+    evictions : int
+        number of chunks dropped to remain within *maxbytes*
+    """
+
+    def __init__(self, maxbytes=64*1024*1024):
+        """ Initialize a ChunkCache instance.
+
+        Parameters
+        ----------
+        maxbytes : int, optional
+            byte budget for decompressed chunks, default 64 MiB
+        """
+        if maxbytes < 0:
+            raise ValueError("maxbytes must be non-negative")
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """ Return the array stored under *key*, or None if absent. """
+        with self._lock:
+            array = self._entries.pop(key, None)
+            if array is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = array
+        return array
+
+    def put(self, key, array):
+        """ Store *array* under *key*, evicting least-recently-used chunks as
+        necessary. Arrays larger than *maxbytes* are not stored. """
+        if array.nbytes > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = array
+            self.nbytes += array.nbytes
+            while self.nbytes > self.maxbytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+        return
+
+    def invalidate(self, key):
+        """ Drop the array stored under *key*, if present. """
+        with self._lock:
+            array = self._entries.pop(key, None)
+            if array is not None:
+                self.nbytes -= array.nbytes
+        return
+
+    def clear(self):
+        """ Drop all stored arrays. Counters are not reset. """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        return
+
+    def reset_counters(self):
+        """ Set hit, miss, and eviction counters to zero. """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    @property
+    def hit_ratio(self):
+        """ Fraction of lookups satisfied from the cache """
+        n = self.hits + self.misses
+        if n == 0:
+            return 0.0
+        return float(self.hits) / n
+
+class ChunkStats(object):
+    """ Summary statistics of the values in each chunk of a band: the minimum,
+    maximum, sum, and count of data values, and the count of nodata values.
+    NaN is always counted as nodata.
+
+    Bands update the statistics of chunks as they are written, or mark them
+    stale, in which case they are recomputed from the band when next needed.
+    Global statistics and checks for data in a window then cost a few
+    operations per chunk rather than reading the band. Chunks are numbered in
+    row-major order.
+
+    Parameters
+    ----------
+    size : tuple of two ints
+        size of band in pixels
+    chunksize : tuple of two ints
+        size of the chunks summarized
+    dtype : type
+        data type of pixel values
+    nodata : value, optional
+        value excluded from statistics (default None)
+    initval : value, optional
+        value of every cell, if known. If None (default), all chunks are
+        stale.
+    """
+
+    def __init__(self, size, chunksize, dtype, nodata=None, initval=None):
+        self.size = tuple(size)
+        self.chunksize = tuple(chunksize)
+        self.dtype = np.dtype(dtype)
+        self.nchunkrows = int(ceil(float(size[0])/float(chunksize[0])))
+        self.nchunkcols = int(ceil(float(size[1])/float(chunksize[1])))
+        nchunks = self.nchunkrows * self.nchunkcols
+
+        self.vmin = np.zeros(nchunks, dtype=self.dtype)
+        self.vmax = np.zeros(nchunks, dtype=self.dtype)
+        self.total = np.zeros(nchunks, dtype=np.float64)
+        self.count = np.zeros(nchunks, dtype=np.int64)
+        self.nodatacount = np.zeros(nchunks, dtype=np.int64)
+        self.current = np.zeros(nchunks, dtype=np.bool_)
+        self._nodata = nodata
+        self._initval = initval
+        self._fill(initval)
+        return
+
+    def __len__(self):
+        return len(self.current)
+
+    @property
+    def nodata(self):
+        return self._nodata
+
+    @nodata.setter
+    def nodata(self, value):
+        """ Change the value excluded from statistics. Unless it is unchanged,
+        all chunks become stale. """
+        unchanged = _same_value(value, self._nodata)
+        if self.dtype.kind in "fc":
+            # NaN is always excluded
+            unchanged |= (_isnan(value) or value is None) and \
+                         (_isnan(self._nodata) or self._nodata is None)
+        self._nodata = value
+        if unchanged:
+            return
+        self.current[:] = False
+        return
+
+    def _isnodata(self, value):
+        return _isnan(value) or \
+                (self._nodata is not None and value == self._nodata)
+
+    def _fill(self, initval):
+        """ Set the statistics of all chunks to those of constant *initval* """
+        if initval is None:
+            self.current[:] = False
+            return
+        cells = self.cellcounts()
+        if self._isnodata(initval):
+            self.total[:] = 0.0
+            self.count[:] = 0
+            self.nodatacount[:] = cells
+        else:
+            self.vmin[:] = initval
+            self.vmax[:] = initval
+            self.total[:] = cells * float(initval)
+            self.count[:] = cells
+            self.nodatacount[:] = 0
+        self.current[:] = True
+        return
+
+    def cellcounts(self):
+        """ Return the number of cells in each chunk """
+        cy, cx = self.chunksize
+        rows = np.minimum(cy, self.size[0] - cy*np.arange(self.nchunkrows))
+        cols = np.minimum(cx, self.size[1] - cx*np.arange(self.nchunkcols))
+        return np.outer(rows, cols).ravel()
+
+    def window(self, index):
+        """ Return the (yoff, xoff, ny, nx) region of chunk *index* """
+        i, j = divmod(index, self.nchunkcols)
+        cy, cx = self.chunksize
+        yoff = i*cy
+        xoff = j*cx
+        return (yoff, xoff, min(cy, self.size[0]-yoff), min(cx, self.size[1]-xoff))
+
+    def indices(self, yoff, xoff, ny, nx):
+        """ Return the indices of chunks overlapping a region """
+        cy, cx = self.chunksize
+        rows = np.arange(max(0, yoff) // cy,
+                         min(self.nchunkrows, -(-(yoff+ny) // cy)))
+        cols = np.arange(max(0, xoff) // cx,
+                         min(self.nchunkcols, -(-(xoff+nx) // cx)))
+        return (rows[:,np.newaxis]*self.nchunkcols + cols).ravel()
+
+    def update(self, index, values):
+        """ Recompute the statistics of chunk *index* from its *values*, which
+        exclude any padding beyond the band edges. """
+        values = np.asarray(values)
+        if self.dtype.kind in "fc":
+            valid = ~np.isnan(values)
+            if self._nodata is not None and not _isnan(self._nodata):
+                valid &= values != self._nodata
+        elif self._nodata is not None and not _isnan(self._nodata):
+            valid = values != self._nodata
+        else:
+            valid = None
+
+        size = values.size
+        n = size if valid is None else int(np.count_nonzero(valid))
+        if n != 0:
+            if n != values.size:
+                values = values[valid]
+            self.vmin[index] = values.min()
+            self.vmax[index] = values.max()
+            self.total[index] = values.sum(dtype=np.float64)
+        else:
+            self.total[index] = 0.0
+        self.count[index] = n
+        self.nodatacount[index] = size - n
+        self.current[index] = True
+        return
+
+    def invalidate(self, indices=None):
+        """ Mark chunks as stale (default all) """
+        if indices is None:
+            self.current[:] = False
+        else:
+            self.current[indices] = False
+        return
+
+    def invalidate_window(self, yoff, xoff, ny, nx):
+        """ Mark the chunks overlapping a region as stale """
+        self.current[self.indices(yoff, xoff, ny, nx)] = False
+        return
+
+    def refresh(self, band, indices=None):
+        """ Recompute stale chunks by reading them from *band* """
+        if indices is None:
+            stale = np.flatnonzero(~self.current)
+        else:
+            indices = np.asarray(indices, dtype=np.intp)
+            stale = indices[~self.current[indices]]
+        for index in stale:
+            self.update(index, band.getblock(*self.window(index)))
         return
 
+    def summary(self, band, indices=None):
+        """ Return statistics of all chunks, or of chunks *indices*.
+
+        Parameters
+        ----------
+        band : band instance
+            band summarized, which is read if any chunks are stale
+        indices : array of ints, optional
+
+        Returns
+        -------
+        tuple
+            (min, max, sum, count, nodata count). The minimum and maximum are
+            None when there are no data values.
+        """
+        self.refresh(band, indices)
+        if indices is None:
+            indices = slice(None)
+        count = self.count[indices]
+        hasdata = count != 0
+        if not hasdata.any():
+            vmin = vmax = None
+        else:
+            vmin = self.vmin[indices][hasdata].min()
+            vmax = self.vmax[indices][hasdata].max()
+        return (vmin, vmax, self.total[indices].sum(), int(count.sum()),
+                int(self.nodatacount[indices].sum()))
+
+    def has_data(self, band, yoff, xoff, ny, nx, exact=True):
+        """ Return whether a region of *band* contains any data values. Only
+        chunks that extend beyond the region and contain both data and nodata
+        are read, unless *exact* is False, in which case such chunks are
+        assumed to contain data in the region. """
+        indices = self.indices(yoff, xoff, ny, nx)
+        self.refresh(band, indices)
+        partial = []
+        for index in indices[self.count[indices] != 0]:
+            cyoff, cxoff, cny, cnx = self.window(index)
+            inside = (cyoff >= yoff) and (cxoff >= xoff) and \
+                     (cyoff+cny <= yoff+ny) and (cxoff+cnx <= xoff+nx)
+            if inside or self.nodatacount[index] == 0 or not exact:
+                return True
+            partial.append((cyoff, cxoff, cny, cnx))
+
+        for cyoff, cxoff, cny, cnx in partial:
+            y0, y1 = max(yoff, cyoff), min(yoff+ny, cyoff+cny)
+            x0, x1 = max(xoff, cxoff), min(xoff+nx, cxoff+cnx)
+            values = band.getblock(y0, x0, y1-y0, x1-x0)
+            invalid = np.isnan(values) if self.dtype.kind in "fc" else \
+                      np.zeros(values.shape, dtype=np.bool_)
+            if self._nodata is not None and not _isnan(self._nodata):
+                invalid |= values == self._nodata
+            if not invalid.all():
+                return True
+        return False
+
+def _isnan(value):
+    try:
+        return bool(np.isnan(value))
+    except TypeError:
+        return False
+
+def _same_value(a, b):
+    if a is None or b is None:
+        return a is b
+    return (a == b) or (_isnan(a) and _isnan(b))
+
 class CompressedBand(object):
     """ CompressedBand is a chunked, blosc-compressed array. """
     CHUNKSET = 1
     CHUNKUNSET = 0
 
-    def __init__(self, size, dtype, chunksize=(256, 256), initval=0):
+    _cachekeys = itertools.count()
+
+    def __init__(self, size, dtype, chunksize=(256, 256), initval=0,
+                 cache=None, nthreads=None):
         """ Initialize a CompressedBand instance.
 
         Parameters
@@ -260,6 +756,13 @@ class CompressedBand(object):
         initval : value, optional
             if set, the entire grid is initialized with this value, which should
             be of *dtype*
+        cache : ChunkCache or int, optional
+            cache for decompressed chunks. An integer creates a private cache
+            with that byte budget. If None (default), CHUNK_CACHE_DEFAULT is
+            used, which disables caching unless it has been assigned.
+        nthreads : int, optional
+            number of threads used to compress and decompress chunks. If None
+            (default), NTHREADS_DEFAULT is used at the time of each operation.
         """
         assert len(size) == 2
         self.size = size
@@ -277,17 +780,58 @@ class CompressedBand(object):
         # 0 => unset
         # 1 => set
         self.chunkstatus = np.zeros(nchunks, dtype=np.int8)
+
+        if cache is None:
+            cache = CHUNK_CACHE_DEFAULT
+        elif isinstance(cache, Integral):
+            cache = ChunkCache(cache)
+        self._cache = cache
+        self._cachekey = next(self._cachekeys)
+        self.nthreads = nthreads
+        self.chunkstats = ChunkStats(size, chunksize, dtype, initval=initval)
         return
 
+    def __deepcopy__(self, memo):
+        # Copies share the cache object, but not cache entries
+        new = type(self).__new__(type(self))
+        memo[id(self)] = new
+        for k, v in self.__dict__.items():
+            if k == "_cache":
+                new._cache = v
+            else:
+                new.__dict__[k] = copy.deepcopy(v, memo)
+        new._cachekey = next(self._cachekeys)
+        return new
+
+    @property
+    def cache(self):
+        """ ChunkCache used by this band, or None """
+        return self._cache
+
     def _store(self, array, index):
         self._data[index] = blosc.compress(array.tostring(),
                                            np.dtype(self.dtype).itemsize)
         self.chunkstatus[index] = self.CHUNKSET
+        if self._cache is not None:
+            self._cache.invalidate((self._cachekey, index))
         return
 
     def _retrieve(self, index):
+        """ Return the decompressed chunk *index*. When the band is cached, the
+        returned array may be shared and is marked read-only. """
+        if self._cache is not None:
+            key = (self._cachekey, index)
+            array = self._cache.get(key)
+            if array is not None:
+                return array
+
         bytestr = blosc.decompress(self._data[index], as_bytearray=True)
-        return np.frombuffer(bytestr, dtype=self.dtype).reshape(self._chunksize)
+        array = np.frombuffer(bytestr, dtype=self.dtype).reshape(self._chunksize)
+
+        if self._cache is not None:
+            array.flags.writeable = False
+            self._cache.put(key, array)
+        return array
 
     def _getchunks(self, yoff, xoff, ny, nx):
         """ Return a generator returning tuples identifying chunks covered by a
@@ -319,17 +863,31 @@ class CompressedBand(object):
 
             i+= 1
 
+    def _nthreads(self):
+        if self.nthreads is None:
+            return NTHREADS_DEFAULT
+        return self.nthreads
+
+    def _map(self, func, chunks):
+        """ Apply *func* to each chunk tuple, in a thread pool if more than one
+        thread is configured. """
+        _pool_map(self._nthreads(), func, chunks)
+        return
+
     def setblock(self, yoff, xoff, array):
         """ Store block of values in *array* starting at offset *yoff*, *xoff*.
         """
         size = array.shape[:2]
         chunksize = self._chunksize
 
-        for i, yst, yen, xst, xen in self._getchunks(yoff, xoff, *size):
+        def setchunk(chunk):
+            i, yst, yen, xst, xen = chunk
 
             # Get from data store
             if self.chunkstatus[i] == self.CHUNKSET:
                 chunkdata = self._retrieve(i)
+                if not chunkdata.flags.writeable:
+                    chunkdata = chunkdata.copy()
             else:
                 chunkdata = np.full(self._chunksize, self._initval, dtype=self.dtype)
 
@@ -349,6 +907,9 @@ class CompressedBand(object):
 
             # Return to data store
             self._store(chunkdata, i)
+            self.chunkstats.update(i, chunkdata[:yen-yst, :xen-xst])
+
+        self._map(setchunk, list(self._getchunks(yoff, xoff, *size)))
         return
 
     def getblock(self, yoff, xoff, ny, nx):
@@ -356,7 +917,9 @@ class CompressedBand(object):
         *xoff*.
         """
         result = np.empty([ny, nx], self.dtype)
-        for i, yst, yen, xst, xen in self._getchunks(yoff, xoff, ny, nx):
+
+        def getchunk(chunk):
+            i, yst, yen, xst, xen = chunk
 
             # Compute the bounds in the output
             oy0 = max(0, yst-yoff)
@@ -378,5 +941,5 @@ class CompressedBand(object):
 
                 result[oy0:oy1, ox0:ox1] = self._retrieve(i)[cy0:cy1, cx0:cx1]
 
+        self._map(getchunk, list(self._getchunks(yoff, xoff, ny, nx)))
         return result
-
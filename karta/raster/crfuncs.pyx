@@ -1,6 +1,9 @@
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
+from libc.math cimport rint, floor, fabs
+from libc.stdlib cimport malloc, realloc, free
 
 DTYPE_float64 = np.float64
 ctypedef np.float64_t DTYPE_float64_t
@@ -32,129 +35,175 @@ def get_positions_vec(tuple T, double[:] x not None, double[:] y not None):
         i += 1
     return I, J
 
-def sample_bilinear_uint(double[:] I not None, double[:] J not None,
-                         np.uint16_t[:,:] Z not None, unsigned int na):
-    cdef int cnt = 0
-    cdef int L = len(I)
-    cdef double i = 0.0, j = 0.0
-    cdef int i0 = 0, i1 = 0, j0 = 0, j1 = 0
-    cdef int m, n
-    m = Z.shape[0]
-    n = Z.shape[1]
-    cdef np.ndarray[np.uint16_t] out = np.empty(L, dtype=np.uint16)
-
-    for cnt in range(L):
-        i = I[cnt]
-        j = J[cnt]
-        if (i % 1 != 0):
-            i0 = int(i // 1.0)
-            i1 = int(i0 + 1)
-        elif (i != 0):
-            i0 = int(i - 1.0)
-            i1 = int(i)
-        else:
-            i0 = int(i)
-            i1 = int(i + 1.0)
-
-        if (j % 1 != 0):
-            j0 = int(j // 1.0)
-            j1 = int(j0 + 1)
-        elif (j != 0):
-            j0 = int(j - 1.0)
-            j1 = int(j)
-        else:
-            j0 = int(j)
-            j1 = int(j + 1.0)
-
-        if i0 >= 0 and i1 < m and j0 >= 0 and j1 < n:
-            out[cnt] = int(float(Z[i0,j0]) * (i1-i) * (j1-j)
-                         + float(Z[i1,j0]) * (i-i0) * (j1-j) \
-                         + float(Z[i0,j1]) * (i1-i) * (j-j0) \
-                         + float(Z[i1,j1]) * (i-i0) * (j-j0))
-        else:
-            out[cnt] = na
-    return out
-
-def sample_bilinear_int(double[:] I not None, double[:] J not None,
-                         np.int32_t[:,:] Z not None, int na):
-    cdef int cnt = 0
-    cdef int L = len(I)
-    cdef double i = 0.0, j = 0.0
-    cdef int i0 = 0, i1 = 0, j0 = 0, j1 = 0
-    cdef int m, n
-    m = Z.shape[0]
-    n = Z.shape[1]
-    cdef np.ndarray[np.int32_t] out = np.empty(L, dtype=np.int32)
-
-    for cnt in range(L):
-        i = I[cnt]
-        j = J[cnt]
-        if (i % 1 != 0):
-            i0 = int(i // 1.0)
-            i1 = int(i0 + 1)
-        elif (i != 0):
-            i0 = int(i - 1.0)
-            i1 = int(i)
-        else:
-            i0 = int(i)
-            i1 = int(i + 1.0)
-
-        if (j % 1 != 0):
-            j0 = int(j // 1.0)
-            j1 = int(j0 + 1)
-        elif (j != 0):
-            j0 = int(j - 1.0)
-            j1 = int(j)
-        else:
-            j0 = int(j)
-            j1 = int(j + 1.0)
-
-        out[cnt] = int(float(Z[i0,j0]) * (i1-i) * (j1-j)
-                     + float(Z[i1,j0]) * (i-i0) * (j1-j) \
-                     + float(Z[i0,j1]) * (i1-i) * (j-j0) \
-                     + float(Z[i1,j1]) * (i-i0) * (j-j0))
-    return out
-
-def sample_bilinear_double(double[:] I not None, double[:] J not None,
-                           np.float64_t[:,:] Z not None, double na):
-    cdef int cnt = 0
-    cdef int L = len(I)
-    cdef double i = 0.0, j = 0.0
-    cdef int i0 = 0, i1 = 0, j0 = 0, j1 = 0
-    cdef int m, n
-    m = Z.shape[0]
-    n = Z.shape[1]
-    cdef np.ndarray[np.float64_t] out = np.empty(L)
-
-    for cnt in range(L):
-        i = I[cnt]
-        j = J[cnt]
-        if (i % 1 != 0):
-            i0 = int(i // 1.0)
-            i1 = int(i0 + 1)
-        elif (i != 0):
-            i0 = int(i - 1.0)
-            i1 = int(i)
-        else:
-            i0 = int(i)
-            i1 = int(i + 1.0)
-
-        if (j % 1 != 0):
-            j0 = int(j // 1.0)
-            j1 = int(j0 + 1)
-        elif (j != 0):
-            j0 = int(j - 1.0)
-            j1 = int(j)
-        else:
-            j0 = int(j)
-            j1 = int(j + 1.0)
+ctypedef fused sample_t:
+    np.uint8_t
+    np.uint16_t
+    np.uint32_t
+    np.uint64_t
+    np.int8_t
+    np.int16_t
+    np.int32_t
+    np.int64_t
+    np.float32_t
+    np.float64_t
+
+cdef inline Py_ssize_t _lower_index(double i) nogil:
+    """ Return the first of the two rows or columns interpolated between.
+    Positions on a cell center use the interval ending at that cell, except for
+    the first. """
+    if i != floor(i):
+        return <Py_ssize_t> floor(i)
+    elif i != 0:
+        return <Py_ssize_t> i - 1
+    return 0
+
+cdef inline double _cubic_weight(double t) nogil:
+    """ Keys cubic convolution kernel with a = -0.5 """
+    t = fabs(t)
+    if t <= 1.0:
+        return (1.5*t - 2.5)*t*t + 1.0
+    elif t < 2.0:
+        return ((-0.5*t + 2.5)*t - 4.0)*t + 2.0
+    return 0.0
+
+cdef inline Py_ssize_t _clamp(Py_ssize_t i, Py_ssize_t n) nogil:
+    if i < 0:
+        return 0
+    elif i >= n:
+        return n - 1
+    return i
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _bilinear_point(const sample_t[:,:,:] Z, double i, double j,
+                                 double nodata, double *out) nogil:
+    """ Interpolate all bands at one position into *out* """
+    cdef Py_ssize_t m = Z.shape[0], n = Z.shape[1], nbands = Z.shape[2]
+    cdef Py_ssize_t k, i0, i1, j0, j1
+    i0 = _lower_index(i)
+    j0 = _lower_index(j)
+    i1 = i0 + 1
+    j1 = j0 + 1
+    if i0 >= 0 and i1 < m and j0 >= 0 and j1 < n:
+        for k in range(nbands):
+            out[k] = <double> Z[i0,j0,k] * (i1-i) * (j1-j) \
+                   + <double> Z[i1,j0,k] * (i-i0) * (j1-j) \
+                   + <double> Z[i0,j1,k] * (i1-i) * (j-j0) \
+                   + <double> Z[i1,j1,k] * (i-i0) * (j-j0)
+    else:
+        for k in range(nbands):
+            out[k] = nodata
 
-        if i0 >= 0 and i1 < m and j0 >= 0 and j1 < n:
-            out[cnt] = Z[i0,j0]*(i1-i)*(j1-j) + Z[i1,j0]*(i-i0)*(j1-j) \
-                     + Z[i0,j1]*(i1-i)*(j-j0) + Z[i1,j1]*(i-i0)*(j-j0)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _bicubic_point(const sample_t[:,:,:] Z, double i, double j,
+                                double nodata, double *out) nogil:
+    """ Interpolate all bands at one position into *out*. The scratch arrays
+    are local so that each prange thread has its own. """
+    cdef Py_ssize_t m = Z.shape[0], n = Z.shape[1], nbands = Z.shape[2]
+    cdef Py_ssize_t k, a, b, i0, j0
+    cdef double wi, acc
+    cdef double wj[4]
+    cdef Py_ssize_t ii[4]
+    cdef Py_ssize_t jj[4]
+    if not (0 <= i <= m-1 and 0 <= j <= n-1):
+        for k in range(nbands):
+            out[k] = nodata
+        return
+    i0 = <Py_ssize_t> floor(i)
+    j0 = <Py_ssize_t> floor(j)
+    for a in range(4):
+        ii[a] = _clamp(i0+a-1, m)
+        jj[a] = _clamp(j0+a-1, n)
+        wj[a] = _cubic_weight(j - (j0+a-1))
+    for k in range(nbands):
+        acc = 0.0
+        for a in range(4):
+            wi = _cubic_weight(i - (i0+a-1))
+            if wi != 0.0:
+                for b in range(4):
+                    acc = acc + wi * wj[b] * <double> Z[ii[a],jj[b],k]
+        out[k] = acc
+    return
+
+_SAMPLE_DTYPES = [np.dtype(t) for t in (np.uint8, np.uint16, np.uint32, np.uint64,
+                                        np.int8, np.int16, np.int32, np.int64,
+                                        np.float32, np.float64)]
+
+cdef tuple _sample_args(I, J, Z):
+    I = np.ascontiguousarray(I, dtype=np.float64).ravel()
+    J = np.ascontiguousarray(J, dtype=np.float64).ravel()
+    if I.shape[0] != J.shape[0]:
+        raise ValueError("I and J must have equal length")
+    Z = np.asarray(Z)
+    if Z.ndim == 2:
+        Z = Z[:,:,np.newaxis]
+    elif Z.ndim != 3:
+        raise ValueError("Z must be an (ny, nx) or (ny, nx, nbands) array")
+    if Z.dtype not in _SAMPLE_DTYPES:
+        raise TypeError("unsupported dtype: {0}".format(Z.dtype))
+    if not Z.dtype.isnative:
+        raise TypeError("Z must have native byte order")
+    return I, J, Z
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _sample(int method, const double[::1] I, const double[::1] J,
+            np.ndarray[sample_t, ndim=3] arr, double nodata, int nthreads):
+    """ Interpolate with method 0 (bilinear) or 1 (bicubic). Cython generates a
+    specialisation for each type of *arr*, and chooses one from its dtype. """
+    # Cython 0.29 cannot dispatch on const fused memoryview arguments, so the
+    # view is taken from a buffer argument, which accepts read-only arrays
+    cdef const sample_t[:,:,:] Z = arr
+    cdef Py_ssize_t cnt, npoints = I.shape[0]
+    result = np.empty((npoints, Z.shape[2]), dtype=np.float64)
+    cdef double[:,::1] out = result
+    if npoints == 0 or Z.shape[2] == 0:
+        return result
+    with nogil:
+        if nthreads > 1:
+            if method == 0:
+                for cnt in prange(npoints, num_threads=nthreads, schedule="static"):
+                    _bilinear_point(Z, I[cnt], J[cnt], nodata, &out[cnt,0])
+            else:
+                for cnt in prange(npoints, num_threads=nthreads, schedule="static"):
+                    _bicubic_point(Z, I[cnt], J[cnt], nodata, &out[cnt,0])
         else:
-            out[cnt] = na
-    return out
+            if method == 0:
+                for cnt in range(npoints):
+                    _bilinear_point(Z, I[cnt], J[cnt], nodata, &out[cnt,0])
+            else:
+                for cnt in range(npoints):
+                    _bicubic_point(Z, I[cnt], J[cnt], nodata, &out[cnt,0])
+    return result
+
+def sample_bilinear(I, J, Z, double nodata, int nthreads=1):
+    """ Interpolate bilinearly at fractional row and column positions (I, J)
+    within all bands of an (ny, nx, nbands) array *Z*.
+
+    *Z* is read in its own type and layout without being copied, and the
+    computation runs without the GIL. Positions that do not lie between four
+    cell centers of *Z* are *nodata*. When built with OpenMP, points are
+    divided between *nthreads* threads.
+
+    Returns an (n, nbands) array of float64 values.
+    """
+    I, J, Z = _sample_args(I, J, Z)
+    return _sample(0, I, J, Z, nodata, nthreads)
+
+def sample_bicubic(I, J, Z, double nodata, int nthreads=1):
+    """ Interpolate with cubic convolution at fractional row and column
+    positions (I, J) within all bands of an (ny, nx, nbands) array *Z*.
+
+    Each value is computed from the 4x4 neighbourhood of cell centers around
+    the position, repeating the outermost rows and columns of *Z* where the
+    neighbourhood extends past its edges. Positions outside of the cell
+    centers of *Z* are *nodata*. Other behaviour is as for `sample_bilinear`.
+
+    Returns an (n, nbands) array of float64 values.
+    """
+    I, J, Z = _sample_args(I, J, Z)
+    return _sample(1, I, J, Z, nodata, nthreads)
 
 @cython.cdivision(True)
 @cython.wraparound(False)
@@ -194,3 +243,176 @@ def fillarray_double(double[:,:] array not None,
                 array[i,j] = nodata_value
     return 0
 
+
+cdef inline void _sort_crossings(int *cols, int *dirs, Py_ssize_t n) nogil:
+    """ Insertion sort crossings by column """
+    cdef Py_ssize_t a, b
+    cdef int c, d
+    for a in range(1, n):
+        c = cols[a]
+        d = dirs[a]
+        b = a - 1
+        while b >= 0 and cols[b] > c:
+            cols[b+1] = cols[b]
+            dirs[b+1] = dirs[b]
+            b -= 1
+        cols[b+1] = c
+        dirs[b+1] = d
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def fill_polygons(double[:] I not None, double[:] J not None,
+                  Py_ssize_t[:] rings not None, Py_ssize_t[:] polys not None,
+                  int[:] values not None, int[:,:] out not None,
+                  Py_ssize_t yoff=0, Py_ssize_t xoff=0):
+    """ Burn polygons into *out* with a scanline algorithm.
+
+    *I* and *J* are vertex positions in fractional row and column units,
+    measured from the grid edge. Vertices of ring *k* are ``rings[k]`` to
+    ``rings[k+1]``, and rings of polygon *p* are ``polys[p]`` to
+    ``polys[p+1]``. The first ring of a polygon is its exterior and the others
+    are holes. Cells inside polygon *p* are set to ``values[p]``, so that later
+    polygons overwrite earlier ones. *out* holds the window of the grid
+    beginning at row *yoff* and column *xoff*. Crossings are computed in grid
+    coordinates, so that cells in a window are the same as in the full grid.
+
+    Vertices are rounded to the nearest grid line, and a cell is inside a
+    polygon when the nonzero winding number of the rounded crossing in its
+    row, taken from the lower edge of each segment, lies to its left.
+
+    Returns 0 on success and 1 if the inputs are inconsistent.
+    """
+    cdef Py_ssize_t ny = out.shape[0]
+    cdef Py_ssize_t nx = out.shape[1]
+    cdef Py_ssize_t npolys = len(polys) - 1
+    cdef Py_ssize_t p, k, v, w, a, b, v0, v1, i, m, start, end, ncross
+    cdef Py_ssize_t imin, imax, lo, hi
+    cdef Py_ssize_t bufsize = 0
+    cdef long ra, rb, ca, cb, c, c0, c1
+    cdef int winding, value, direction, sign
+    cdef double area, slope
+    cdef Py_ssize_t *rowstart = NULL
+    cdef Py_ssize_t *rowfill = NULL
+    cdef int *cols = NULL
+    cdef int *dirs = NULL
+    cdef int *tmp = NULL
+    cdef bint failed = False
+
+    if len(I) != len(J) or len(values) < npolys:
+        return 1
+
+    rowstart = <Py_ssize_t*> malloc((ny+1) * sizeof(Py_ssize_t))
+    rowfill = <Py_ssize_t*> malloc((ny+1) * sizeof(Py_ssize_t))
+    if rowstart == NULL or rowfill == NULL:
+        free(rowstart)
+        free(rowfill)
+        raise MemoryError()
+
+    with nogil:
+        for p in range(npolys):
+            value = values[p]
+
+            # row range of the polygon, limited to the grid
+            imin = ny
+            imax = 0
+            for v in range(rings[polys[p]], rings[polys[p+1]]):
+                ra = <long> rint(I[v]) - yoff
+                if ra < imin:
+                    imin = max(ra, 0)
+                if ra > imax:
+                    imax = min(ra, ny)
+            if imin >= imax:
+                continue
+
+            # count crossings per row
+            for i in range(imin, imax+1):
+                rowstart[i] = 0
+            for k in range(polys[p], polys[p+1]):
+                v0 = rings[k]
+                v1 = rings[k+1]
+                for v in range(v0, v1):
+                    w = v + 1 if v + 1 != v1 else v0
+                    ra = <long> rint(I[v]) - yoff
+                    rb = <long> rint(I[w]) - yoff
+                    lo = max(min(ra, rb), imin)
+                    hi = min(max(ra, rb), imax)
+                    for i in range(lo, hi):
+                        rowstart[i+1] += 1
+
+            for i in range(imin, imax):
+                rowstart[i+1] += rowstart[i]
+                rowfill[i] = rowstart[i]
+            ncross = rowstart[imax]
+
+            if ncross > bufsize:
+                tmp = <int*> realloc(cols, ncross * sizeof(int))
+                if tmp == NULL:
+                    failed = True
+                    break
+                cols = tmp
+                tmp = <int*> realloc(dirs, ncross * sizeof(int))
+                if tmp == NULL:
+                    failed = True
+                    break
+                dirs = tmp
+                bufsize = ncross
+
+            # compute crossings, orienting holes opposite the exterior ring
+            for k in range(polys[p], polys[p+1]):
+                v0 = rings[k]
+                v1 = rings[k+1]
+                area = 0.0
+                for v in range(v0, v1):
+                    w = v + 1 if v + 1 != v1 else v0
+                    area += J[v]*I[w] - J[w]*I[v]
+                sign = -1 if area < 0 else 1
+                if k != polys[p]:
+                    sign = -sign
+
+                for v in range(v0, v1):
+                    w = v + 1 if v + 1 != v1 else v0
+                    ra = <long> rint(I[v]) - yoff
+                    rb = <long> rint(I[w]) - yoff
+                    if ra == rb:
+                        continue
+                    # measure crossings from the lower end point
+                    if ra < rb:
+                        a = v
+                        b = w
+                        direction = sign
+                    else:
+                        a = w
+                        b = v
+                        ra, rb = rb, ra
+                        direction = -sign
+                    ca = <long> rint(J[a])
+                    slope = (J[b] - J[a]) / (I[b] - I[a])
+                    for i in range(max(ra, imin), min(rb, imax)):
+                        m = rowfill[i]
+                        c = <long> rint((i-ra)*slope + ca) - xoff
+                        cols[m] = <int> min(max(c, -1), nx)
+                        dirs[m] = direction
+                        rowfill[i] += 1
+
+            # fill spans with nonzero winding number
+            for i in range(imin, imax):
+                start = rowstart[i]
+                end = rowstart[i+1]
+                _sort_crossings(&cols[start], &dirs[start], end-start)
+                winding = 0
+                for m in range(start, end):
+                    winding += dirs[m]
+                    if winding != 0:
+                        c0 = max(cols[m], 0)
+                        c1 = cols[m+1] if m+1 != end else nx
+                        for c in range(c0, c1):
+                            out[i,c] = value
+
+    free(rowstart)
+    free(rowfill)
+    free(cols)
+    free(dirs)
+    if failed:
+        raise MemoryError()
+    return 0
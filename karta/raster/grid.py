@@ -12,6 +12,7 @@ from .band import SimpleBand, CompressedBand, BandIndexer
 from .coordgen import CoordinateGenerator
 from .. import errors
 from ..crs import Cartesian
+from ..vector.table import Table
 
 BAND_CLASS_DEFAULT = CompressedBand
 CRS_DEFAULT = Cartesian
@@ -23,8 +24,32 @@ class Grid(object):
     def nodata(self):
         return self._nodata
 
+    def _band_summaries(self, collapsed=False):
+        """ Return a (min, max, sum, count, nodata count) summary of each band
+        from chunk statistics, or None if a band does not keep statistics.
+
+        If *collapsed* is True, summaries are returned only if they describe
+        the cells that are valid in every band, which is the case for a single
+        band or when no band contains nodata.
+        """
+        summaries = []
+        for band in self.bands:
+            stats = getattr(band, "chunkstats", None)
+            if stats is None:
+                return None
+            stats.nodata = self.nodata
+            summaries.append(stats.summary(band))
+        if collapsed and len(summaries) > 1 and \
+                any(summary[4] != 0 for summary in summaries):
+            return None
+        return summaries
+
     def max(self):
         """ Return the maximum non-nan in self.data """
+        summaries = self._band_summaries(collapsed=True)
+        if summaries is not None:
+            values = [s[1] for s in summaries if s[3] != 0]
+            return max(values) if len(values) != 0 else np.nan
         tmp = self[self.data_mask]
         if len(tmp) != 0:
             return tmp.max()
@@ -33,6 +58,10 @@ class Grid(object):
 
     def min(self):
         """ Return the minimum non-nan in self.data """
+        summaries = self._band_summaries(collapsed=True)
+        if summaries is not None:
+            values = [s[0] for s in summaries if s[3] != 0]
+            return min(values) if len(values) != 0 else np.nan
         tmp = self[self.data_mask]
         if len(tmp) != 0:
             return tmp.min()
@@ -41,12 +70,55 @@ class Grid(object):
 
     def minmax(self):
         """ Return the minimum and maximum value of data array """
+        summaries = self._band_summaries()
+        if summaries is not None:
+            summaries = [s for s in summaries if s[3] != 0]
+            if len(summaries) == 0:
+                return (np.nan, np.nan)
+            return (min(s[0] for s in summaries), max(s[1] for s in summaries))
         tmp = self[self.data_mask_full]
         if len(tmp) != 0:
             return (tmp.min(), tmp.max())
         else:
             return (np.nan, np.nan)
 
+    def has_data(self, yoff=0, xoff=0, ny=None, nx=None):
+        """ Return whether a window of the grid contains any cells that are
+        valid in every band. Bands that keep chunk statistics are read only
+        where a chunk extends beyond the window and contains both data and
+        nodata.
+
+        Parameters
+        ----------
+        yoff, xoff : int, optional
+            offset of the window (default 0)
+        ny, nx : int, optional
+            size of the window (default the remainder of the grid)
+
+        Returns
+        -------
+        bool
+        """
+        if ny is None:
+            ny = self.size[0] - yoff
+        if nx is None:
+            nx = self.size[1] - xoff
+        stats = [getattr(band, "chunkstats", None) for band in self.bands]
+        for band, bandstats in zip(self.bands, stats):
+            if bandstats is not None:
+                bandstats.nodata = self.nodata
+                if not bandstats.has_data(band, yoff, xoff, ny, nx):
+                    return False
+        if len(self.bands) == 1 and stats[0] is not None:
+            return True
+
+        # cells must be valid in every band
+        window = np.dstack([band.getblock(yoff, xoff, ny, nx)
+                            for band in self.bands])
+        if np.isnan(self.nodata):
+            return bool(np.any(np.all(~np.isnan(window), axis=-1)))
+        return bool(np.any(np.all(window != self.nodata, axis=-1)))
+
     def copy(self):
         """ Return a deep copy """
         return copy.deepcopy(self)
@@ -164,33 +236,41 @@ class RegularGrid(Grid):
         else:
             self.bands = []
 
+        if nodata_value is None:
+            if len(self.bands) != 0:
+                nodata_value = get_nodata(self.bands[0].dtype)
+            elif values is not None:
+                nodata_value = get_nodata(values.dtype.type)
+            else:
+                nodata_value = np.nan
+        self._nodata = nodata_value
+
         if bands is None and (values is not None):
             if values.ndim == 2:
                 band = self._bndcls(values.shape, values.dtype.type)
+                _set_stats_nodata(band, self._nodata)
                 band.setblock(0, 0, values)
                 self.bands.append(band)
             elif values.ndim == 3:
                 for iband in range(values.shape[2]):
                     band = self._bndcls(values.shape[:2], values.dtype.type)
+                    _set_stats_nodata(band, self._nodata)
                     band.setblock(0, 0, values[:,:,iband])
                     self.bands.append(band)
             else:
                 raise ValueError("`values` must have two or three dimensions")
+        else:
+            for band in self.bands:
+                _set_stats_nodata(band, self._nodata)
 
         self._bandindexer = BandIndexer(self.bands)
+        self._overviews = {}
+        self._overview_method = None
 
         if crs is None:
             self.crs = CRS_DEFAULT
         else:
             self.crs = crs
-
-        if nodata_value is None:
-            if len(self.bands) == 0:
-                self._nodata = np.nan
-            else:
-                self._nodata = get_nodata(self.bands[0].dtype)
-        else:
-            self._nodata = nodata_value
         return
 
     def __add__(self, other):
@@ -210,10 +290,48 @@ class RegularGrid(Grid):
             raise ValueError(self, other)
 
     def __getitem__(self, key):
+        if self._overviews:
+            level = self._strided_overview(key)
+            if level is not None:
+                return level
         return self._bandindexer[key]
 
+    def _strided_overview(self, key):
+        """ Read a strided index from the coarsest nearest-neighbour overview
+        that contains exactly the requested cells, or return None. """
+        if self._overview_method != "nearest" or not isinstance(key, tuple) \
+                or len(key) < 2 or not isinstance(key[0], slice) \
+                or not isinstance(key[1], slice):
+            return None
+        ny, nx = self.size
+        ystart, ystop, ystep = key[0].indices(ny)
+        xstart, xstop, xstep = key[1].indices(nx)
+        if ystep < 1 or xstep < 1 or ystop <= ystart or xstop <= xstart:
+            return None
+        for factor in sorted(self._overviews, reverse=True):
+            if (ystep % factor == 0) and (xstep % factor == 0) and \
+                    (ystart % factor == 0) and (xstart % factor == 0):
+                ov = self._overviews[factor]
+                ovkey = (slice(ystart//factor, (ystop-1)//factor+1, ystep//factor),
+                         slice(xstart//factor, (xstop-1)//factor+1, xstep//factor))
+                return ov._bandindexer[ovkey + key[2:]]
+        return None
+
+    def lazy(self):
+        """ Return a LazyGrid reading from this grid. Arithmetic and `apply()`
+        on the LazyGrid build a deferred expression that is computed window by
+        window when indexed, written, or evaluated. Arithmetic on the
+        RegularGrid itself remains eager.
+
+        Returns
+        -------
+        karta.raster.lazy.LazyGrid
+        """
+        return LazyGrid.from_grid(self)
+
     def __setitem__(self, key, value):
         self._bandindexer[key] = value
+        self._overviews = {}
         return
 
     def _equivalent_structure(self, other):
@@ -251,7 +369,11 @@ class RegularGrid(Grid):
         -------
         self
         """
-        self[:,:,:] = np.where(self.data_mask_full, self[:,:,:], val)
+        values = np.where(self.data_mask_full, self[:,:,:], val)
+        # chunk statistics are recomputed as the values are written
+        for band in self.bands:
+            _set_stats_nodata(band, val)
+        self[:,:,:] = values
         self._nodata = val
         return self
 
@@ -644,16 +766,7 @@ class RegularGrid(Grid):
         polys = unpack_multipolygons(polys)
 
         ny, nx = self.size
-        msk = np.zeros([ny, nx], dtype=np.bool)
-        for poly in polys:
-
-            x, y = poly.coords(self.crs)[:2]
-            if not poly.isclockwise():
-                x = x[::-1]
-                y = y[::-1]
-
-            _msk = mask_poly(x, y, nx, ny, self.transform)
-            msk = (msk | _msk)
+        msk = rasterize(polys, nx, ny, self.transform, crs=self.crs)
 
         if inplace:
             for i in range(len(self.bands)):
@@ -667,6 +780,128 @@ class RegularGrid(Grid):
                                values=np.where(msk, self[:,:,:], self.nodata),
                                crs=self.crs, nodata_value=self.nodata)
 
+    def zonal_stats(self, polys, stats=("mean", "min", "max", "count"),
+                    band=0, chunksize=(512, 512)):
+        """ Compute statistics of grid values within each of a set of
+        polygons. Each polygon is rasterised only over the part of its
+        bounding box within each chunk of the grid, and chunks that no polygon
+        touches are not read.
+
+        Parameters
+        ----------
+        polys : Multipolygon, Polygon, or list of Polygon instances
+            zones, which may include holes
+        stats : tuple of str, optional
+            statistics to compute from "count", "sum", "mean", "min", "max",
+            and "std" (default ("mean", "min", "max", "count"))
+        band : int, optional
+            band to compute statistics for (default 0)
+        chunksize : tuple of two ints, optional
+            size of grid chunks read at once (default (512, 512))
+
+        Returns
+        -------
+        karta.vector.table.Table
+            one row per polygon, in the order of *polys*, with a field for each
+            statistic. For a Multipolygon, the result may be joined to its data
+            with ``polys.data.updated(result)``. Statistics other than "count"
+            and "sum" are NaN for polygons containing no data.
+        """
+        for stat in stats:
+            if stat not in ("count", "sum", "mean", "min", "max", "std"):
+                raise ValueError("unknown statistic '{0}'".format(stat))
+
+        if getattr(polys, "_geotype", "") == "Polygon":
+            polys = [polys]
+        n = len(polys)
+        ny, nx = self.size
+        T = self.transform
+
+        parts = [polys[i] for i in range(n)]
+        rings = [[ring.coords(self.crs)[:2] for ring in [p] + list(p.subs)]
+                 for p in parts]
+
+        # window of grid cells that may be inside each polygon, with a margin
+        # for the rounding of edge crossings
+        windows = np.empty((n, 4), dtype=np.int64)
+        for i, polygon in enumerate(rings):
+            x, y = polygon[0]
+            I, J = crfuncs.get_positions_vec(T, np.asarray(x, dtype=np.float64),
+                                             np.asarray(y, dtype=np.float64))
+            windows[i] = (np.floor(I.min()), np.floor(J.min()),
+                          np.ceil(I.max())+2, np.ceil(J.max())+2)
+        windows[:,0::2] = np.clip(windows[:,0::2], 0, ny)
+        windows[:,1::2] = np.clip(windows[:,1::2], 0, nx)
+
+        use_rtree = (getattr(polys, "rtree", None) is not None and
+                     polys.crs == self.crs)
+
+        count = np.zeros(n, dtype=np.int64)
+        total = np.zeros(n, dtype=np.float64)
+        mean = np.zeros(n, dtype=np.float64)
+        m2 = np.zeros(n, dtype=np.float64)     # sum of squared deviations
+        minimum = np.full(n, np.inf)
+        maximum = np.full(n, -np.inf)
+
+        for i0 in range(0, ny, chunksize[0]):
+            i1 = min(i0+chunksize[0], ny)
+            for j0 in range(0, nx, chunksize[1]):
+                j1 = min(j0+chunksize[1], nx)
+
+                candidates = np.arange(n)
+                if use_rtree:
+                    # pad the chunk by one cell against rounding in the index
+                    corners_i = np.array([i0-1, i0-1, i1+1, i1+1])
+                    corners_j = np.array([j0-1, j1+1, j0-1, j1+1])
+                    xc = T[0] + corners_j*T[2] + corners_i*T[4]
+                    yc = T[1] + corners_i*T[3] + corners_j*T[5]
+                    candidates = np.array(polys.rtree.search_overlapping(
+                        (xc.min(), yc.min(), xc.max(), yc.max())),
+                        dtype=np.int64)
+                if len(candidates) != 0:
+                    w = windows[candidates]
+                    candidates = candidates[(w[:,0] < i1) & (w[:,2] > i0) &
+                                            (w[:,1] < j1) & (w[:,3] > j0)]
+                if len(candidates) == 0:
+                    continue
+
+                values = self.bands[band].getblock(i0, j0, i1-i0, j1-j0)
+                if np.isnan(self.nodata):
+                    isdata = ~np.isnan(values)
+                else:
+                    isdata = values != self.nodata
+
+                for k in candidates:
+                    r0, c0 = max(windows[k,0], i0), max(windows[k,1], j0)
+                    r1, c1 = min(windows[k,2], i1), min(windows[k,3], j1)
+                    inside = _fill_rings([rings[k]], nx, ny, T, [1],
+                                         window=(r0, c0, r1-r0, c1-c0))
+                    inside = (inside != 0) & isdata[r0-i0:r1-i0,c0-j0:c1-j0]
+                    v = values[r0-i0:r1-i0,c0-j0:c1-j0][inside].astype(np.float64)
+                    if len(v) == 0:
+                        continue
+                    # combine with previous chunks as in Chan et al. (1979)
+                    nv = len(v)
+                    vmean = v.mean()
+                    delta = vmean - mean[k]
+                    m2[k] += ((v-vmean)**2).sum() + delta**2 * count[k]*nv/(count[k]+nv)
+                    mean[k] += delta * nv/(count[k]+nv)
+                    count[k] += nv
+                    total[k] += v.sum()
+                    minimum[k] = min(minimum[k], v.min())
+                    maximum[k] = max(maximum[k], v.max())
+
+        nodata = count == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            results = {"count": count,
+                       "sum": total,
+                       "mean": np.where(nodata, np.nan, mean),
+                       "min": np.where(nodata, np.nan, minimum),
+                       "max": np.where(nodata, np.nan, maximum),
+                       "std": np.where(nodata, np.nan, np.sqrt(m2/count))}
+        columns = [results[stat].tolist() for stat in stats]
+        return Table(data=list(zip(*columns)), fields=stats)
+
     def _resample_transform(self, transform, method='nearest'):
         """ Resample grid to match a new transform.
 
@@ -686,6 +921,8 @@ class RegularGrid(Grid):
             values = self.sample_nearest(X, Y)
         elif method == 'linear':
             values = self.sample_bilinear(X, Y)
+        elif method == 'cubic':
+            values = self.sample_bicubic(X, Y)
         else:
             raise NotImplementedError('method "{0}" unavailable'.format(method))
         if values.ndim == 3:
@@ -721,7 +958,7 @@ class RegularGrid(Grid):
              self._transform[5]]
         return self._resample_transform(t, method=method)
 
-    def resample(self, dx, dy, method='nearest'):
+    def resample(self, dx, dy, method='nearest', use_overviews=True):
         """ Resample array to have spacing *dx*, *dy*. The grid origin remains
         in the same position.
 
@@ -732,11 +969,17 @@ class RegularGrid(Grid):
         dy : float
             cell dimension 2
         method : str, optional
-            interpolation method, currently 'nearest' and 'linear' supported
+            interpolation method, one of 'nearest' (default), 'linear', or
+            'cubic'
+        use_overviews : bool, optional
+            if True (default) and overviews have been built, sample from the
+            coarsest overview level with cells no larger than *dx*, *dy*
         """
         if dx <= 0 or dy <= 0:
             raise ValueError("resolution must be positive "
                              "(got {0}, {1})".format(dx, dy))
+        if method not in ('nearest', 'linear', 'cubic'):
+            raise NotImplementedError('method "{0}" unavailable'.format(method))
 
         xmin, xmax, ymin, ymax = self.extent()
         ny = int((ymax - ymin) // dy) + 1
@@ -747,18 +990,132 @@ class RegularGrid(Grid):
         cg = CoordinateGenerator(tnew, (ny, nx), self.crs, self.crs)
         X, Y = cg[:,:]
 
-        if method == 'nearest':
-            values = self.sample_nearest(X, Y)
-        elif method == 'linear':
-            values = self.sample_bilinear(X, Y)
-        else:
-            raise NotImplementedError('method "{0}" unavailable'.format(method))
+        level = self._overview_level(dx, dy) if use_overviews else self
+        values = level._sample_level(X, Y, method, self)
 
         if values.ndim == 3:
             values = values.transpose(1, 2, 0)
         return RegularGrid(tnew, values=values, crs=self.crs,
                            nodata_value=self.nodata)
 
+    @property
+    def overviews(self):
+        """ Dictionary of overview grids built by `build_overviews`, keyed by
+        their reduction factor """
+        return dict(self._overviews)
+
+    def build_overviews(self, levels=(2, 4, 8, 16), method="mean",
+                        chunksize=(512, 512), bandclass=None):
+        """ Compute and cache reduced-resolution copies of the grid.
+
+        Each level is computed from the full resolution bands, which are read
+        in windows of about *chunksize*. Overviews are used by `resample`,
+        `sample`, and by indexing with strides (nearest overviews only). They
+        are discarded when values are assigned through the grid, but not when
+        bands are modified directly, in which case `build_overviews` should be
+        called again.
+
+        Parameters
+        ----------
+        levels : iterable of ints, optional
+            reduction factors (default (2, 4, 8, 16))
+        method : str, optional
+            one of 'mean' (default), 'nearest', or 'mode'. Nodata cells are
+            excluded from means and modes.
+        chunksize : tuple of two ints, optional
+            approximate size of the windows read at once (default (512, 512))
+        bandclass : callable, optional
+            band class of the overviews, called as
+            ``bandclass(size, dtype, initval=nodata)`` (default
+            BAND_CLASS_DEFAULT)
+
+        Returns
+        -------
+        dict
+            overview grids keyed by reduction factor
+        """
+        methods = {"mean": "average", "nearest": "nearest", "mode": "mode"}
+        if method not in methods:
+            raise ValueError("overview method '{0}' not available".format(method))
+        levels = sorted(set(int(f) for f in levels))
+        if any(f < 2 for f in levels):
+            raise ValueError("overview levels must be integers greater than 1")
+        if bandclass is None:
+            bandclass = BAND_CLASS_DEFAULT
+
+        ny, nx = self.size
+        t = self._transform
+        overviews = {}
+        for f in levels:
+            size = (-(-ny // f), -(-nx // f))
+            bands = [bandclass(size, band.dtype, initval=self.nodata)
+                     for band in self.bands]
+            overviews[f] = RegularGrid((t[0], t[1], f*t[2], f*t[3], f*t[4], f*t[5]),
+                                       bands=bands, crs=self.crs,
+                                       nodata_value=self.nodata)
+
+        # windows are multiples of every factor, so that each overview cell is
+        # computed from a single window
+        m = _gdal._lcm(*levels) if levels else 1
+        wy = m * max(1, chunksize[0] // m)
+        wx = m * max(1, chunksize[1] // m)
+        for yoff in range(0, ny, wy):
+            for xoff in range(0, nx, wx):
+                wny = min(wy, ny-yoff)
+                wnx = min(wx, nx-xoff)
+                for i, band in enumerate(self.bands):
+                    window = band.getblock(yoff, xoff, wny, wnx)
+                    for f in levels:
+                        if method == "nearest":
+                            # the first cell of each block, so that strided
+                            # indexing can read from the overview exactly
+                            ov = window[::f, ::f]
+                        else:
+                            ov = _gdal._downsample(window, f, methods[method],
+                                                   self.nodata)
+                        overviews[f].bands[i].setblock(yoff//f, xoff//f, ov)
+
+        self._overviews = overviews
+        self._overview_method = method
+        return self.overviews
+
+    def _overview_level(self, dx, dy):
+        """ Return the coarsest overview with cells no larger than *dx*, *dy*,
+        or self. """
+        rx = abs(self._transform[2])
+        ry = abs(self._transform[3])
+        for factor in sorted(self._overviews, reverse=True):
+            if factor*rx <= dx*(1+1e-12) and factor*ry <= dy*(1+1e-12):
+                return self._overviews[factor]
+        return self
+
+    def _sample_level(self, x, y, method, full):
+        """ Sample this grid (*full* or one of its overviews) with 'nearest',
+        'linear', or 'cubic' interpolation. Interpolated samples that fall
+        between the outermost overview cell centers and the grid edge are
+        taken from *full*. """
+        samplers = {'nearest': "sample_nearest", 'linear': "sample_bilinear",
+                    'cubic': "sample_bicubic"}
+        values = getattr(self, samplers[method])(x, y)
+        if self is full or method == 'nearest':
+            return values
+        if np.isnan(self.nodata):
+            missing = np.isnan(values)
+        else:
+            missing = np.asarray(values) == self.nodata
+        if not hasattr(x, "__iter__"):
+            if missing.any():
+                return getattr(full, samplers[method])(x, y)
+            return values
+        # values are p x (shape of x)
+        missing = missing.any(axis=0)
+        if missing.any():
+            x = np.asarray(x, dtype=np.float64)
+            y = np.asarray(y, dtype=np.float64)
+            values[:,missing] = getattr(full, samplers[method])(x[missing],
+                                                                y[missing])
+        return values
+
     def positions(self, x, y):
         """ Return the float row and column indices for the point nearest
         geographical coordinates.
@@ -863,33 +1220,20 @@ class RegularGrid(Grid):
             y = np.array(y)
 
         I, J = self._indices(x.ravel(), y.ravel())
-        out_of_bounds_mask = (I < 0) | (I >= m) | (J < 0) | (J >= n)
-        I = I[~out_of_bounds_mask]
-        J = J[~out_of_bounds_mask]
-
-        Imn = int(np.floor(I.min())-1)
-        Imx = int(np.ceil(I.max()+1))
-        Jmn = int(np.floor(J.min())-1)
-        Jmx = int(np.ceil(J.max()+1))
+        inbounds = np.flatnonzero((I >= 0) & (I < m) & (J >= 0) & (J < n))
+        I = I[inbounds]
+        J = J[inbounds]
 
-        Imn = max(Imn, 0)
-        Jmn = max(Jmn, 0)
-        Imx = min(Imx, self.size[0])
-        Jmx = min(Jmx, self.size[1])
+        data = np.empty((self.nbands, x.size), dtype=self.bands[0].dtype)
+        data[:,:] = self.nodata_value
 
-        I -= Imn
-        J -= Jmn
+        # read only the band chunks that contain points
+        for k, band in enumerate(self.bands):
+            for idx, yoff, xoff, ny, nx in _chunk_groups(band, I, J, 0, 0):
+                block = band.getblock(yoff, xoff, ny, nx)
+                data[k, inbounds[idx]] = block[I[idx]-yoff, J[idx]-xoff]
 
-        data = np.empty((out_of_bounds_mask.shape[0], self.nbands),
-                        dtype=self.bands[0].dtype)
-
-        data[out_of_bounds_mask, :] = self.nodata_value
-        data[~out_of_bounds_mask, :] = self[Imn:Imx,Jmn:Jmx,:][I,J].reshape(sum(~out_of_bounds_mask), self.nbands)
-
-        if x.ndim == 1:
-            return data.reshape(self.nbands, x.shape[0])
-        else:
-            return data.reshape(self.nbands, x.shape[0], x.shape[1])
+        return data.reshape((self.nbands,) + x.shape)
 
     def sample_bilinear(self, x, y):
         """ Return the value nearest to coordinates using a bi-linear sampling
@@ -913,6 +1257,28 @@ class RegularGrid(Grid):
         IndexError
             points outside of Grid bbox
         """
+        return self._sample_interpolated(x, y, "bilinear")
+
+    def sample_bicubic(self, x, y):
+        """ Return the value at coordinates using cubic convolution
+        interpolation of the 4x4 neighbouring cell centers.
+
+        Parameters
+        ----------
+        x, y : float or vector
+            vertices of points to compute indices for
+
+        Returns
+        -------
+        float or vector
+            the size of the output has one more dimension than the input. if
+            the input are scalar, the output is a vector length p representing
+            band values. if the input is a vector length n, the ouput is p x n.
+            if the input is an m x n array, the output is p x m x n.
+        """
+        return self._sample_interpolated(x, y, "bicubic")
+
+    def _sample_interpolated(self, x, y, method):
         if not hasattr(x, "__iter__"):
             dim = 0
             x = np.array([x])
@@ -925,40 +1291,60 @@ class RegularGrid(Grid):
             dim = x.ndim
 
         I, J = self.positions(x.ravel(), y.ravel())
-
-        # If the grid is large, decompressing everthing is expensive, so
-        # compute only the region necessary
-        if len(I) != 1:
-            Imn = int(np.floor(I.min())-1)
-            Imx = int(np.ceil(I.max()+1))
-            Jmn = int(np.floor(J.min())-1)
-            Jmx = int(np.ceil(J.max()+1))
-
-            Imn = max(Imn, 0)
-            Jmn = max(Jmn, 0)
-            Imx = min(Imx, self.size[0])
-            Jmx = min(Jmx, self.size[1])
-
-            I -= Imn
-            J -= Jmn
+        m, n = self.size
+        if method == "bilinear":
+            # upper left corner of the cell used to interpolate each point
+            kernel = crfuncs.sample_bilinear
+            I0 = _bilinear_corner(I)
+            J0 = _bilinear_corner(J)
+            halo = (0, 1)
+            inbounds = (I0 >= 0) & (I0 < m-1) & (J0 >= 0) & (J0 < n-1)
         else:
-            Imn = None
-            Imx = None
-            Jmn = None
-            Jmx = None
-
-        data = []
+            kernel = crfuncs.sample_bicubic
+            with np.errstate(invalid="ignore"):
+                I0 = np.floor(I)
+                J0 = np.floor(J)
+            halo = (1, 2)
+            inbounds = (I >= 0) & (I <= m-1) & (J >= 0) & (J <= n-1)
+        inbounds = np.flatnonzero(inbounds)
+        I = I[inbounds]
+        J = J[inbounds]
+        I0 = I0[inbounds].astype(np.intp)
+        J0 = J0[inbounds].astype(np.intp)
+
+        # Bands with the same type are interpolated together
+        groups = []
         for i, band in enumerate(self.bands):
-            v = self[Imn:Imx,Jmn:Jmx,i].squeeze()
-            if band.dtype in (np.float32, np.float64):
-                data.append(crfuncs.sample_bilinear_double(I, J, v.astype(np.float64), self.nodata_value))
-            elif band.dtype in (np.int16, np.int32, np.int64):
-                data.append(crfuncs.sample_bilinear_int(I, J, v.astype(np.int32), self.nodata_value))
-            elif band.dtype in (np.uint8, np.uint16, np.uint32):
-                data.append(crfuncs.sample_bilinear_uint(I, J, v.astype(np.uint16), self.nodata_value))
+            for group in groups:
+                if np.dtype(self.bands[group[0]].dtype) == np.dtype(band.dtype):
+                    group.append(i)
+                    break
             else:
-                raise NotImplementedError("no sample_bilinear method for dtype:"
-                                          " {0}".format(band.dtype))
+                groups.append([i])
+
+        data = [None for _ in self.bands]
+        for group in groups:
+            bands = [self.bands[i] for i in group]
+            values = np.full((x.size, len(group)), self.nodata_value,
+                             dtype=np.float64)
+
+            # If the grid is large, decompressing everthing is expensive, so
+            # read only the chunks containing points, with the neighbouring
+            # rows and columns that the kernel requires
+            for idx, yoff, xoff, ny, nx in _chunk_groups(bands[0], I0, J0, *halo):
+                blocks = [band.getblock(yoff, xoff, ny, nx) for band in bands]
+                if len(blocks) == 1:
+                    window = blocks[0][:,:,np.newaxis]
+                else:
+                    window = np.stack(blocks, axis=-1)
+                values[inbounds[idx]] = kernel(I[idx]-yoff, J[idx]-xoff,
+                                               window, self.nodata_value)
+
+            dtype = np.dtype(bands[0].dtype)
+            if dtype.kind in "iu":
+                values = _as_integer(values, dtype, method == "bicubic")
+            for k, i in enumerate(group):
+                data[i] = values[:,k]
 
         if dim == 0:
             return np.array([d[0] for d in data])
@@ -983,7 +1369,10 @@ class RegularGrid(Grid):
             used when coordinate lists are provided, otherwise the coordinate
             system is taken from the crs attribute of the geometry
         method : string, optional
-            may be one of 'nearest', 'bilinear' (default).
+            may be one of 'nearest', 'bilinear' (default), or 'bicubic'.
+        resolution : float, optional
+            if provided and overviews have been built, sample from the coarsest
+            overview level with cells no larger than *resolution*
 
         Returns
         -------
@@ -1000,6 +1389,7 @@ class RegularGrid(Grid):
         """
         crs = kwargs.get("crs", None)
         method = kwargs.get("method", "bilinear")
+        resolution = kwargs.get("resolution", None)
 
         argerror = TypeError("'sample' method takes a Point, a Multipoint, or x and y coordinate arrays")
         if hasattr(args[0], "_geotype"):
@@ -1024,13 +1414,15 @@ class RegularGrid(Grid):
             if len(x) != len(y):
                 raise argerror
 
-        if method == "nearest":
-            v = self.sample_nearest(x, y)
-        elif method == "bilinear":
-            v = self.sample_bilinear(x, y)
-        else:
+        methods = {"nearest": "nearest", "bilinear": "linear",
+                   "bicubic": "cubic"}
+        if method not in methods:
             raise ValueError("method '{0}' not available".format(method))
-        return v
+        if resolution is None:
+            level = self
+        else:
+            level = self._overview_level(resolution, resolution)
+        return level._sample_level(x, y, methods[method], self)
 
     def profile(self, line, resolution=None, **kw):
         """ Sample along a *Line* at a specified interval.
@@ -1072,8 +1464,21 @@ class RegularGrid(Grid):
             output file name
         compress: str or None, optional
             "PACKBITS" (default), "DEFLATE", "LZW", "LZMA", or None
+        tiled : bool, optional
+            whether to write a tiled GeoTiff (default False)
+        overviews : list of ints, optional
+            decimation factors of internal overviews to build while writing
+        overview_method : str, optional
+            "average" (default) or "nearest"
+        nthreads : int, optional
+            number of threads used to read bands concurrently (default 1)
+        max_memory : int, optional
+            approximate limit in bytes on the window read from each band at
+            once (default 64 MiB)
+
+        Additional keyword arguments are passed to GDAL as creation options.
         """
-        return _gdal.write(fnm, self, compress=compress, **kw)
+        return _gdal.write(fnm, self, compress=compress, tiled=tiled, **kw)
 
     def to_gtiff(self, *args, **kwargs):
         """ Alias for to_geotiff """
@@ -1138,22 +1543,116 @@ class RegularGrid(Grid):
             f.close()
         return self
 
-def merge(grids, weights=None):
+def _band_chunksize(band):
+    """ Return the size of the chunks or blocks in which a band stores values,
+    or None for bands that are read equally quickly in any window. """
+    for attr in ("_chunksize", "_blocksize"):
+        chunksize = getattr(band, attr, None)
+        if chunksize is not None:
+            return chunksize
+    return None
+
+def _chunk_groups(band, I, J, before, after):
+    """ Group cell indices by the band chunk that contains them.
+
+    Yields tuples of (indices, yoff, xoff, ny, nx) for each chunk containing at
+    least one cell, where *indices* selects the cells (I, J) in the chunk, and
+    the window (yoff, xoff, ny, nx) covers those cells plus *before* rows and
+    columns above and to the left and *after* rows and columns below and to
+    the right, within the band.
+    """
+    if len(I) == 0:
+        return
+    m, n = band.size
+
+    def window(idx):
+        i, j = I[idx], J[idx]
+        yoff = max(int(i.min())-before, 0)
+        xoff = max(int(j.min())-before, 0)
+        ny = min(int(i.max())+1+after, m) - yoff
+        nx = min(int(j.max())+1+after, n) - xoff
+        return idx, yoff, xoff, ny, nx
+
+    chunksize = _band_chunksize(band)
+    if chunksize is None:
+        yield window(np.arange(len(I)))
+        return
+
+    ncols = -(-n // chunksize[1])
+    keys = (I // chunksize[0]).astype(np.int64) * ncols + (J // chunksize[1])
+    order = np.argsort(keys, kind="mergesort")
+    bounds = np.flatnonzero(np.diff(keys[order])) + 1
+    for idx in np.split(order, bounds):
+        yield window(idx)
+
+def _set_stats_nodata(band, nodata):
+    """ Exclude *nodata* from the chunk statistics of *band*, if it has them """
+    stats = getattr(band, "chunkstats", None)
+    if stats is not None:
+        stats.nodata = nodata
+    return
+
+def _may_have_data(grid, yoff, xoff, ny, nx):
+    """ Return False if chunk statistics show that a window of *grid* has no
+    cells that are valid in every band, without reading band values. """
+    for band in grid.bands:
+        stats = getattr(band, "chunkstats", None)
+        if stats is None:
+            continue
+        stats.nodata = grid.nodata
+        if stats.current[stats.indices(yoff, xoff, ny, nx)].all() and \
+                not stats.has_data(band, yoff, xoff, ny, nx, exact=False):
+            return False
+    return True
+
+def _bilinear_corner(positions):
+    """ Return the lower of the two indices interpolated between by the
+    bilinear sampling functions in crfuncs. Positions on a cell center use the
+    interval ending at that cell, except for the first. """
+    positions = np.asarray(positions, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        return np.where(np.mod(positions, 1) != 0, np.floor(positions),
+                        np.where(positions != 0, positions-1, 0))
+
+def _as_integer(values, dtype, clip):
+    """ Truncate interpolated values toward zero and convert to the integer
+    type *dtype*, optionally clipping to its range first. Nodata values that
+    cannot be represented are kept as NaN in a float array. """
+    if clip:
+        info = np.iinfo(dtype)
+        values = np.clip(values, info.min, info.max)
+    if np.any(np.isnan(values)):
+        return np.trunc(values)
+    return np.trunc(values).astype(dtype)
+
+def merge(grids, weights=None, chunksize=(512, 512), bandclass=None):
     """ Construct a grid mosiac by averaging multiple grids. Currently limited
     to grids whose sampling is an integer translation from each other.
 
+    The mosaic is computed in tiles of *chunksize*, reading only the windows
+    of the input grids that overlap each tile, so that memory use does not
+    depend on the size of the mosaic or of the inputs.
+
     Parameters
     ----------
     grids : iterable of Grid objects
         grids to combine
     weights : iterable of floats, optional
         weighting factors for computing grid averages
+    chunksize : tuple of two ints, optional
+        size of the output tiles computed at once (default (512, 512))
+    bandclass : callable, optional
+        band class of the output grid, called as
+        ``bandclass(size, dtype, initval=nodata)``. A file-backed class such as
+        `MmapBand` allows mosaics larger than memory (default
+        BAND_CLASS_DEFAULT).
 
     Raises
     ------
     GridError, ValueError
         input grids have inconsistent transform properties
     """
+    grids = list(grids)
 
     # Check grid class
     if not all(isinstance(grid, RegularGrid) for grid in grids):
@@ -1198,37 +1697,65 @@ def merge(grids, weights=None):
     nx = int(round((xmax-xmin) / T[2]))
     ny = int(round((ymax-ymin) / T[3]))
 
-    # Allocate data array and copy each grid's data
-    typ = grids[0].bands[0].dtype
-    outbands = []
-
-    for iband in range(len(grids[0].bands)):
-        values = np.zeros([ny, nx], dtype=typ)
-        counts = np.zeros([ny, nx], dtype=np.float32)
-
-        for grid, weight in zip(grids, normalizedweights):
-            _xmin, _xmax, _ymin, _ymax = grid.extent(reference='edge')
-            offx = int((_xmin-xmin) / T[2])
-            offy = int((_ymin-ymin) / T[3])
-            _ny, _nx = grid.size
+    # Index the extent of each grid in output cells as (row0, col0, row1, col1)
+    index = np.empty((len(grids), 4), dtype=np.int64)
+    for i, grid in enumerate(grids):
+        _xmin, _xmax, _ymin, _ymax = grid.extent(reference='edge')
+        offx = int((_xmin-xmin) / T[2])
+        offy = int((_ymin-ymin) / T[3])
+        index[i] = (offy, offx, offy+grid.size[0], offx+grid.size[1])
 
-            mask = grid.data_mask
-            counts[offy:offy+_ny,offx:offx+_nx][mask] += weight
-            _bnd = grid.bands[iband]
-            values[offy:offy+_ny,offx:offx+_nx][mask] += typ(_bnd.getblock(0, 0, *_bnd.size)[mask]) * weight
-            del mask
+    typ = grids[0].bands[0].dtype
+    nbands = len(grids[0].bands)
+    nodata = grids[0].nodata
+    if bandclass is None:
+        bandclass = BAND_CLASS_DEFAULT
+    outbands = [bandclass((ny, nx), typ, initval=nodata) for _ in range(nbands)]
+
+    for i0 in range(0, ny, chunksize[0]):
+        i1 = min(i0+chunksize[0], ny)
+        for j0 in range(0, nx, chunksize[1]):
+            j1 = min(j0+chunksize[1], nx)
+
+            overlapping = np.nonzero((index[:,0] < i1) & (index[:,2] > i0) &
+                                     (index[:,1] < j1) & (index[:,3] > j0))[0]
+            if len(overlapping) == 0:
+                continue
+
+            values = np.zeros([i1-i0, j1-j0, nbands], dtype=typ)
+            counts = np.zeros([i1-i0, j1-j0], dtype=np.float32)
+
+            for k in overlapping:
+                grid = grids[k]
+                weight = normalizedweights[k]
+                offy, offx = index[k,:2]
+                r0, r1 = max(i0, offy), min(i1, index[k,2])
+                c0, c1 = max(j0, offx), min(j1, index[k,3])
+                if not _may_have_data(grid, r0-offy, c0-offx, r1-r0, c1-c0):
+                    continue
+
+                window = np.dstack([band.getblock(r0-offy, c0-offx, r1-r0, c1-c0)
+                                    for band in grid.bands])
+                if np.isnan(grid.nodata):
+                    mask = np.all(~np.isnan(window), axis=-1)
+                else:
+                    mask = np.all(window != grid.nodata, axis=-1)
 
-        validcountmask = (counts!=0.0)
-        values[validcountmask] = values[validcountmask] / counts[validcountmask]
-        values[~validcountmask] = grids[0].nodata
+                counts[r0-i0:r1-i0,c0-j0:c1-j0][mask] += weight
+                for iband in range(nbands):
+                    values[r0-i0:r1-i0,c0-j0:c1-j0,iband][mask] += \
+                            typ(window[:,:,iband][mask]) * weight
 
-        band = CompressedBand((ny, nx), typ, initval=grids[0].nodata)
-        band.setblock(0, 0, values)
-        outbands.append(band)
+            validcountmask = (counts!=0.0)
+            for iband, band in enumerate(outbands):
+                v = values[:,:,iband]
+                v[validcountmask] = v[validcountmask] / counts[validcountmask]
+                v[~validcountmask] = nodata
+                band.setblock(i0, j0, v)
 
     Tmerge = [xmin, ymin] + list(T[2:])
     return RegularGrid(Tmerge, bands=outbands, crs=grids[0].crs,
-                       nodata_value=grids[0].nodata)
+                       nodata_value=nodata)
 
 def get_nodata(T):
     """ Return a default value for NODATA given a type
@@ -1301,87 +1828,140 @@ def gridpoints(x, y, z, transform, crs):
     grid[:,:,0] = array
     return grid
 
-def mask_poly(xpoly, ypoly, nx, ny, transform):
-    """ Create a grid mask based on a clockwise-oriented polygon.
+def _normalize_transform(transform, nx, ny):
+    """ Return a transform describing the same cells with positive cell
+    dimensions, and whether rows and columns are reversed relative to the
+    original transform. """
+    ta, tb, tc, td, te, tf = transform
+    flipcols = tc < 0
+    fliprows = td < 0
+    if flipcols:
+        ta = ta + nx*tc
+        tb = tb + nx*tf
+        tc = -tc
+        tf = -tf
+    if fliprows:
+        ta = ta + ny*te
+        tb = tb + ny*td
+        td = -td
+        te = -te
+    return (ta, tb, tc, td, te, tf), fliprows, flipcols
+
+def _fill_rings(polygons, nx, ny, transform, values, window=None):
+    """ Burn polygons given as lists of (x, y) rings into an int32 array. The
+    first ring of each polygon is the exterior and the rest are holes. If
+    *window* is provided as (yoff, xoff, ny, nx), only cells of the grid
+    within the window are computed. """
+    T, fliprows, flipcols = _normalize_transform(transform, nx, ny)
+    ta, tb, tc, td, te, tf = T
+
+    if window is None:
+        window = (0, 0, ny, nx)
+    yoff, xoff, wny, wnx = window
+    if fliprows:
+        yoff = ny - yoff - wny
+    if flipcols:
+        xoff = nx - xoff - wnx
+
+    xs, ys, rings, polys = [], [], [0], [0]
+    for polygon in polygons:
+        for x, y in polygon:
+            xs.append(np.asarray(x, dtype=np.float64))
+            ys.append(np.asarray(y, dtype=np.float64))
+            rings.append(rings[-1] + len(xs[-1]))
+        polys.append(len(rings)-1)
+
+    out = np.zeros((wny, wnx), dtype=np.intc)
+    if len(xs) == 0:
+        return out
+    x = np.concatenate(xs)
+    y = np.concatenate(ys)
+
+    # positions in fractional row and column units from the grid edge
+    I = (y-tb - tf/tc*(x-ta)) / (td - tf*te/tc)
+    J = (x-ta - te/td*(y-tb)) / (tc - te*tf/td)
+    err = crfuncs.fill_polygons(I, J, np.asarray(rings, dtype=np.intp),
+                                np.asarray(polys, dtype=np.intp),
+                                np.asarray(values, dtype=np.intc), out,
+                                yoff, xoff)
+    if err != 0:
+        raise RuntimeError("failure in fill_polygons")
+
+    if fliprows:
+        out = out[::-1]
+    if flipcols:
+        out = out[:,::-1]
+    return out
+
+def rasterize(polys, nx, ny, transform, ids=None, crs=None):
+    """ Burn polygons into a grid-shaped array in a single pass. Holes
+    (`Polygon.subs`) are excluded.
 
     Parameters
     ----------
-    xpoly, ypoly : lists of floats
-        sequences of points representing polygon
+    polys : list of Polygon or Multipolygon instances
     nx : int
     ny : int
         size of grid
     transform : list[float]
         affine transformation describing grid layout and origin
         ``T == [x0, y0, dx, dy, sx, sy]``
+    ids : list of ints, optional
+        value to burn for each item of *polys*. Cells covered by more than one
+        polygon take the value of the last. If not provided, a boolean mask of
+        cells covered by any polygon is returned.
+    crs : karta.crs.CRS, optional
+        coordinate system of the grid, to which polygons are projected
 
     Returns
     -------
     ndarray
+        boolean array, or int32 array that is zero outside all polygons when
+        *ids* is provided
     """
-    mask = np.zeros((ny, nx), dtype=np.int8)
-
-    # find left southernmost index (will start and end on this point)
-    x0, y0 = xpoly[0], ypoly[0]
-    i_bot = 0
-    for i in range(1, len(ypoly)):
-        if ypoly[i] < y0 or (ypoly[i] == y0 and xpoly[i] < x0):
-            x0 = xpoly[i]
-            y0 = ypoly[i]
-            i_bot = i
-
-    x0 = xpoly[i_bot]
-    y0 = ypoly[i_bot]
-
-    # compute the grid indices of the starting point
-    ta, tb, tc, td, te, tf = transform
-
-    # normalize grid transform so increasing i, j corresponds to north, east
-    if tc < 0:
-        ta = ta + nx*tc
-        tc = -tc
-
-    if td < 0:
-        tb = tb + ny*td
-        td = -td
-
-    i0 = int(round((y0-tb - tf/tc*(x0-ta)) / (td - tf*te/tc)))
-    j0 = int(round((x0-ta - te/td*(y0-tb)) / (tc - te*tf/td)))
-
-    for el in range(1, len(xpoly)+1):
-        idx = (el + i_bot) % len(xpoly)
-        x1 = xpoly[idx]
-        y1 = ypoly[idx]
-
-        # (Unbounded) grid indices of the segment end points
-        i1 = int(round((y1-tb - tf/tc*(x1-ta)) / (td - tf*te/tc)))
-        j1 = int(round((x1-ta - te/td*(y1-tb)) / (tc - te*tf/td)))
-
-        # If segment is horizontal or off-grid, ignore
-        if ((0 <= i0 < ny) and (0 <= i1 < ny)) or (y1 != y0):
-
-            if y1 > y0:     # upward - mark grid cells to the right
-
-                for i in range(i0, i1):
-                    if (0 <= i < ny):
-                        j = int(round((i-i0) * (x1-x0)/(y1-y0) + j0))
-                        if j < nx:
-                            mask[i, max(0, j):] += 1
+    if ids is None:
+        values = np.ones(len(polys), dtype=np.intc)
+    else:
+        values = np.asarray(ids, dtype=np.intc)
+        if len(values) != len(polys):
+            raise ValueError("number of ids must equal number of polygons")
+
+    polygons = []
+    partvalues = []
+    for item, value in zip(polys, values):
+        if getattr(item, "_geotype", "") == "Multipolygon":
+            parts = [item[i] for i in range(len(item))]
+        else:
+            parts = [item]
+        for part in parts:
+            polygons.append([ring.coords(crs)[:2]
+                             for ring in [part] + list(part.subs)])
+            partvalues.append(value)
 
-            else:           # downward - unmark grid cells to the right
+    out = _fill_rings(polygons, nx, ny, transform, partvalues)
+    if ids is None:
+        return out.astype(np.bool_)
+    return out
 
-                for i in range(i1, i0):
-                    if (0 <= i < ny):
-                        j = int(round((i-i1) * (x1-x0)/(y1-y0) + j1))
-                        if j < nx:
-                            mask[i, max(0, j):] -= 1
+def mask_poly(xpoly, ypoly, nx, ny, transform):
+    """ Create a grid mask based on a polygon.
 
-        x0 = x1
-        y0 = y1
-        i0 = i1
-        j0 = j1
+    Parameters
+    ----------
+    xpoly, ypoly : lists of floats
+        sequences of points representing polygon
+    nx : int
+    ny : int
+        size of grid
+    transform : list[float]
+        affine transformation describing grid layout and origin
+        ``T == [x0, y0, dx, dy, sx, sy]``
 
-    return mask.astype(np.bool)
+    Returns
+    -------
+    ndarray
+    """
+    return _fill_rings([[(xpoly, ypoly)]], nx, ny, transform, [1]).astype(np.bool_)
 
 def newgrid(bbox, resolution=(1, 1), skew=(0, 0), dtype=np.float64, **kw):
     """ Simplified constructor for RegularGrid """
@@ -1389,3 +1969,5 @@ def newgrid(bbox, resolution=(1, 1), skew=(0, 0), dtype=np.float64, **kw):
     return RegularGrid([x0, y0, dx, dy, sx, sy],
                        values=np.zeros([ny, nx], dtype=dtype), **kw)
 
+# lazy depends on RegularGrid, so it is imported after the definitions above
+from .lazy import LazyGrid
@@ -0,0 +1,358 @@
+"""
+Deferred raster expressions
+
+A `LazyGrid` represents a raster computed from one or more RegularGrids by
+arithmetic, `apply()`, or neighbourhood (focal) operations. Nothing is
+computed when an expression is built. Values are computed window by window
+when a LazyGrid is indexed, written with `to_geotiff()`, or converted to a
+RegularGrid with `evaluate()`, so memory use is proportional to the window
+size rather than to the size of the grid.
+
+Usage
+-----
+    expr = (a.lazy() + b - c).apply(np.sqrt)
+    result = expr.evaluate(chunksize=(512, 512))
+"""
+
+import operator
+import numpy as np
+from . import _gdal
+from .band import BandIndexer, _pool_map
+from .grid import RegularGrid, get_nodata, BAND_CLASS_DEFAULT
+from .. import errors
+
+class LazyGrid(object):
+    """ Base class for nodes of a deferred raster expression. Subclasses
+    implement `_window(yoff, xoff, ny, nx)`, which returns an (ny, nx, nbands)
+    array. Windows may extend past the grid edges, in which case outside cells
+    are nodata. """
+
+    def __init__(self, transform, size, nbands, dtype, crs, nodata):
+        self.transform = tuple(transform)
+        self.size = tuple(size)
+        self.nbands = nbands
+        self.dtype = np.dtype(dtype)
+        self.crs = crs
+        self.nodata = nodata
+        self._memo = (None, None)
+
+    @classmethod
+    def from_grid(cls, grid):
+        """ Return a LazyGrid that reads from *grid* """
+        return _GridSource(grid)
+
+    def _window(self, yoff, xoff, ny, nx):
+        raise NotImplementedError()
+
+    def window(self, yoff, xoff, ny, nx):
+        """ Compute values in a window as an (ny, nx, nbands) array. The most
+        recent window is memoized, so that indexing multiple bands of the same
+        window evaluates the expression once. """
+        key = (yoff, xoff, ny, nx)
+        memo = self._memo
+        if memo[0] == key:
+            return memo[1]
+        values = self._window(yoff, xoff, ny, nx)
+        self._memo = (key, values)
+        return values
+
+    @property
+    def nodata_value(self):
+        return self.nodata
+
+    @property
+    def resolution(self):
+        return self.transform[2:4]
+
+    @property
+    def skew(self):
+        return self.transform[4:]
+
+    @property
+    def bands(self):
+        return [_LazyBand(self, i) for i in range(self.nbands)]
+
+    @property
+    def values(self):
+        return BandIndexer(self.bands)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def _binary(self, other, op, reverse=False):
+        if isinstance(other, RegularGrid):
+            other = _GridSource(other)
+        if isinstance(other, LazyGrid):
+            if (self.transform != other.transform) or (self.size != other.size):
+                raise ValueError(self, other)
+        operands = (other, self) if reverse else (self, other)
+        return _Elementwise(op, operands)
+
+    def __add__(self, other):
+        return self._binary(other, operator.add)
+
+    def __radd__(self, other):
+        return self._binary(other, operator.add, reverse=True)
+
+    def __sub__(self, other):
+        return self._binary(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self._binary(other, operator.sub, reverse=True)
+
+    def __mul__(self, other):
+        return self._binary(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self._binary(other, operator.mul, reverse=True)
+
+    def __truediv__(self, other):
+        return self._binary(other, operator.truediv)
+
+    def __rtruediv__(self, other):
+        return self._binary(other, operator.truediv, reverse=True)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, other):
+        return self._binary(other, operator.pow)
+
+    def __neg__(self):
+        return _Elementwise(operator.neg, (self,))
+
+    def apply(self, func):
+        """ Apply a vector function to grid values.
+
+        Parameters
+        ----------
+        func : callable
+            function that takes a vector of values and returns an equally-sized
+            vector of values with the same type
+
+        Returns
+        -------
+        LazyGrid
+        """
+        return _Elementwise(func, (self,))
+
+    def focal(self, func, halo, nbands=None, dtype=None, nodata=None,
+              edges=False):
+        """ Apply a neighbourhood function.
+
+        Parameters
+        ----------
+        func : callable
+            function that takes an (ny+2*halo, nx+2*halo, nbands) array and
+            returns an (ny, nx, nbands_out) array of values for the interior
+            cells. Cells beyond the grid edges are nodata.
+        halo : int
+            number of neighbouring cells required on each side
+        edges : bool, optional
+            if True, *func* is called as ``func(window, edges)``, where *edges*
+            is a tuple of four bools indicating whether the window includes the
+            first row, last row, first column, and last column of the grid
+            (default False)
+        nbands : int, optional
+            number of output bands (default same as input)
+        dtype : numpy dtype, optional
+            output type (default same as input)
+        nodata : number, optional
+            output nodata value (default same as input)
+
+        Returns
+        -------
+        LazyGrid
+        """
+        return _Focal(func, self, halo, nbands=nbands, dtype=dtype,
+                      nodata=nodata, edges=edges)
+
+    def _tiles(self, chunksize):
+        ny, nx = self.size
+        for i0 in range(0, ny, chunksize[0]):
+            for j0 in range(0, nx, chunksize[1]):
+                yield (i0, j0, min(chunksize[0], ny-i0), min(chunksize[1], nx-j0))
+
+    def evaluate(self, chunksize=(256, 256), bandclass=None, nthreads=1):
+        """ Compute the expression and return a RegularGrid.
+
+        Parameters
+        ----------
+        chunksize : tuple of two ints, optional
+            size of the windows evaluated at once (default (256, 256))
+        bandclass : class, optional
+            band class of the output grid (default BAND_CLASS_DEFAULT)
+        nthreads : int, optional
+            number of windows evaluated concurrently (default 1)
+
+        Returns
+        -------
+        RegularGrid
+        """
+        if bandclass is None:
+            bandclass = BAND_CLASS_DEFAULT
+        bands = [bandclass(self.size, self.dtype.type, initval=self.nodata)
+                 for _ in range(self.nbands)]
+
+        def compute(tile):
+            return tile, self._window(*tile)
+
+        # Windows are computed in batches on a shared pool. Band reads and
+        # writes made by its workers run serially.
+        tiles = list(self._tiles(chunksize))
+        if nthreads > 1:
+            batches = [tiles[i:i+2*nthreads]
+                       for i in range(0, len(tiles), 2*nthreads)]
+            results = (r for batch in batches
+                         for r in _pool_map(nthreads, compute, batch))
+        else:
+            results = (compute(tile) for tile in tiles)
+
+        for (i0, j0, _, _), values in results:
+            for i, band in enumerate(bands):
+                band.setblock(i0, j0, values[:,:,i])
+
+        return RegularGrid(self.transform, bands=bands, crs=self.crs,
+                           nodata_value=self.nodata)
+
+    def to_geotiff(self, fnm, compress="PACKBITS", tiled=False, **kw):
+        """ Compute the expression while writing to a GeoTiff file.
+
+        Parameters are the same as for `RegularGrid.to_geotiff`.
+        """
+        _gdal.write(fnm, self, compress=compress, tiled=tiled, **kw)
+        return self
+
+    def _data_mask(self, values):
+        """ Return a boolean array marking cells of *values* that are not
+        nodata. """
+        if _isnan(self.nodata):
+            return ~np.isnan(values)
+        return values != self.nodata
+
+class _LazyBand(object):
+    """ Band interface to one band of a LazyGrid """
+
+    def __init__(self, lazygrid, iband):
+        self.lazygrid = lazygrid
+        self.iband = iband
+        self.size = lazygrid.size
+        self.dtype = lazygrid.dtype.type
+
+    def getblock(self, yoff, xoff, ny, nx):
+        return self.lazygrid.window(yoff, xoff, ny, nx)[:,:,self.iband]
+
+    def setblock(self, yoff, xoff, array):
+        raise TypeError("LazyGrid values are read-only")
+
+class _GridSource(LazyGrid):
+    """ Leaf node reading from the bands of a RegularGrid """
+
+    def __init__(self, grid):
+        super(_GridSource, self).__init__(grid.transform, grid.size,
+                                          grid.nbands, grid.bands[0].dtype,
+                                          grid.crs, grid.nodata)
+        self.grid = grid
+
+    def _window(self, yoff, xoff, ny, nx):
+        gny, gnx = self.size
+        out = np.full((ny, nx, self.nbands), self.nodata, dtype=self.dtype)
+        y0, y1 = max(yoff, 0), min(yoff+ny, gny)
+        x0, x1 = max(xoff, 0), min(xoff+nx, gnx)
+        if y0 < y1 and x0 < x1:
+            for i, band in enumerate(self.grid.bands):
+                out[y0-yoff:y1-yoff, x0-xoff:x1-xoff, i] = \
+                        band.getblock(y0, x0, y1-y0, x1-x0)
+        return out
+
+def _probe_dtype(func, operands):
+    """ Determine the output type of *func* by evaluating it on single values """
+    args = [np.ones(1, dtype=op.dtype) if isinstance(op, LazyGrid) else op
+            for op in operands]
+    with np.errstate(all="ignore"):
+        return np.asarray(func(*args)).dtype
+
+class _Elementwise(LazyGrid):
+    """ Node applying a vectorized function to the data cells of one or more
+    operands. Output cells are nodata where any operand is nodata. """
+
+    def __init__(self, func, operands):
+        grids = [op for op in operands if isinstance(op, LazyGrid)]
+        first = grids[0]
+        nbands = max(g.nbands for g in grids)
+        for g in grids:
+            if g.nbands not in (1, nbands):
+                raise errors.GridError("operands have incompatible numbers "
+                                       "of bands")
+        dtype = _probe_dtype(func, operands)
+
+        nodata = first.nodata
+        if np.issubdtype(dtype, np.integer) and not _representable(nodata, dtype):
+            nodata = get_nodata(dtype.type)
+
+        super(_Elementwise, self).__init__(first.transform, first.size, nbands,
+                                           dtype, first.crs, nodata)
+        self.func = func
+        self.operands = operands
+
+    def _window(self, yoff, xoff, ny, nx):
+        shape = (ny, nx, self.nbands)
+        mask = np.ones(shape, dtype=np.bool_)
+        values = []
+        for op in self.operands:
+            if isinstance(op, LazyGrid):
+                v = op.window(yoff, xoff, ny, nx)
+                mask &= op._data_mask(v)
+                values.append(np.broadcast_to(v, shape))
+            else:
+                values.append(op)
+
+        out = np.full(shape, self.nodata, dtype=self.dtype)
+        args = [v[mask] if isinstance(v, np.ndarray) else v for v in values]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[mask] = self.func(*args)
+        return out
+
+class _Focal(LazyGrid):
+    """ Node applying a neighbourhood function, requesting windows from its
+    operand that are padded by a halo """
+
+    def __init__(self, func, operand, halo, nbands=None, dtype=None,
+                 nodata=None, edges=False):
+        if nbands is None:
+            nbands = operand.nbands
+        if dtype is None:
+            dtype = operand.dtype
+        if nodata is None:
+            nodata = operand.nodata
+        super(_Focal, self).__init__(operand.transform, operand.size, nbands,
+                                     dtype, operand.crs, nodata)
+        self.func = func
+        self.operand = operand
+        self.halo = halo
+        self.edges = edges
+
+    def _window(self, yoff, xoff, ny, nx):
+        h = self.halo
+        padded = self.operand.window(yoff-h, xoff-h, ny+2*h, nx+2*h)
+        if self.edges:
+            gny, gnx = self.size
+            edges = (yoff <= 0, yoff+ny >= gny, xoff <= 0, xoff+nx >= gnx)
+            out = np.asarray(self.func(padded, edges))
+        else:
+            out = np.asarray(self.func(padded))
+        if out.ndim == 2:
+            out = out[:,:,np.newaxis]
+        return out.astype(self.dtype, copy=False)
+
+def _isnan(value):
+    try:
+        return bool(np.isnan(value))
+    except TypeError:
+        return False
+
+def _representable(value, dtype):
+    if value is None or _isnan(value):
+        return False
+    info = np.iinfo(dtype)
+    return info.min <= value <= info.max
@@ -1,9 +1,48 @@
 """
 2D raster functions
+
+Neighbourhood functions (slope, aspect, gradient, divergence, hillshade) are
+computed in tiles padded by a halo of neighbouring cells, so that memory use
+is proportional to the tile size. Tiles may be computed concurrently with the
+*nthreads* argument. When passed a LazyGrid, these functions other than
+hillshade return a deferred LazyGrid expression.
 """
 
 import numpy as np
 from .grid import RegularGrid
+from .lazy import LazyGrid
+
+# Size of the tiles computed at once by neighbourhood functions
+CHUNKSIZE_DEFAULT = (512, 512)
+
+# Maximum number of values gathered in memory at once to compute percentiles
+_PERCENTILE_BUFFER = 1 << 22
+
+def _masked_source(grid, band):
+    """ Return a LazyGrid of *band* as float32, with NaN where any band of
+    *grid* is nodata """
+    src = grid if isinstance(grid, LazyGrid) else grid.lazy()
+    def masked(w):
+        return np.where(np.all(src._data_mask(w), axis=-1),
+                        w[:,:,band].astype(np.float32), np.nan)
+    return src.focal(masked, 0, nbands=1, dtype=np.float32, nodata=np.nan)
+
+def _result(expr, grid, chunksize, nthreads):
+    """ Return *expr* unevaluated when *grid* is a LazyGrid, and otherwise
+    evaluate it as a RegularGrid """
+    if isinstance(grid, LazyGrid):
+        return expr
+    if chunksize is None:
+        chunksize = CHUNKSIZE_DEFAULT
+    return expr.evaluate(chunksize=chunksize, nthreads=nthreads)
+
+def _split_bands(grid):
+    """ Return a list of single-band grids sharing the bands of *grid* """
+    if isinstance(grid, LazyGrid):
+        return [grid.focal(lambda w, i=i: w[:,:,i], 0, nbands=1)
+                for i in range(grid.nbands)]
+    return [RegularGrid(grid.transform, bands=[band], crs=grid.crs,
+                        nodata_value=grid.nodata) for band in grid.bands]
 
 def _slope(D, res=(1.0, 1.0)):
     """ Return the scalar slope at each pixel using the neighbourhood method.
@@ -17,18 +56,45 @@ def _slope(D, res=(1.0, 1.0)):
     return np.pad(np.sqrt(Ddx*Ddx + Ddy*Ddy), ((1, 1), (1, 1)), "reflect",
                   reflect_type="odd")
 
-def slope(grid, band=0):
+def _slope_window(D, edges, res=(1.0, 1.0)):
+    """ Return the slope for a window padded by three cells. Slope is computed
+    for a two cell halo so that values on the grid edges can be extrapolated
+    as in `_slope`. """
+    dx, dy = res
+    Ddx = ((2 * D[1:-1,2:] + D[:-2,2:] + D[2:,2:]) -
+           (2 * D[1:-1,:-2] + D[:-2,:-2] + D[2:,:-2])) / (8.0 * dx)
+    Ddy = ((2 * D[2:,1:-1] + D[2:,2:] + D[2:,:-2]) -
+           (2 * D[:-2,1:-1] + D[:-2,:-2] + D[:-2,2:])) / (8.0 * dy)
+    S = np.sqrt(Ddx*Ddx + Ddy*Ddy)
+
+    # rows are extrapolated first, as by np.pad
+    first_row, last_row, first_col, last_col = edges
+    if first_row:
+        S[2] = 2*S[3] - S[4]
+    if last_row:
+        S[-3] = 2*S[-4] - S[-5]
+    if first_col:
+        S[:,2] = 2*S[:,3] - S[:,4]
+    if last_col:
+        S[:,-3] = 2*S[:,-4] - S[:,-5]
+    return S[2:-2,2:-2]
+
+def slope(grid, band=0, chunksize=None, nthreads=1):
     """ Return the scalar slope at each pixel using the neighbourhood method.
 
     Parameters
     ----------
-    grid : RegularGrid
+    grid : RegularGrid or LazyGrid
     band : int, optional
         band to compute slope for (default 0)
+    chunksize : tuple of two ints, optional
+        size of tiles computed at once (default CHUNKSIZE_DEFAULT)
+    nthreads : int, optional
+        number of tiles computed concurrently (default 1)
 
     Returns
     -------
-    RegularGrid
+    RegularGrid, or LazyGrid if *grid* is a LazyGrid
 
     Notes
     -----
@@ -36,9 +102,10 @@ def slope(grid, band=0):
     """
     if grid.skew != (0, 0):
         raise NotImplementedError("slope calculations not implemented on skewed grids")
-    D = np.where(grid.data_mask, grid[:,:,band].astype(np.float32), np.nan)
-    return RegularGrid(grid.transform, _slope(D, grid.resolution),
-                       crs=grid.crs, nodata_value=np.nan)
+    res = grid.resolution
+    expr = _masked_source(grid, band).focal(
+            lambda D, edges: _slope_window(D, edges, res), 3, edges=True)
+    return _result(expr, grid, chunksize, nthreads)
 
 def _aspect(D, res=(1.0, 1.0)):
     """ Return the slope aspect for each pixel.
@@ -51,24 +118,37 @@ def _aspect(D, res=(1.0, 1.0)):
     return np.pad(np.arctan2(Ddy, -Ddx), ((1, 1), (1, 1)), "constant",
                   constant_values=(np.nan,))
 
-def aspect(grid, band=0):
+def _aspect_window(D, res=(1.0, 1.0)):
+    """ Return the slope aspect for a window padded by one cell. """
+    Ddx = ((2 * D[1:-1,2:] + D[:-2,2:] + D[2:,2:]) -
+           (2 * D[1:-1,:-2] + D[:-2,:-2] + D[2:,:-2])) / (8.0 * res[0])
+    Ddy = ((2 * D[2:,1:-1] + D[2:,2:] + D[2:,:-2]) -
+           (2 * D[:-2,1:-1] + D[:-2,:-2] + D[:-2,2:])) / (8.0 * res[1])
+    return np.arctan2(Ddy, -Ddx)
+
+def aspect(grid, band=0, chunksize=None, nthreads=1):
     """ Compute grid aspect.
 
     Parameters
     ----------
-    grid : RegularGrid
+    grid : RegularGrid or LazyGrid
     band : int, optional
         band to compute aspect for (default 0)
+    chunksize : tuple of two ints, optional
+        size of tiles computed at once (default CHUNKSIZE_DEFAULT)
+    nthreads : int, optional
+        number of tiles computed concurrently (default 1)
 
     Returns
     -------
-    RegularGrid
+    RegularGrid, or LazyGrid if *grid* is a LazyGrid
     """
     if grid.skew != (0, 0):
         raise NotImplementedError("aspect calculations not implemented on skewed grids")
-    D = np.where(grid.data_mask, grid[:,:,band].astype(np.float32), np.nan)
-    return RegularGrid(grid.transform, _aspect(D, grid.resolution),
-                       crs=grid.crs, nodata_value=np.nan)
+    res = grid.resolution
+    expr = _masked_source(grid, band).focal(
+            lambda D: _aspect_window(D, res), 1)
+    return _result(expr, grid, chunksize, nthreads)
 
 def _grad(D, res=(1.0, 1.0)):
     """ Computes the gradient of potential D. Return a tuple (dx, dy).
@@ -80,25 +160,39 @@ def _grad(D, res=(1.0, 1.0)):
     return (np.pad(Ddx, ((1, 1), (1, 1)), "constant", constant_values=(np.nan,)),
             np.pad(Ddy, ((1, 1), (1, 1)), "constant", constant_values=(np.nan,)))
 
-def gradient(grid, band=0):
+def _grad_window(D, res=(1.0, 1.0)):
+    """ Return the gradient for a window padded by one cell as a two-band
+    array. """
+    Ddx = ((2 * D[1:-1,2:] + D[:-2,2:] + D[2:,2:]) -
+           (2 * D[1:-1,:-2] + D[:-2,:-2] + D[2:,:-2])) / (8.0 * res[0])
+    Ddy = ((2 * D[2:,1:-1] + D[2:,2:] + D[2:,:-2]) -
+           (2 * D[:-2,1:-1] + D[:-2,:-2] + D[:-2,2:])) / (8.0 * res[1])
+    return np.concatenate([Ddx, Ddy], axis=-1)
+
+def gradient(grid, band=0, chunksize=None, nthreads=1):
     """ Compute gradient field from a grid.
 
     Parameters
     ----------
-    grid : RegularGrid
+    grid : RegularGrid or LazyGrid
     band : int, optional
         (default 0)
+    chunksize : tuple of two ints, optional
+        size of tiles computed at once (default CHUNKSIZE_DEFAULT)
+    nthreads : int, optional
+        number of tiles computed concurrently (default 1)
 
     Returns
     -------
-    (RegularGrid, RegularGrid)
+    (RegularGrid, RegularGrid), or (LazyGrid, LazyGrid) if *grid* is a
+    LazyGrid
     """
     if grid.skew != (0, 0):
         raise NotImplementedError("gradient calculations not implemented on skewed grids")
-    D = np.where(grid.data_mask, grid[:,:,band].astype(np.float32), np.nan)
-    dDdx, dDdy = _grad(D, grid.resolution)
-    return (RegularGrid(grid.transform, dDdx, crs=grid.crs, nodata_value=np.nan),
-            RegularGrid(grid.transform, dDdy, crs=grid.crs, nodata_value=np.nan))
+    res = grid.resolution
+    expr = _masked_source(grid, band).focal(
+            lambda D: _grad_window(D, res), 1, nbands=2)
+    return tuple(_split_bands(_result(expr, grid, chunksize, nthreads)))
 
 def _div(U, V, res=(1.0, 1.0)):
     """ Calculate the divergence of a vector field. """
@@ -108,26 +202,51 @@ def _div(U, V, res=(1.0, 1.0)):
                + np.pad(dVdy, ((1, 1), (0, 0)), "constant", constant_values=(np.nan,))
     return divergence
 
-def divergence(grid, bands=(0, 1)):
+def _div_window(W, edges, bands=(0, 1), res=(1.0, 1.0)):
+    """ Calculate the divergence of a vector field for a window padded by one
+    cell. """
+    U = W[:,:,bands[0]]
+    V = W[:,:,bands[1]]
+    dUdx = (U[1:-1,2:] - U[1:-1,:-2]) / (2.0*res[0])
+    dVdy = (V[2:,1:-1] - V[:-2,1:-1]) / (2.0*res[1])
+    divergence = dUdx + dVdy
+    first_row, last_row, first_col, last_col = edges
+    if first_row:
+        divergence[0] = np.nan
+    if last_row:
+        divergence[-1] = np.nan
+    if first_col:
+        divergence[:,0] = np.nan
+    if last_col:
+        divergence[:,-1] = np.nan
+    return divergence
+
+def divergence(grid, bands=(0, 1), chunksize=None, nthreads=1):
     """ Compute divergence from a grid.
 
     Parameters
     ----------
-    grid : RegularGrid
+    grid : RegularGrid or LazyGrid
     band : tuple of ints, optional
         indicates orthogonal velocity bands (default (0, 1))
+    chunksize : tuple of two ints, optional
+        size of tiles computed at once (default CHUNKSIZE_DEFAULT)
+    nthreads : int, optional
+        number of tiles computed concurrently (default 1)
 
     Returns
     -------
-    RegularGrid
+    RegularGrid, or LazyGrid if *grid* is a LazyGrid
     """
     if grid.skew != (0, 0):
         raise NotImplementedError("divergence calculations not implemented on skewed grids")
-    return RegularGrid(grid.transform,
-                       _div(grid[:,:,bands[0]],
-                            grid[:,:,bands[1]],
-                            grid.resolution),
-                       crs=grid.crs, nodata_value=np.nan)
+    res = grid.resolution
+    src = grid if isinstance(grid, LazyGrid) else grid.lazy()
+    probe = np.ones((3, 3, src.nbands), dtype=src.dtype)
+    dtype = _div_window(probe, (False,)*4, bands, res).dtype
+    expr = src.focal(lambda W, edges: _div_window(W, edges, bands, res), 1,
+                     nbands=1, dtype=dtype, nodata=np.nan, edges=True)
+    return _result(expr, grid, chunksize, nthreads)
 
 def _normed_potential_vectors(D, res=(1.0, 1.0)):
     """ Computes a U,V vector field of potential D. Scalar components of
@@ -164,18 +283,109 @@ def normed_potential_vectors(grid, band=0):
     return (RegularGrid(grid.transform, u, crs=grid.crs, nodata_value=np.nan),
             RegularGrid(grid.transform, v, crs=grid.crs, nodata_value=np.nan))
 
-def hillshade(grid, azimuth=330.0, elevation=60.0, band=0):
+def _hillshade_window(D, s, res=(1.0, 1.0)):
+    """ Return the unclipped illumination for a window padded by one cell """
+    g = _grad_window(D, res)
+    dx = g[:,:,0]
+    dy = g[:,:,1]
+    u = np.array((np.full_like(dx, res[0]), np.zeros_like(dx), dx))
+    v = np.array((np.zeros_like(dy), np.full_like(dy, res[1]), dy))
+    w = np.cross(u, v, axisa=0, axisb=0)
+    wunit = w / np.atleast_3d(np.sqrt(np.sum(w**2, axis=-1)))
+    smat = np.full((wunit.shape[0], wunit.shape[1], 3), s, dtype=np.float64)
+    return (wunit*smat).sum(axis=-1)
+
+def _band_chunks(band, chunksize):
+    """ Yield the non-NaN values of a band, chunk by chunk """
+    ny, nx = band.size
+    for i0 in range(0, ny, chunksize[0]):
+        for j0 in range(0, nx, chunksize[1]):
+            v = band.getblock(i0, j0, min(chunksize[0], ny-i0),
+                              min(chunksize[1], nx-j0))
+            yield v[~np.isnan(v)]
+
+def _select(band, k, chunksize, maxvalues, nbins=1024):
+    """ Return the *k*th smallest non-NaN value of a band, holding at most
+    *maxvalues* values in memory, by iteratively narrowing a histogram. """
+    lo = np.inf
+    hi = -np.inf
+    for v in _band_chunks(band, chunksize):
+        if len(v) != 0:
+            lo = min(lo, v.min())
+            hi = max(hi, v.max())
+
+    nbelow = 0          # number of values less than lo
+    include_hi = True   # whether the interval is closed on the right
+    while True:
+        if lo == hi or (np.nextafter(lo, np.inf) >= hi and not include_hi):
+            return lo
+
+        def within(v):
+            return v[(v >= lo) & ((v <= hi) if include_hi else (v < hi))]
+
+        edges = np.linspace(lo, hi, nbins+1)
+        counts = np.zeros(nbins, dtype=np.int64)
+        for v in _band_chunks(band, chunksize):
+            counts += np.histogram(within(v), edges)[0]
+
+        cumulative = nbelow + np.cumsum(counts)
+        b = int(np.searchsorted(cumulative, k, side="right"))
+        if counts[b] <= maxvalues:
+            lo_, hi_ = edges[b], edges[b+1]
+            last = (b == nbins-1) and include_hi
+            values = np.concatenate([v[(v >= lo_) & ((v <= hi_) if last else (v < hi_))]
+                                     for v in _band_chunks(band, chunksize)])
+            values.sort()
+            return values[k - (cumulative[b] - counts[b])]
+
+        nbelow = cumulative[b] - counts[b]
+        include_hi = (b == nbins-1) and include_hi
+        lo, hi = edges[b], edges[b+1]
+
+def _chunked_percentile(band, q, chunksize=None, maxvalues=None):
+    """ Compute percentiles of the non-NaN values of a band, equivalent to
+    `np.percentile` with linear interpolation. If there are more than
+    *maxvalues* values, order statistics are selected in several passes
+    rather than gathering all values in memory. """
+    if chunksize is None:
+        chunksize = CHUNKSIZE_DEFAULT
+    if maxvalues is None:
+        maxvalues = _PERCENTILE_BUFFER
+
+    n = sum(len(v) for v in _band_chunks(band, chunksize))
+    if n <= maxvalues:
+        values = np.concatenate(list(_band_chunks(band, chunksize)))
+        return np.percentile(values, q)
+
+    out = []
+    for q_ in q:
+        index = q_ / 100.0 * (n-1)
+        i0 = int(np.floor(index))
+        i1 = min(i0+1, n-1)
+        t = index - i0
+        a = _select(band, i0, chunksize, maxvalues)
+        b = _select(band, i1, chunksize, maxvalues) if t != 0 else a
+        diff = b - a
+        out.append(b - diff*(1-t) if t >= 0.5 else a + diff*t)
+    return np.array(out)
+
+def hillshade(grid, azimuth=330.0, elevation=60.0, band=0, chunksize=None,
+              nthreads=1):
     """ Return a hill-shaded version of *grid*.
 
     Parameters
     ----------
-    grid : RegularGrid
+    grid : RegularGrid or LazyGrid
     azimuth : float, optional
         direction of light source (default 330.0)
     elevation : float, optional
         height of light source (default 60.0)
     band : int, optional
         band to compute hillshade for (default 0)
+    chunksize : tuple of two ints, optional
+        size of tiles computed at once (default CHUNKSIZE_DEFAULT)
+    nthreads : int, optional
+        number of tiles computed concurrently (default 1)
 
     Returns
     -------
@@ -184,24 +394,27 @@ def hillshade(grid, azimuth=330.0, elevation=60.0, band=0):
     Notes
     -----
     Currently assumes orthogonal coordinates.
+
+    Output is clipped to the 2nd and 98th percentiles of illumination, so the
+    result is always evaluated, even when *grid* is a LazyGrid.
     """
-    dxgrid, dygrid = gradient(grid, band=band)
-    dx = dxgrid[:,:,0]
-    dy = dygrid[:,:,0]
+    if chunksize is None:
+        chunksize = CHUNKSIZE_DEFAULT
     res = grid.resolution
-    u = np.array((np.full_like(dx, res[0]), np.zeros_like(dx), dx))
-    v = np.array((np.zeros_like(dy), np.full_like(dy, res[1]), dy))
-    w = np.cross(u, v, axisa=0, axisb=0)
-    wunit = w / np.atleast_3d(np.sqrt(np.sum(w**2, axis=-1)))
-
     s = np.array((np.cos(azimuth*np.pi/180.0),
                   np.sin(azimuth*np.pi/180.0),
                   np.sin(elevation*np.pi/180.0)))
-    smat = np.full((wunit.shape[0], wunit.shape[1], 3), s, dtype=np.float64)
-    dprod = (wunit*smat).sum(axis=-1)
-
-    q = np.percentile(dprod[~np.isnan(dprod)], [2, 98])
-    np.clip(dprod, q[0], q[1], out=dprod)
-
-    return RegularGrid(grid.transform, values=dprod, crs=grid.crs)
+    expr = _masked_source(grid, band).focal(
+            lambda D: _hillshade_window(D, s, res), 1, dtype=np.float64)
+    out = expr.evaluate(chunksize=chunksize, nthreads=nthreads)
 
+    outband = out.bands[0]
+    q = _chunked_percentile(outband, [2, 98], chunksize)
+    ny, nx = outband.size
+    for i0 in range(0, ny, chunksize[0]):
+        for j0 in range(0, nx, chunksize[1]):
+            v = outband.getblock(i0, j0, min(chunksize[0], ny-i0),
+                                 min(chunksize[1], nx-j0)).copy()
+            np.clip(v, q[0], q[1], out=v)
+            outband.setblock(i0, j0, v)
+    return out
@@ -40,6 +40,10 @@ def read_geotiff(fnm, in_memory=True, ibands=_gdal.ALL, **kw):
         class of band used by returned grid (default karta.band.CompressedBand)
         if in_memory is True, this parameter is ignored and the returned grid
         will have bands of type karta.raster._gdal.GdalFileBand
+    update : bool, optional
+        if True and in_memory is False, bands are writable and modifications
+        are written to *fnm* when the bands are flushed or closed (default
+        False)
     """
     bands, hdr = _gdal.read(fnm, in_memory, ibands, **kw)
 
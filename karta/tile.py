@@ -1,6 +1,20 @@
+import copy
 import math
+import os
+import sqlite3
+import struct
+import time
+import zlib
+import multiprocessing
+import numpy as np
 from .vector.geometry import Point
-from .crs import LonLatWGS84
+from .crs import LonLatWGS84, WebMercator, GeographicalCRS
+
+# Maximum latitude of the square Web Mercator world
+MAX_LATITUDE = 85.0511287798066
+
+# Half the width of the Web Mercator world, in metres
+MERCATOR_HALF_WIDTH = math.pi * 6378137.0
 
 class Tile(object):
 
@@ -76,3 +90,303 @@ def tile_from_point(point, zoom):
     x = int(x0 // dlon)
     y = int(y0 // dlat)
     return Tile(z, x, y)
+
+def tiles_covering(bbox, zoom):
+    """ Return the tiles at a zoom level that overlap a geographical bounding
+    box.
+
+    Parameters
+    ----------
+    bbox : tuple
+        (lonmin, latmin, lonmax, latmax)
+    zoom : int
+        non-negative zoom level
+
+    Returns
+    -------
+    list of Tile
+        in row-major order, from the northwest tile
+    """
+    z = int(zoom)
+    n = 2**z
+    lonmin, latmin, lonmax, latmax = bbox
+
+    # tiles that only touch the eastern or southern edge are excluded
+    def column(lon, east=False):
+        c = (lon+180.0) / 360.0 * n
+        c = math.ceil(c)-1 if east else math.floor(c)
+        return min(n-1, max(0, int(c)))
+
+    def row(lat, south=False):
+        lat = min(MAX_LATITUDE, max(-MAX_LATITUDE, lat)) * math.pi / 180.0
+        r = (1.0 - math.log(math.tan(lat) + 1.0/math.cos(lat)) / math.pi) / 2.0 * n
+        r = math.ceil(r)-1 if south else math.floor(r)
+        return min(n-1, max(0, int(r)))
+
+    x0 = column(lonmin)
+    x1 = max(x0, column(lonmax, east=True))
+    y0 = row(latmax)
+    y1 = max(y0, row(latmin, south=True))
+    return [Tile(z, x, y) for y in range(y0, y1+1) for x in range(x0, x1+1)]
+
+def render_tiles(grid, zooms, path, format="directory", method="bilinear",
+                 vmin=None, vmax=None, tilesize=256, skip_empty=True,
+                 build_overviews=True, nprocesses=1):
+    """ Render a grid to a pyramid of Web Mercator (XYZ) PNG tiles.
+
+    Each tile is sampled from the coarsest overview of *grid* whose cells are
+    no larger than the tile pixels. Tiles are rendered in a pool of worker
+    processes and written by the calling process.
+
+    Parameters
+    ----------
+    grid : RegularGrid
+        grid with a geographical or projected coordinate system, and one
+        (greyscale), three (RGB), or four (RGBA) bands
+    zooms : iterable of ints
+        zoom levels to render
+    path : str
+        output directory, or MBTiles (SQLite) file
+    format : str, optional
+        "directory" (default) writes *path*/z/x/y.png, and "mbtiles" writes
+        the tiles table of an MBTiles file
+    method : str, optional
+        sampling method passed to `RegularGrid.sample` (default "bilinear")
+    vmin, vmax : float, optional
+        values mapped to 0 and 255. Default is the grid's minimum and maximum,
+        or no scaling for uint8 grids.
+    tilesize : int, optional
+        tile width and height in pixels (default 256)
+    skip_empty : bool, optional
+        if True (default), tiles without data are not written
+    build_overviews : bool, optional
+        if True (default) and *grid* has no overviews, build them for
+        rendering. They are built on a shallow copy, so *grid* itself is not
+        modified.
+    nprocesses : int, optional
+        number of worker processes (default 1)
+
+    Returns
+    -------
+    dict
+        statistics for each zoom level, with keys "tiles" (number rendered),
+        "written", "seconds", and "tiles_per_second"
+    """
+    zooms = list(zooms)
+    if format not in ("directory", "mbtiles"):
+        raise ValueError("tile format '{0}' not available".format(format))
+    if grid.nbands not in (1, 3, 4):
+        raise ValueError("grids with {0} bands cannot be rendered as "
+                         "tiles".format(grid.nbands))
+
+    dtype = np.dtype(grid.bands[0].dtype)
+    if dtype != np.uint8 and (vmin is None or vmax is None):
+        dmin, dmax = grid.minmax()
+        vmin = dmin if vmin is None else vmin
+        vmax = dmax if vmax is None else vmax
+    if build_overviews and not grid.overviews:
+        # build_overviews replaces the overview dict rather than updating it,
+        # so the copy shares bands with *grid* without altering it
+        grid = copy.copy(grid)
+        grid.build_overviews()
+
+    bbox = _lonlat_bbox(grid)
+    renderer = _TileRenderer(grid, method, vmin, vmax, tilesize, skip_empty)
+    if format == "directory":
+        writer = _DirectoryWriter(path)
+    else:
+        writer = _MBTilesWriter(path)
+    if nprocesses > 1:
+        pool = multiprocessing.Pool(nprocesses, initializer=_init_worker,
+                                    initargs=(renderer,))
+        render = lambda tiles: pool.imap_unordered(_render_in_worker, tiles,
+                                                   chunksize=4)
+    else:
+        pool = None
+        render = lambda tiles: (renderer(t) for t in tiles)
+
+    stats = {}
+    try:
+        for z in zooms:
+            start = time.time()
+            tiles = [(t.z, t.x, t.y) for t in tiles_covering(bbox, z)]
+            written = 0
+            for zxy, data in render(tiles):
+                if data is not None:
+                    writer.write(zxy, data)
+                    written += 1
+            writer.flush()
+            seconds = time.time() - start
+            stats[z] = {"tiles": len(tiles), "written": written,
+                        "seconds": seconds,
+                        "tiles_per_second": len(tiles)/seconds if seconds else
+                                            float("inf")}
+        writer.finish(bbox, zooms)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+    return stats
+
+def _lonlat_bbox(grid, n=64):
+    """ Geographical bounding box of the grid edges, sampled at *n* points
+    per side """
+    t = grid.transform
+    ny, nx = grid.size
+    s = np.linspace(0.0, 1.0, n)
+    i = np.r_[s*ny, np.full(n, ny), s[::-1]*ny, np.zeros(n)]
+    j = np.r_[np.zeros(n), s*nx, np.full(n, nx), s[::-1]*nx]
+    x = t[0] + j*t[2] + i*t[4]
+    y = t[1] + i*t[3] + j*t[5]
+    lon, lat = grid.crs.transform(LonLatWGS84, x, y)
+    return (np.min(lon), np.min(lat), np.max(lon), np.max(lat))
+
+class _TileRenderer(object):
+    """ Callable that renders the tile (z, x, y) as PNG bytes, or None if the
+    tile is empty and *skip_empty* is True """
+
+    def __init__(self, grid, method, vmin, vmax, tilesize, skip_empty):
+        self.grid = grid
+        self.method = method
+        self.vmin = vmin
+        self.vmax = vmax
+        self.tilesize = tilesize
+        self.skip_empty = skip_empty
+
+    def __call__(self, zxy):
+        z, x, y = zxy
+        grid = self.grid
+        n = self.tilesize
+        px = 2*MERCATOR_HALF_WIDTH / (n * 2**z)
+        xm = -MERCATOR_HALF_WIDTH + (x*n + np.arange(n) + 0.5) * px
+        ym = MERCATOR_HALF_WIDTH - (y*n + np.arange(n) + 0.5) * px
+        if isinstance(grid.crs, GeographicalCRS):
+            # longitude depends only on x and latitude only on y, so only the
+            # tile edges are transformed
+            lon, _ = WebMercator.transform(grid.crs, xm, np.full(n, ym[0]))
+            _, lat = WebMercator.transform(grid.crs, np.full(n, xm[0]), ym)
+            X, Y = np.meshgrid(lon, lat)
+        elif grid.crs != WebMercator:
+            X, Y = WebMercator.transform(grid.crs, *np.meshgrid(xm, ym))
+            X = np.asarray(X)
+            Y = np.asarray(Y)
+        else:
+            X, Y = np.meshgrid(xm, ym)
+
+        # pixel size in grid units, for choosing an overview
+        with np.errstate(invalid="ignore"):
+            resolution = min(np.nanmin(np.hypot(np.diff(X, axis=1),
+                                                np.diff(Y, axis=1))),
+                             np.nanmin(np.hypot(np.diff(X, axis=0),
+                                                np.diff(Y, axis=0))))
+        values = grid.sample(X, Y, method=self.method, resolution=resolution)
+
+        if np.isnan(grid.nodata):
+            mask = ~np.isnan(values).any(axis=0)
+        else:
+            mask = (values != grid.nodata).all(axis=0)
+        if self.skip_empty and not mask.any():
+            return zxy, None
+
+        if self.vmin is None or self.vmax is None:
+            image = values.astype(np.uint8)
+        else:
+            scale = 255.0 / (self.vmax-self.vmin) if self.vmax != self.vmin else 0.0
+            with np.errstate(invalid="ignore"):
+                scaled = np.clip((values-self.vmin) * scale, 0, 255)
+            image = np.where(np.isnan(scaled), 0, np.round(scaled)).astype(np.uint8)
+
+        alpha = np.where(mask, 255, 0).astype(np.uint8)
+        if len(image) == 4:
+            alpha = np.minimum(alpha, image[3])
+            image = image[:3]
+        pixels = np.concatenate([image, alpha[np.newaxis]], axis=0)
+        return zxy, _encode_png(pixels.transpose(1, 2, 0))
+
+_RENDERER = None
+
+def _init_worker(renderer):
+    global _RENDERER
+    _RENDERER = renderer
+
+def _render_in_worker(zxy):
+    return _RENDERER(zxy)
+
+def _encode_png(pixels):
+    """ Encode an (ny, nx, 2) grey-alpha or (ny, nx, 4) RGBA uint8 array as
+    PNG """
+    ny, nx, nchannels = pixels.shape
+    colortype = {2: 4, 4: 6}[nchannels]
+    # each scanline is preceded by a filter type byte (0, no filter)
+    raw = np.zeros((ny, nx*nchannels+1), dtype=np.uint8)
+    raw[:,1:] = pixels.reshape(ny, nx*nchannels)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data +
+                struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", nx, ny, 8, colortype, 0, 0, 0)
+    return b"".join([b"\x89PNG\r\n\x1a\n",
+                     chunk(b"IHDR", header),
+                     chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+                     chunk(b"IEND", b"")])
+
+class _DirectoryWriter(object):
+    """ Writes tiles to path/z/x/y.png """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, zxy, data):
+        z, x, y = zxy
+        dirname = os.path.join(self.path, str(z), str(x))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, "{0}.png".format(y)), "wb") as f:
+            f.write(data)
+
+    def flush(self):
+        pass
+
+    def finish(self, bbox, zooms):
+        pass
+
+    def close(self):
+        pass
+
+class _MBTilesWriter(object):
+    """ Writes tiles to an MBTiles SQLite file. MBTiles rows are numbered
+    from the south (TMS). """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS metadata "
+                          "(name TEXT, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tiles "
+                          "(zoom_level INTEGER, tile_column INTEGER, "
+                          "tile_row INTEGER, tile_data BLOB)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON "
+                          "tiles (zoom_level, tile_column, tile_row)")
+
+    def write(self, zxy, data):
+        z, x, y = zxy
+        self.conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                          (z, x, 2**z-1-y, sqlite3.Binary(data)))
+
+    def flush(self):
+        self.conn.commit()
+
+    def finish(self, bbox, zooms):
+        metadata = {"name": "karta", "format": "png", "type": "overlay",
+                    "bounds": ",".join(str(float(a)) for a in bbox)}
+        if len(zooms) != 0:
+            metadata["minzoom"] = str(min(zooms))
+            metadata["maxzoom"] = str(max(zooms))
+        self.conn.execute("DELETE FROM metadata")
+        self.conn.executemany("INSERT INTO metadata VALUES (?, ?)",
+                              sorted(metadata.items()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,5 +1,7 @@
-from libc.math cimport fabs
+from libc.math cimport fabs, fmin, fmax
 from cpython cimport bool
+import numpy as np
+cimport cython
 from coordstring.coordstring cimport CoordString
 from vectorgeo cimport Vector2
 
@@ -41,6 +43,243 @@ def contains(double x, double y, CoordString poly):
 
     return cnt != 0
 
+# Polygons with at least this many vertices are tested with an edge index by
+# contains_many, unless requested otherwise
+EDGE_INDEX_MIN_VERTICES = 32
+
+cdef inline int winding(double x, double y, const double *coords,
+                        const int *edges, int nedges) nogil:
+    """ Winding number of a ring around (x, y), counting the edges listed in
+    *edges*, where edge i runs from vertex i to vertex i+1 of the packed
+    (x, y) array *coords* """
+    cdef int cnt = 0
+    cdef int i, j
+    cdef Vector2 pt, pt0, pt1
+    pt.x = x
+    pt.y = y
+    for j in range(nedges):
+        i = edges[j]
+        pt0.x = coords[2*i]
+        pt0.y = coords[2*i+1]
+        pt1.x = coords[2*i+2]
+        pt1.y = coords[2*i+3]
+        if (pt0.y <= pt.y < pt1.y):
+            if isleft(pt, pt0, pt1) > 0:
+                cnt += 1
+        elif (pt0.y > pt.y >= pt1.y):
+            if isleft(pt, pt0, pt1) < 0:
+                cnt -= 1
+    return cnt
+
+cdef inline bint onsegment(Vector2 pt, Vector2 pt0, Vector2 pt1) nogil:
+    """ tests whether *pt*, which is collinear with (pt0, pt1), lies on the
+    segment """
+    return (fmin(pt0.x, pt1.x) <= pt.x <= fmax(pt0.x, pt1.x)) and \
+           (fmin(pt0.y, pt1.y) <= pt.y <= fmax(pt0.y, pt1.y))
+
+cdef inline bint segments_intersect(Vector2 p0, Vector2 p1,
+                                    Vector2 q0, Vector2 q1) nogil:
+    """ tests whether closed segments (p0, p1) and (q0, q1) share a point """
+    cdef double d0 = isleft(p0, q0, q1)
+    cdef double d1 = isleft(p1, q0, q1)
+    cdef double d2 = isleft(q0, p0, p1)
+    cdef double d3 = isleft(q1, p0, p1)
+    if (((d0 > 0 and d1 < 0) or (d0 < 0 and d1 > 0)) and
+        ((d2 > 0 and d3 < 0) or (d2 < 0 and d3 > 0))):
+        return True
+    return ((d0 == 0 and onsegment(p0, q0, q1)) or
+            (d1 == 0 and onsegment(p1, q0, q1)) or
+            (d2 == 0 and onsegment(q0, p0, p1)) or
+            (d3 == 0 and onsegment(q1, p0, p1)))
+
+cdef class EdgeIndex:
+    """ Edges of a closed ring, bucketed by the horizontal bands of equal height
+    that they span, so that a point or segment is only tested against edges
+    near its y coordinates.
+
+    Parameters
+    ----------
+    poly : CoordString
+        closed ring
+    nbins : int, optional
+        number of bands (default one per four edges)
+    """
+    cdef readonly int nedges
+    cdef readonly int nbins
+    cdef readonly double ymin
+    cdef readonly double ymax
+    cdef double scale
+    cdef double[::1] ring
+    cdef int[::1] offsets
+    cdef int[::1] edges
+
+    def __init__(self, CoordString poly, nbins=None):
+        cdef int i
+        if not poly.ring:
+            raise TypeError("EdgeIndex requires a closed CoordString")
+
+        self.nedges = poly.length
+        ring = np.empty(2*(self.nedges+1), dtype=np.float64)
+        for i in range(self.nedges):
+            ring[2*i] = poly.getX(i)
+            ring[2*i+1] = poly.getY(i)
+        if self.nedges != 0:
+            ring[2*self.nedges:] = ring[:2]
+        self.ring = ring
+
+        if nbins is None:
+            nbins = self.nedges // 4
+        self.nbins = max(1, nbins)
+        ring_y = ring[1::2]
+        if self.nedges == 0:
+            self.ymin = self.ymax = 0.0
+        else:
+            self.ymin = ring_y.min()
+            self.ymax = ring_y.max()
+        if self.ymax == self.ymin:
+            self.nbins = 1
+            self.scale = 0.0
+        else:
+            self.scale = self.nbins / (self.ymax - self.ymin)
+
+        # bucket edges in compressed sparse row form
+        y0 = ring_y[:-1]
+        y1 = ring_y[1:]
+        b0 = self._bins(np.minimum(y0, y1))
+        b1 = self._bins(np.maximum(y0, y1))
+        nspanned = b1 - b0 + 1
+        edges = np.repeat(np.arange(self.nedges, dtype=np.intc), nspanned)
+        starts = np.repeat(np.cumsum(nspanned) - nspanned, nspanned)
+        bins = np.repeat(b0, nspanned) + (np.arange(len(edges)) - starts)
+        order = np.argsort(bins, kind="mergesort")
+        offsets = np.zeros(self.nbins+1, dtype=np.intc)
+        np.cumsum(np.bincount(bins, minlength=self.nbins), out=offsets[1:])
+        self.offsets = offsets
+        self.edges = np.ascontiguousarray(edges[order], dtype=np.intc)
+        # keeps pointers to the edge array valid for empty bins
+        self.edges = np.append(self.edges, 0).astype(np.intc)
+
+    def _bins(self, y):
+        return np.clip(((y - self.ymin) * self.scale).astype(np.intc),
+                       0, self.nbins-1)
+
+    cdef inline int bin(self, double y) nogil:
+        cdef int b = <int> ((y - self.ymin) * self.scale)
+        if b < 0:
+            return 0
+        elif b >= self.nbins:
+            return self.nbins - 1
+        return b
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def contains_many(self, x, y):
+        """ Return whether the ring contains each of the points (x[i], y[i]),
+        using a winding number scheme. """
+        cdef double[::1] xa = np.ascontiguousarray(x, dtype=np.float64).ravel()
+        cdef double[::1] ya = np.ascontiguousarray(y, dtype=np.float64).ravel()
+        if xa.shape[0] != ya.shape[0]:
+            raise ValueError("x and y must have the same length")
+        cdef int n = xa.shape[0]
+        cdef int i, b
+        out = np.zeros(n, dtype=np.bool_)
+        cdef unsigned char[::1] result = out.view(np.uint8)
+        if n == 0 or self.nedges == 0:
+            return out
+
+        with nogil:
+            for i in range(n):
+                if not (self.ymin <= ya[i] < self.ymax):
+                    continue
+                b = self.bin(ya[i])
+                if winding(xa[i], ya[i], &self.ring[0],
+                           &self.edges[self.offsets[b]],
+                           self.offsets[b+1] - self.offsets[b]) != 0:
+                    result[i] = 1
+        return out
+
+    def contains(self, double x, double y):
+        """ Return whether the ring contains a point (x, y) """
+        cdef int b
+        if self.nedges == 0 or not (self.ymin <= y < self.ymax):
+            return False
+        b = self.bin(y)
+        return winding(x, y, &self.ring[0], &self.edges[self.offsets[b]],
+                       self.offsets[b+1] - self.offsets[b]) != 0
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def intersects(self, CoordString other):
+        """ Return whether any segment of *other* shares a point with an edge of
+        the ring """
+        cdef int nseg = other.length
+        cdef int i, j, k, b, b0, b1
+        cdef bint found = False
+        cdef Vector2 p0, p1, q0, q1
+        cdef double[::1] coords
+        if not other.ring:
+            nseg -= 1
+        if nseg < 1 or self.nedges == 0:
+            return False
+
+        coords = np.empty(2*(nseg+1), dtype=np.float64)
+        for i in range(nseg):
+            coords[2*i] = other.getX(i)
+            coords[2*i+1] = other.getY(i)
+        coords[2*nseg] = other.getX(nseg % other.length)
+        coords[2*nseg+1] = other.getY(nseg % other.length)
+
+        with nogil:
+            for i in range(nseg):
+                p0.x = coords[2*i]
+                p0.y = coords[2*i+1]
+                p1.x = coords[2*i+2]
+                p1.y = coords[2*i+3]
+                if fmax(p0.y, p1.y) < self.ymin or fmin(p0.y, p1.y) > self.ymax:
+                    continue
+                b0 = self.bin(fmin(p0.y, p1.y))
+                b1 = self.bin(fmax(p0.y, p1.y))
+                for b in range(b0, b1+1):
+                    for j in range(self.offsets[b], self.offsets[b+1]):
+                        k = self.edges[j]
+                        q0.x = self.ring[2*k]
+                        q0.y = self.ring[2*k+1]
+                        q1.x = self.ring[2*k+2]
+                        q1.y = self.ring[2*k+3]
+                        if segments_intersect(p0, p1, q0, q1):
+                            found = True
+                            break
+                    if found:
+                        break
+                if found:
+                    break
+        return found
+
+def contains_many(x, y, CoordString poly, index=None):
+    """ Uses a winding number scheme to compute whether *poly* contains each of
+    the points (x[i], y[i]).
+
+    Parameters
+    ----------
+    x, y : array-like
+        point coordinates
+    poly : CoordString
+        closed ring
+    index : bool, optional
+        whether to bucket the polygon edges by horizontal band, so that each
+        point is tested against nearby edges only. The default is to use an
+        index for rings with at least EDGE_INDEX_MIN_VERTICES vertices.
+
+    Returns
+    -------
+    ndarray of bools
+    """
+    if not poly.ring:
+        raise TypeError("contains requires a closed CoordString")
+    if index is None:
+        index = poly.length >= EDGE_INDEX_MIN_VERTICES
+    return EdgeIndex(poly, nbins=None if index else 1).contains_many(x, y)
+
 def contains_proj(double x, double y, CoordString poly, object crs):
     """ contains implementation for geographical coordinates.
     calls crs.inverse n times, making this relatively inefficient.
@@ -9,6 +9,7 @@ from __future__ import division
 import math
 import itertools
 import numbers
+import threading
 import numpy as np
 from coordstring import CoordString
 from .decorators import cache_decorator
@@ -29,6 +30,10 @@ from ..crs import Cartesian, CartesianCRS, GeographicalCRS
 from ..crs import SphericalEarth
 from ..errors import GeometryError, CRSError
 
+# Whether subsets of multipart geometries answer spatial queries with a view of
+# the parent's index, when the parent's index has already been constructed
+SHARE_SUBSET_INDEXES = True
+
 class Geometry(object):
     """ Abstract base class for all geometry types """
 
@@ -592,10 +597,8 @@ class MultiVertexMixin(object):
 
     def any_within_poly(self, poly):
         """ Return whether any vertices are inside *poly* """
-        for pt in self:
-            if poly.contains(pt):
-                return True
-        return False
+        x, y = self.coords()
+        return bool(np.any(poly.contains_many(x, y, crs=self.crs)))
 
     def convex_hull(self):
         """ Return a Polygon representing the convex hull.
@@ -654,13 +657,10 @@ class ConnectedMultiVertexMixin(MultiVertexMixin):
           provided by the CRS instance.
         """
         if isinstance(self.crs, GeographicalCRS):
-            lon, lat = self.vertices()[0][:2]
-            d = 0.0
-            for xy in self.vertices()[1:]:
-                d += self.crs.inverse(lon, lat, xy[0], xy[1])[2]
-                lon = xy[0]
-                lat = xy[1]
-            return d
+            x, y = self._vertices.vectors(drop_z=True)
+            if len(x) < 2:
+                return 0.0
+            return float(np.sum(self.crs.inverse(x[:-1], y[:-1], x[1:], y[1:])[2]))
         else:
             return _cvectorgeo.length(self._vertices)
 
@@ -1043,8 +1043,8 @@ class Polygon(MultiVertexBase, Rotatable, ConnectedMultiVertexMixin, GeoJSONOutM
 
     def isclockwise(self):
         """ Return whether polygon winds clockwise around its interior. """
-        s = sum((seg[1][0] - seg[0][0]) * (seg[1][1] + seg[0][1])
-                        for seg in self.segment_tuples)
+        x, y = self._vertices.vectors(drop_z=True)
+        s = np.sum((x - np.roll(x, 1)) * (y + np.roll(y, 1)))
         return s > 0
 
     def ispolar(self, pole=None):
@@ -1103,8 +1103,13 @@ class Polygon(MultiVertexBase, Rotatable, ConnectedMultiVertexMixin, GeoJSONOutM
         -----
         - If CRS is Geographical, uses distance defined by the CRS instance.
         """
-        return sum(seg.length for seg in self.segments) + \
-                sum([p.perimeter for p in self.subs])
+        x, y = self._vertices.vectors(drop_z=True)
+        x0, y0 = np.roll(x, 1), np.roll(y, 1)
+        if isinstance(self.crs, GeographicalCRS):
+            perimeter = np.sum(self.crs.inverse(x0, y0, x, y)[2])
+        else:
+            perimeter = np.sum(np.sqrt((x-x0)**2 + (y-y0)**2))
+        return float(perimeter) + sum([p.perimeter for p in self.subs])
 
     @property
     def area(self):
@@ -1116,41 +1121,33 @@ class Polygon(MultiVertexBase, Rotatable, ConnectedMultiVertexMixin, GeoJSONOutM
         - If CRS is Geographical, uses either a spherical or an ellipsoidal
           calculation.
         """
+        x, y = self._vertices.vectors(drop_z=True)
+        x1, y1 = np.roll(x, 1), np.roll(y, 1)
         if isinstance(self.crs, GeographicalCRS):
             major_axis = self.crs.ellipsoid.a
             minor_axis = self.crs.ellipsoid.b
 
-            area = 0.0
             if major_axis == minor_axis:    # Sphere
-                for seg in self.segment_tuples:
-                    x1, y1 = seg[0]
-                    x2, y2 = seg[1]
-                    area += geodesy.spherical_area(major_axis, x1, y1, x2, y2)
-
+                area = np.sum(geodesy.spherical_area(major_axis, x1, y1, x, y))
             else:
-                for seg in self.segment_tuples:
-                    x1, y1 = seg[0]
-                    x2, y2 = seg[1]
-                    area += geodesy.ellipsoidal_area(major_axis, minor_axis,
-                                                     x1, y1, x2, y2)
+                area = np.sum(geodesy.ellipsoidal_area(major_axis, minor_axis,
+                                                       x1, y1, x, y))
 
         else:
             # Cartesian coordinate systems
-            x, y = self.coords()
-            x0 = np.min(x)
-            area = (0.5*(x[0] + x[-1]) - x0) * (y[0] - y[-1])
-            area += sum((0.5*(x[i+1]+x[i]) - x0) * (y[i+1] - y[i]) for i in range(len(x)-1))
-        return abs(area) - sum(sub.area for sub in self.subs)
+            xmin = np.min(x)
+            area = np.sum((0.5*(x+x1) - xmin) * (y-y1))
+        return abs(float(area)) - sum(sub.area for sub in self.subs)
 
     @property
     def centroid(self):
         """ Return Polygon centroid as a Point, ignoring sub-polygons. """
-        x, y = self.coords()
-        A = 0.5 * sum(x[i]*y[i+1] - x[i+1]*y[i] for i in range(-1, len(self)-1))
-        cx = sum((x[i] + x[i+1]) * (x[i]*y[i+1] - x[i+1]*y[i])
-                    for i in range(-1, len(self)-1)) / (6*A)
-        cy = sum((y[i] + y[i+1]) * (x[i]*y[i+1] - x[i+1]*y[i])
-                    for i in range(-1, len(self)-1)) / (6*A)
+        x, y = self._vertices.vectors(drop_z=True)
+        x1, y1 = np.roll(x, 1), np.roll(y, 1)
+        cross = x1*y - x*y1
+        A = 0.5 * np.sum(cross)
+        cx = float(np.sum((x1 + x) * cross) / (6*A))
+        cy = float(np.sum((y1 + y) * cross) / (6*A))
         return Point((cx, cy), properties=self.properties, crs=self.crs)
 
     def contains(self, point):
@@ -1173,11 +1170,142 @@ class Polygon(MultiVertexBase, Rotatable, ConnectedMultiVertexMixin, GeoJSONOutM
             return _ccontains.contains(x, y, self._vertices) and \
                     not any(p.contains(point) for p in self.subs)
 
+    def contains_many(self, x, y, crs=None):
+        """ Test whether the polygon contains each of many points.
+
+        Parameters
+        ----------
+        x, y : array-like
+            point coordinates
+        crs : karta.CRS, optional
+            coordinate system of *x* and *y* (default polygon CRS)
+
+        Returns
+        -------
+        ndarray of bools
+
+        Notes
+        -----
+        - Equivalent to calling `contains` for each point, but planar tests are
+          performed in a single compiled loop.
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        if crs is not None and crs != self.crs:
+            x, y = _reproject((x, y), crs, self.crs)
+            x = np.asarray(x, dtype=np.float64)
+            y = np.asarray(y, dtype=np.float64)
+        if isinstance(self.crs, GeographicalCRS) and self.ispolar():
+            result = np.array([_ccontains.contains_proj(xi, yi, self._vertices,
+                                                        self.crs)
+                               for xi, yi in zip(x, y)], dtype=np.bool_)
+        else:
+            result = _ccontains.contains_many(x, y, self._vertices)
+        for p in self.subs:
+            if np.any(result):
+                result[result] &= ~p.contains_many(x[result], y[result])
+        return result
+
+    def prepare(self):
+        """ Return a PreparedPolygon, which precomputes edge indexes, bounding
+        boxes, and polar status for repeated `contains` and `intersects` tests.
+
+        The prepared polygon does not reflect later changes to this polygon.
+        """
+        return PreparedPolygon(self)
+
     def to_line(self):
         """ Returns a self-closing polyline. Discards sub-polygons. """
         v = self._vertices + self._vertices[0]
         return Line(v, properties=self.properties, crs=self.crs)
 
+class PreparedPolygon(object):
+    """ Polygon prepared for repeated containment and intersection tests.
+    Created by `Polygon.prepare()`.
+
+    The edges of the exterior and of each hole are bucketed by horizontal
+    band, so that a test only visits the edges near the y coordinates of the
+    query geometry.
+    """
+
+    def __init__(self, polygon):
+        self.polygon = polygon
+        self.crs = polygon.crs
+        self._bbox = polygon.bbox()
+        self._polar = isinstance(self.crs, GeographicalCRS) and polygon.ispolar()
+        self._exterior = _ccontains.EdgeIndex(polygon._vertices)
+        self._holes = [(sub.bbox(crs=self.crs),
+                        _ccontains.EdgeIndex(sub._vertices))
+                       for sub in polygon.subs]
+        return
+
+    def __repr__(self):
+        return "PreparedPolygon({0!r})".format(self.polygon)
+
+    def bbox(self, crs=None):
+        if crs is None or crs == self.crs:
+            return self._bbox
+        return self.polygon.bbox(crs=crs)
+
+    def contains(self, point):
+        """ Returns True if point is inside or on the boundary of the polygon,
+        and False otherwise. Equivalent to `Polygon.contains`.
+        """
+        x, y = point.vertex(crs=self.crs)[:2]
+        if self._polar:
+            return self.polygon.contains(point)
+        bb = self._bbox
+        if not (bb[0] <= x <= bb[2] and bb[1] <= y <= bb[3]):
+            return False
+        if not self._exterior.contains(x, y):
+            return False
+        for bb, hole in self._holes:
+            if (bb[0] <= x <= bb[2] and bb[1] <= y <= bb[3]) and \
+                    hole.contains(x, y):
+                return False
+        return True
+
+    def contains_many(self, x, y, crs=None):
+        """ Test whether the polygon contains each of many points.
+        Equivalent to `Polygon.contains_many`.
+        """
+        if self._polar:
+            return self.polygon.contains_many(x, y, crs=crs)
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        if crs is not None and crs != self.crs:
+            x, y = _reproject((x, y), crs, self.crs)
+            x = np.asarray(x, dtype=np.float64)
+            y = np.asarray(y, dtype=np.float64)
+        result = self._exterior.contains_many(x, y)
+        for bb, hole in self._holes:
+            candidates = np.flatnonzero(result & (bb[0] <= x) & (x <= bb[2]) &
+                                        (bb[1] <= y) & (y <= bb[3]))
+            if len(candidates) != 0:
+                result[candidates] &= ~hole.contains_many(x[candidates],
+                                                          y[candidates])
+        return result
+
+    def intersects(self, other):
+        """ Return whether the boundary of the polygon intersects another
+        geometry with multiple connected vertices.
+
+        Notes
+        -----
+        - If CRS is Geographical, uses `Polygon.intersects`.
+        - Boundaries that touch at a single point are considered to intersect.
+        """
+        if not _cintersection.bboxes_overlap(self._bbox, other.bbox(self.crs)):
+            return False
+        if isinstance(self.crs, GeographicalCRS):
+            return self.polygon.intersects(other)
+        if other.crs == self.crs:
+            vertices = other._vertices
+        else:
+            vertices = CoordString(other.vertices(crs=self.crs, drop_z=True),
+                                   ring=other._vertices.ring)
+        return self._exterior.intersects(vertices)
+
 class Multipart(Geometry):
     """ Base for objects consisting of multiple singular types. """
 
@@ -1229,6 +1357,39 @@ class Multipart(Geometry):
     def __len__(self):
         return len(self._vertices)
 
+    def _new_index(self):
+        raise NotImplementedError()
+
+    def _spatial_index(self):
+        """ Return the spatial index, constructing it on first use. """
+        index = getattr(self, "_index", None)
+        if index is None:
+            if not getattr(self, "_build_index", True):
+                raise AttributeError("{0} was created with build_index=False"
+                                     .format(type(self).__name__))
+            index = self._new_index()
+            self._index = index
+        return index
+
+    def _inherit_index(self, parent, indices):
+        """ Answer spatial queries with a view of *parent*'s index, restricted
+        to the members at *indices*, if the parent's index has been constructed.
+        """
+        index = getattr(parent, "_index", None)
+        if not SHARE_SUBSET_INDEXES or index is None or \
+                not getattr(self, "_build_index", True):
+            return
+        indices = np.asarray(indices, dtype=np.intp)
+        # the members must correspond one-to-one with *indices*, which is not
+        # the case e.g. for CoordString slices with negative strides
+        if len(indices) != len(self) or len(np.unique(indices)) != len(indices):
+            return
+        if isinstance(index, _SubsetIndex):
+            indices = index.indices[indices]
+            index = index.index
+        self._index = _SubsetIndex(index, indices)
+        return
+
 
 class Multipoint(Multipart, Rotatable, MultiVertexMixin, GeoJSONOutMixin, ShapefileOutMixin):
     """ Point cloud with associated attributes.
@@ -1263,11 +1424,29 @@ class Multipoint(Multipart, Rotatable, MultiVertexMixin, GeoJSONOutMixin, Shapef
             self._vertices = CoordString(inputs)
 
         super(Multipoint, self).__init__(inputs, **kwargs)
-        if build_index:
-            self.quadtree = QuadTree(self._vertices, leaf_capacity=50)
+        self._build_index = build_index
+        self._index = None
         self._geotype = "Multipoint"
         return
 
+    def _new_index(self):
+        return QuadTree(self._vertices, leaf_capacity=50)
+
+    @property
+    def quadtree(self):
+        """ QuadTree index of the vertices, which is constructed when first
+        needed unless `build_index=False` was passed to the constructor. """
+        return self._spatial_index()
+
+    @quadtree.setter
+    def quadtree(self, index):
+        self._index = index
+
+    def _subset(self, idxs):
+        subset = super(Multipoint, self)._subset(idxs)
+        subset._inherit_index(self, idxs)
+        return subset
+
     def __getitem__(self, key):
         if isinstance(key, numbers.Integral):
             p = self.d[key]
@@ -1275,14 +1454,17 @@ class Multipoint(Multipart, Rotatable, MultiVertexMixin, GeoJSONOutMixin, Shapef
             return Point(self._vertices[key], properties=p, crs=self.crs)
         elif isinstance(key, slice):
             start, stop, stride = key.indices(len(self._vertices))
-            return Multipoint(self._vertices.slice(start, stop, stride),
-                              properties=self.properties,
-                              data=self.d[key], crs=self.crs)
+            subset = Multipoint(self._vertices.slice(start, stop, stride),
+                                properties=self.properties,
+                                data=self.d[key], crs=self.crs)
+            subset._inherit_index(self, range(start, stop, stride))
+            return subset
         else:
             raise KeyError(type(key))
 
     def __setitem__(self, key, value):
         if isinstance(key, numbers.Integral):
+            self._index = None
             if hasattr(value, "vertex"):
                 self._vertices[key] = np.array(value.vertex(self.crs), dtype=np.float64)
                 row = []
@@ -1346,6 +1528,95 @@ class Multipoint(Multipart, Rotatable, MultiVertexMixin, GeoJSONOutMixin, Shapef
         data = table.merge(mappings)
         return Multipoint(np.vstack(vertices), data=data, crs=crs)
 
+    def nearest_vertex_to(self, point):
+        """ Returns the index of the vertex that is nearest to a point. If two
+        points are equidistant, only one will be returned.
+
+        Parameters
+        ----------
+        point : Point
+            target point
+
+        Returns
+        -------
+        int
+        """
+        if hasattr(self, "quadtree") and (self._vertices.rank == 2) and \
+                not isinstance(self.crs, GeographicalCRS):
+            return self.nearest(point, k=1)[0][0,0]
+        return super(Multipoint, self).nearest_vertex_to(point)
+
+    def nearest(self, points, k=1, nthreads=1):
+        """ Find the vertices nearest to each of a set of query points.
+
+        Parameters
+        ----------
+        points : Point, Multipoint, or array-like
+            query points, either as geometries or as an (n, 2) array of
+            coordinates in the coordinate system of the Multipoint
+        k : int, optional
+            number of vertices to find for each query point (default 1)
+        nthreads : int, optional
+            number of threads among which queries are divided (default 1)
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            (n, k) arrays of vertex indices and distances, ordered by
+            increasing distance. When the Multipoint has fewer than *k*
+            vertices, indices are padded with -1 and distances with inf.
+
+        Notes
+        -----
+        - Distances are two-dimensional and Euclidean in the coordinate system
+          of the Multipoint, so a geographical CRS raises CRSError.
+        """
+        if isinstance(self.crs, GeographicalCRS):
+            raise CRSError("nearest requires a Cartesian or projected CRS")
+
+        t = getattr(points, "_geotype", None)
+        if t == "Point":
+            xy = np.array([points.vertex(crs=self.crs)[:2]])
+        elif t == "Multipoint":
+            xy = points.vertices(crs=self.crs)[:,:2]
+        else:
+            xy = np.atleast_2d(np.asarray(points, dtype=np.float64))[:,:2]
+
+        quadtree = getattr(self, "quadtree", None)
+        if quadtree is None:
+            quadtree = QuadTree(self._vertices, leaf_capacity=50)
+
+        def query(bounds):
+            i0, i1 = bounds
+            return quadtree.nearest(xy[i0:i1,0], xy[i0:i1,1], k)
+
+        if nthreads > 1 and len(xy) > nthreads:
+            # queries release the GIL, so plain threads are enough, and avoid
+            # starting a pool for every call
+            bounds = np.linspace(0, len(xy), nthreads+1).astype(int)
+            chunks = list(zip(bounds[:-1], bounds[1:]))
+            results = [None] * len(chunks)
+            errors = []
+
+            def run(n):
+                try:
+                    results[n] = query(chunks[n])
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run, args=(n,))
+                       for n in range(1, len(chunks))]
+            for thread in threads:
+                thread.start()
+            run(0)
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+            return (np.vstack([r[0] for r in results]),
+                    np.vstack([r[1] for r in results]))
+        return query((0, len(xy)))
+
     def within_radius(self, point, radius):
         """ Return subset of Multipoint within a radius. Items on the border
         are excluded.
@@ -1391,18 +1662,15 @@ class Multipoint(Multipart, Rotatable, MultiVertexMixin, GeoJSONOutMixin, Shapef
     def within_polygon(self, poly):
         """ Return Multipoint subset that is within a polygon.
         """
+        x, y = self.coords()
         if hasattr(self, "quadtree"):
             bbox = poly.bbox(crs=self.crs)
-            candidate_indices = self.quadtree.search_within(*bbox)
-            confirmed_indices = []
-            for i in candidate_indices:
-                if poly.contains(self[i]):
-                    confirmed_indices.append(i)
-            confirmed_indices.sort()
+            candidates = np.sort(np.asarray(self.quadtree.search_within(*bbox),
+                                            dtype=np.intp))
         else:
-            confirmed_indices = [i for (i, point) in enumerate(self)
-                                   if poly.contains(point)]
-        return self._subset(confirmed_indices)
+            candidates = np.arange(len(x))
+        inside = poly.contains_many(x[candidates], y[candidates], crs=self.crs)
+        return self._subset(candidates[inside])
 
 class MultiVertexMultipartMixin(object):
     """ Mix-in class for multipart classes for which it is reasonable to ask
@@ -1412,6 +1680,23 @@ class MultiVertexMultipartMixin(object):
     - "which members touch this Line/Polygon?"
     - "which members are contained by this Polygon?"
     """
+    @property
+    def rtree(self):
+        """ RTree index of the member bounding boxes, which is constructed when
+        first needed unless `build_index=False` was passed to the constructor.
+        """
+        return self._spatial_index()
+
+    @rtree.setter
+    def rtree(self, index):
+        self._index = index
+
+    def _members(self, indices):
+        """ Return a geometry of the members at *indices* """
+        subset = type(self)([self[i] for i in indices])
+        subset._inherit_index(self, indices)
+        return subset
+
     @cache_decorator("bbox")
     def bbox(self, crs=None):
         bbs = [part.bbox(crs=crs) for part in self]
@@ -1479,7 +1764,7 @@ class MultiVertexMultipartMixin(object):
             (xmin, ymin, xmax, ymax)
         """
         indices = self.rtree.search_within(bbox, max_results=max_results)
-        return type(self)([self[i] for i in indices])
+        return self._members(indices)
 
     def touching_bbox(self, bbox, max_results=-1):
         """ Return Multipart geometry representing member geometries that touch
@@ -1491,7 +1776,7 @@ class MultiVertexMultipartMixin(object):
             (xmin, ymin, xmax, ymax)
         """
         indices = self.rtree.search_overlapping(bbox, max_results=max_results)
-        return type(self)([self[i] for i in indices])
+        return self._members(indices)
 
     def touching(self, geom):
         """ Return a Multipart geometry representing member geometries that
@@ -1513,16 +1798,16 @@ class MultiVertexMultipartMixin(object):
             for i in indices:
                 test_geom = self[i]
                 if geom.intersects(test_geom):
-                    results.append(test_geom)
+                    results.append(i)
         elif isinstance(geom, Polygon):
             for i in indices:
                 test_geom = self[i]
                 pt = test_geom[0]
                 if geom.contains(pt) or geom.intersects(test_geom):
-                    results.append(test_geom)
+                    results.append(i)
         else:
             raise TypeError("argument must be Line or Polygon")
-        return type(self)(results)
+        return self._members(results)
 
     def within(self, geom):
         """ Return a Multipart geometry representing member geometries
@@ -1540,8 +1825,8 @@ class MultiVertexMultipartMixin(object):
             test_geom = self[i]
             pt = test_geom[0]
             if geom.contains(pt) and not geom.intersects(test_geom):
-                results.append(test_geom)
-        return type(self)(results)
+                results.append(i)
+        return self._members(results)
 
 class Multiline(Multipart, MultiVertexMultipartMixin, GeoJSONOutMixin,
                 ShapefileOutMixin):
@@ -1572,19 +1857,24 @@ class Multiline(Multipart, MultiVertexMultipartMixin, GeoJSONOutMixin,
         else:
             self._vertices = [CoordString(part) for part in inputs]
         super(Multiline, self).__init__(inputs, **kwargs)
-        if build_index:
-            self.rtree = RTree(self._vertices)
+        self._build_index = build_index
+        self._index = None
         self._geotype = "Multiline"
         return
 
+    def _new_index(self):
+        return RTree(self._vertices)
+
     def __getitem__(self, key):
         if isinstance(key, numbers.Integral):
             properties = self.d[key]
             properties.update(self.properties)
             return Line(self._vertices[key], properties=properties, crs=self.crs)
         elif isinstance(key, slice):
-            return Multiline(self._vertices[key], properties=self.properties,
-                             data=self.d[key], crs=self.crs)
+            subset = Multiline(self._vertices[key], properties=self.properties,
+                               data=self.d[key], crs=self.crs)
+            subset._inherit_index(self, range(*key.indices(len(self))))
+            return subset
         else:
             raise KeyError(type(key))
 
@@ -1697,11 +1987,14 @@ class Multipolygon(Multipart, MultiVertexMultipartMixin, GeoJSONOutMixin,
                 rings = [CoordString(ring) for ring in part]
                 self._vertices.append(rings)
         super(Multipolygon, self).__init__(inputs, **kwargs)
-        if build_index:
-            self.rtree = RTree([v[0] for v in self._vertices])
+        self._build_index = build_index
+        self._index = None
         self._geotype = "Multipolygon"
         return
 
+    def _new_index(self):
+        return RTree([v[0] for v in self._vertices])
+
     def __getitem__(self, key):
         if isinstance(key, numbers.Integral):
             properties = self.d[key]
@@ -1712,8 +2005,10 @@ class Multipolygon(Multipart, MultiVertexMultipartMixin, GeoJSONOutMixin,
             vertices = self._vertices[key][0]
             return Polygon(vertices, subs=subs, properties=properties, crs=self.crs)
         elif isinstance(key, slice):
-            return Multipolygon(self._vertices[key], properties=self.properties,
-                                data=self.d[key], crs=self.crs)
+            subset = Multipolygon(self._vertices[key], properties=self.properties,
+                                  data=self.d[key], crs=self.crs)
+            subset._inherit_index(self, range(*key.indices(len(self))))
+            return subset
         else:
             raise KeyError(type(key))
 
@@ -1815,6 +2110,74 @@ class Multipolygon(Multipart, MultiVertexMultipartMixin, GeoJSONOutMixin,
             ret.append(poly)
         return ret
 
+class _SubsetIndex(object):
+    """ View of a QuadTree or RTree answering queries for a subset of the
+    indexed items. Results from the underlying index are filtered to the subset
+    and renumbered by position in the subset. """
+
+    def __init__(self, index, indices):
+        self.index = index
+        self.indices = np.asarray(indices, dtype=np.intp)
+        # sorted copy of indices, built when first queried
+        self._order = None
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _map(self, indices):
+        """ Return the positions in the subset of items of the underlying
+        index, or -1 for items outside of the subset. """
+        if self._order is None:
+            self._order = np.argsort(self.indices, kind="mergesort")
+            self._sorted = self.indices[self._order]
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(self._sorted) == 0:
+            return np.full(indices.shape, -1, dtype=np.intp)
+        pos = np.minimum(np.searchsorted(self._sorted, indices),
+                         len(self._sorted)-1)
+        return np.where(self._sorted[pos] == indices, self._order[pos], -1)
+
+    def _renumber(self, indices, max_results):
+        mapped = self._map(indices)
+        out = [int(i) for i in mapped if i != -1]
+        if max_results >= 0:
+            out = out[:max_results]
+        return out
+
+    def search_within(self, *args, **kwargs):
+        max_results = kwargs.pop("max_results", -1)
+        return self._renumber(self.index.search_within(*args, **kwargs),
+                              max_results)
+
+    def search_overlapping(self, *args, **kwargs):
+        max_results = kwargs.pop("max_results", -1)
+        return self._renumber(self.index.search_overlapping(*args, **kwargs),
+                              max_results)
+
+    def nearest(self, x, y, k=1):
+        # query the underlying index for more neighbours until each query has
+        # k neighbours in the subset
+        n = min(k, len(self.indices))
+        kq = k
+        while True:
+            indices, distances = self.index.nearest(x, y, kq)
+            mapped = self._map(indices)
+            valid = mapped != -1
+            if np.all(valid.sum(axis=1) >= n) or kq >= len(self.index):
+                break
+            kq = min(4*kq, len(self.index))
+
+        order = np.argsort(~valid, axis=1, kind="mergesort")[:,:k]
+        rows = np.arange(len(mapped))[:,np.newaxis]
+        out_indices = np.full((len(mapped), k), -1, dtype=np.intp)
+        out_distances = np.full((len(mapped), k), np.inf)
+        m = min(k, order.shape[1])
+        found = valid[rows, order][:,:m]
+        out_indices[:,:m] = np.where(found, mapped[rows, order][:,:m], -1)
+        out_distances[:,:m] = np.where(found, distances[rows, order][:,:m], np.inf)
+        return out_indices, out_distances
+
 def sign(a):
     """ Return the sign of *a* """
     if a == 0.0:
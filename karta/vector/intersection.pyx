@@ -6,6 +6,7 @@ from vectorgeo cimport (Vector2, Vector3,
                         azimuth_sph, cart2sph, sph2cart,
                         eulerpole, eulerpole_cart)
 import heapq
+import numpy as np
 
 cdef bool isbetween_inc(double a, double b, double c):
     return fmin(a, c) <= b <= fmax(a, c)
@@ -38,35 +39,158 @@ def bboxes_overlap(tuple bb0, tuple bb1):
     else:
         return True
 
+# Geometry pairs with fewer than this many pairs of segments are searched by
+# brute force
+GRID_MIN_PAIRS = 256
+
 def all_intersections(CoordString a, CoordString b):
-    """ Brute-force intersection search with len(a)*len(b) complexity """
+    """ Find all intersections between segments of *a* and segments of *b*.
+
+    Segments are bucketed in a uniform grid covering the overlap of the two
+    bounding boxes, and only segments sharing a grid cell are tested, so the
+    cost is roughly proportional to (len(a) + len(b) + k) for k candidate pairs
+    rather than to len(a)*len(b). When long segments span so many cells that
+    the grid would generate more than len(a)*len(b) candidates, every pair is
+    tested instead. Intersections are returned in the same order
+    as a brute-force search over segments of *a* and then segments of *b*.
+    """
     cdef int na = len(a)
     cdef int nb = len(b)
-    cdef int i = 0, j = 0
-    cdef double x0, x1, x2, x3, y0, y1, y2, y3
-    cdef xi, yi
-    cdef list intersections = []
-
     if not a.ring:
         na -= 1
     if not b.ring:
         nb -= 1
+    if na <= 0 or nb <= 0:
+        return []
 
-    for i in range(na):
-        x0 = a.getX(i)
-        x1 = a.getX(i+1)
-        y0 = a.getY(i)
-        y1 = a.getY(i+1)
-        for j in range(nb):
-            x2 = b.getX(j)
-            x3 = b.getX(j+1)
-            y2 = b.getY(j)
-            y3 = b.getY(j+1)
-            xi, yi = intersection(x0, x1, x2, x3, y0, y1, y2, y3)
-            if not isnan(xi):
-                intersections.append((xi, yi))
+    cdef double[:,::1] sa = _segments(a, na)
+    cdef double[:,::1] sb = _segments(b, nb)
+    cdef list intersections = []
+    cdef double xi, yi
+    cdef object pairs
+    cdef Py_ssize_t k
+    cdef int i, j
+
+    # the grid search falls back to brute force when segments span so many
+    # cells that it would consider more than na*nb pairs
+    pairs = None
+    if <long long> na * nb >= GRID_MIN_PAIRS:
+        pairs = _candidate_pairs(np.asarray(sa), np.asarray(sb))
+
+    if pairs is None:
+        for i in range(na):
+            for j in range(nb):
+                if _intersection(sa[i,0], sa[i,2], sb[j,0], sb[j,2],
+                                 sa[i,1], sa[i,3], sb[j,1], sb[j,3], &xi, &yi):
+                    intersections.append((xi, yi))
+        return intersections
+
+    for k in range(pairs.shape[0]):
+        i = pairs[k] // nb
+        j = pairs[k] % nb
+        if _intersection(sa[i,0], sa[i,2], sb[j,0], sb[j,2],
+                         sa[i,1], sa[i,3], sb[j,1], sb[j,3], &xi, &yi):
+            intersections.append((xi, yi))
     return intersections
 
+cdef double[:,::1] _segments(CoordString cs, int n):
+    """ Return an (n, 4) array of (x0, y0, x1, y1) segments """
+    cdef double[:,::1] segs = np.empty((n, 4), dtype=np.float64)
+    cdef int i
+    for i in range(n):
+        segs[i,0] = cs.getX(i)
+        segs[i,1] = cs.getY(i)
+        segs[i,2] = cs.getX(i+1)
+        segs[i,3] = cs.getY(i+1)
+    return segs
+
+def _grid_cells(segs, double x0, double y0, double dx, double dy, int nx, int ny,
+                long long limit):
+    """ Return the segment and cell indices of each cell spanned by the
+    bounding box of a segment, for segments overlapping the grid, or None if
+    there are more than *limit* """
+    xmin = np.minimum(segs[:,0], segs[:,2])
+    xmax = np.maximum(segs[:,0], segs[:,2])
+    ymin = np.minimum(segs[:,1], segs[:,3])
+    ymax = np.maximum(segs[:,1], segs[:,3])
+    keep = np.flatnonzero((xmax >= x0) & (xmin <= x0 + nx*dx) &
+                          (ymax >= y0) & (ymin <= y0 + ny*dy))
+
+    i0 = np.clip(((xmin[keep] - x0) / dx).astype(np.intp), 0, nx-1)
+    i1 = np.clip(((xmax[keep] - x0) / dx).astype(np.intp), 0, nx-1)
+    j0 = np.clip(((ymin[keep] - y0) / dy).astype(np.intp), 0, ny-1)
+    j1 = np.clip(((ymax[keep] - y0) / dy).astype(np.intp), 0, ny-1)
+    wx = i1 - i0 + 1
+    wy = j1 - j0 + 1
+    ncells = wx * wy
+    if ncells.sum() > limit:
+        return None
+
+    # enumerate the cells of each segment's bounding box
+    seg = np.repeat(np.arange(len(keep)), ncells)
+    offset = np.arange(len(seg)) - np.repeat(np.cumsum(ncells) - ncells, ncells)
+    cells = (np.repeat(j0, ncells) + offset // np.repeat(wx, ncells)) * nx + \
+            np.repeat(i0, ncells) + offset % np.repeat(wx, ncells)
+    return keep[seg], cells
+
+def _candidate_pairs(sa, sb):
+    """ Return sorted, unique keys i*len(sb)+j of segment pairs sharing a grid
+    cell, or None if bucketing would generate more than len(sa)*len(sb)
+    entries, as when long segments span many cells """
+    cdef int na = len(sa), nb = len(sb)
+    cdef long long limit = <long long> na * nb
+    x0 = max(min(sa[:,0].min(), sa[:,2].min()), min(sb[:,0].min(), sb[:,2].min()))
+    x1 = min(max(sa[:,0].max(), sa[:,2].max()), max(sb[:,0].max(), sb[:,2].max()))
+    y0 = max(min(sa[:,1].min(), sa[:,3].min()), min(sb[:,1].min(), sb[:,3].min()))
+    y1 = min(max(sa[:,1].max(), sa[:,3].max()), max(sb[:,1].max(), sb[:,3].max()))
+    if x1 < x0 or y1 < y0:
+        return np.empty(0, dtype=np.int64)
+
+    # roughly one cell per segment, with cells as square as possible
+    cdef int ncells = max(1, min(na + nb, 1 << 20))
+    w = max(x1 - x0, 0.0)
+    h = max(y1 - y0, 0.0)
+    if w == 0 and h == 0:
+        nx = ny = 1
+    elif w == 0:
+        nx, ny = 1, ncells
+    elif h == 0:
+        nx, ny = ncells, 1
+    else:
+        nx = int(min(max(1, round(np.sqrt(ncells * w / h))), ncells))
+        ny = int(max(1, ncells // nx))
+    dx = w / nx if w != 0 else 1.0
+    dy = h / ny if h != 0 else 1.0
+
+    cells = _grid_cells(sa, x0, y0, dx, dy, nx, ny, limit)
+    if cells is None:
+        return None
+    seg_a, cells_a = cells
+    cells = _grid_cells(sb, x0, y0, dx, dy, nx, ny, limit)
+    if cells is None:
+        return None
+    seg_b, cells_b = cells
+    if len(cells_a) == 0 or len(cells_b) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # group the b entries by cell, and pair each a entry with the b entries in
+    # the same cell
+    order = np.argsort(cells_b, kind="mergesort")
+    cells_b = cells_b[order]
+    seg_b = seg_b[order]
+    start = np.searchsorted(cells_b, cells_a, side="left")
+    stop = np.searchsorted(cells_b, cells_a, side="right")
+    count = stop - start
+    total = count.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    elif total > limit:
+        return None
+    ia = np.repeat(seg_a, count)
+    offset = np.arange(len(ia)) - np.repeat(np.cumsum(count) - count, count)
+    ib = seg_b[np.repeat(start, count) + offset]
+    return np.unique(ia.astype(np.int64) * nb + ib)
+
 cdef class Event(object):
     """ An Event represents an event in a sweep-line algorithm that signals a
     change in the sweep-line datastructure. This event signals the entrance and
@@ -603,6 +727,23 @@ cpdef tuple intersection_sph(double x0, double x1, double x2, double x3,
     else:
         return NAN, NAN
 
+cdef inline bint _intersection(double x0, double x1, double x2, double x3,
+                              double y0, double y1, double y2, double y3,
+                              double *xi, double *yi) nogil:
+    """ Compute the planar intersection between two segments, storing it in
+    (*xi*, *yi*). Returns whether an intersection exists. """
+    cdef double rxs = (x1-x0)*(y3-y2) - (y1-y0)*(x3-x2)
+    if rxs == 0:
+        return False
+
+    cdef double t = ((x2-x0)*(y3-y2) - (y2-y0)*(x3-x2)) / rxs
+    cdef double u = ((x2-x0)*(y1-y0) - (y2-y0)*(x1-x0)) / rxs
+    if (0 < t <= 1) and (0 < u <= 1):
+        xi[0] = x0 + t*(x1-x0)
+        yi[0] = y0 + t*(y1-y0)
+        return True
+    return False
+
 cpdef tuple intersection(double x0, double x1, double x2, double x3,
                          double y0, double y1, double y2, double y3):
     """ Compute the planar intersection between two segments,
@@ -610,16 +751,10 @@ cpdef tuple intersection(double x0, double x1, double x2, double x3,
 
     Returns (NaN, NaN) if no intersection exists.
     """
-    cdef double rxs = cross2(Vector2(x1-x0, y1-y0), Vector2(x3-x2, y3-y2))
-    if rxs == 0:
-        return NAN, NAN
-
-    cdef double t = cross2(Vector2(x2-x0, y2-y0), Vector2(x3-x2, y3-y2)) / rxs
-    cdef double u = cross2(Vector2(x2-x0, y2-y0), Vector2(x1-x0, y1-y0)) / rxs
-    if (0 < t <= 1) and (0 < u <= 1):
-        return x0 + t*(x1-x0), y0 + t*(y1-y0)
-    else:
-        return NAN, NAN
+    cdef double xi, yi
+    if _intersection(x0, x1, x2, x3, y0, y1, y2, y3, &xi, &yi):
+        return xi, yi
+    return NAN, NAN
 
 def count_crossings(double xp, double yp, CoordString coords):
     """ Count the number of times a vertical ray from (xp, yp) crosses a
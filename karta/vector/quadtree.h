@@ -318,6 +318,189 @@ Pool *qt_search_within(NodePtrUnion node_union, Bbox *bbox) {
     return results;
 }
 
+typedef struct NodeDistanceStruct {
+    double d2;
+    NodePtrUnion node;
+} NodeDistance;
+
+// squared distance from a point to the nearest part of a bounding box
+double bbox_dist2(Bbox *bb, double x, double y) {
+    double dx = fmax(fmax(bb->xmin - x, 0.0), x - bb->xmax);
+    double dy = fmax(fmax(bb->ymin - y, 0.0), y - bb->ymax);
+    return dx*dx + dy*dy;
+}
+
+// push a node onto a min-heap ordered by distance
+int nd_heap_push(NodeDistance **heap, int *count, int *size, NodeDistance item) {
+    NodeDistance *h;
+    NodeDistance tmp;
+    int i, parent;
+    if (*count == *size) {
+        h = (NodeDistance*) realloc(*heap, 2*(*size)*sizeof(NodeDistance));
+        if (h == NULL) {
+            return -1;
+        }
+        *heap = h;
+        *size *= 2;
+    }
+    h = *heap;
+    i = *count;
+    h[i] = item;
+    (*count)++;
+    while (i != 0) {
+        parent = (i-1) / 2;
+        if (h[parent].d2 <= h[i].d2) {
+            break;
+        }
+        tmp = h[parent];
+        h[parent] = h[i];
+        h[i] = tmp;
+        i = parent;
+    }
+    return 0;
+}
+
+// pop the nearest node from a min-heap
+NodeDistance nd_heap_pop(NodeDistance *heap, int *count) {
+    NodeDistance top = heap[0];
+    NodeDistance tmp;
+    int i = 0, child;
+    (*count)--;
+    heap[0] = heap[*count];
+    while (1) {
+        child = 2*i + 1;
+        if (child >= *count) {
+            break;
+        }
+        if ((child+1 < *count) && (heap[child+1].d2 < heap[child].d2)) {
+            child++;
+        }
+        if (heap[i].d2 <= heap[child].d2) {
+            break;
+        }
+        tmp = heap[i];
+        heap[i] = heap[child];
+        heap[child] = tmp;
+        i = child;
+    }
+    return top;
+}
+
+// restore the max-heap property of parallel *ids* and *dist2* arrays of length
+// *count*, starting from index *i*
+void nb_sift_down(int *ids, double *dist2, int count, int i) {
+    int child, itmp;
+    double dtmp;
+    while (1) {
+        child = 2*i + 1;
+        if (child >= count) {
+            break;
+        }
+        if ((child+1 < count) && (dist2[child+1] > dist2[child])) {
+            child++;
+        }
+        if (dist2[i] >= dist2[child]) {
+            break;
+        }
+        dtmp = dist2[i]; dist2[i] = dist2[child]; dist2[child] = dtmp;
+        itmp = ids[i]; ids[i] = ids[child]; ids[child] = itmp;
+        i = child;
+    }
+}
+
+// add a candidate neighbour to a max-heap holding at most k neighbours
+void nb_heap_offer(int *ids, double *dist2, int *count, int k, int id, double d2) {
+    int i, parent, itmp;
+    double dtmp;
+    if (*count < k) {
+        i = *count;
+        ids[i] = id;
+        dist2[i] = d2;
+        (*count)++;
+        while (i != 0) {
+            parent = (i-1) / 2;
+            if (dist2[parent] >= dist2[i]) {
+                break;
+            }
+            dtmp = dist2[i]; dist2[i] = dist2[parent]; dist2[parent] = dtmp;
+            itmp = ids[i]; ids[i] = ids[parent]; ids[parent] = itmp;
+            i = parent;
+        }
+    }
+    else if (d2 < dist2[0]) {
+        ids[0] = id;
+        dist2[0] = d2;
+        nb_sift_down(ids, dist2, k, 0);
+    }
+}
+
+// Best-first search for the *k* positions nearest to (x, y). Writes position
+// ids and squared distances to *ids* and *dist2* in order of increasing
+// distance, and returns the number found, which is less than *k* when the tree
+// contains fewer positions. Returns -1 if memory cannot be allocated.
+int qt_nearest(NodePtrUnion root, double x, double y, int k, int *ids, double *dist2) {
+    int size = 64;
+    int nnodes = 0;
+    int nfound = 0;
+    int i, itmp;
+    double d2, dtmp;
+    NodeDistance item, child;
+    NonleafNode *nonleaf;
+    LeafNode *leaf;
+    NodeDistance *heap;
+
+    if (k <= 0) {
+        return 0;
+    }
+    heap = (NodeDistance*) malloc(size*sizeof(NodeDistance));
+    if (heap == NULL) {
+        return -1;
+    }
+
+    item.node = root;
+    item.d2 = bbox_dist2(root.leafnode->bbox, x, y);
+    nd_heap_push(&heap, &nnodes, &size, item);
+
+    while (nnodes != 0) {
+        item = nd_heap_pop(heap, &nnodes);
+        if ((nfound == k) && (item.d2 > dist2[0])) {
+            break;
+        }
+        if (item.node.leafnode->type == LEAF) {
+            leaf = item.node.leafnode;
+            for (i=0; i!=leaf->count; i++) {
+                d2 = (leaf->positions[i].x - x) * (leaf->positions[i].x - x) +
+                     (leaf->positions[i].y - y) * (leaf->positions[i].y - y);
+                nb_heap_offer(ids, dist2, &nfound, k, leaf->positions[i].id, d2);
+            }
+        }
+        else {
+            nonleaf = item.node.nonleafnode;
+            NodePtrUnion children[4] = {nonleaf->ulnode, nonleaf->urnode,
+                                        nonleaf->llnode, nonleaf->lrnode};
+            for (i=0; i!=4; i++) {
+                child.node = children[i];
+                child.d2 = bbox_dist2(children[i].leafnode->bbox, x, y);
+                if ((nfound < k) || (child.d2 <= dist2[0])) {
+                    if (nd_heap_push(&heap, &nnodes, &size, child) != 0) {
+                        free(heap);
+                        return -1;
+                    }
+                }
+            }
+        }
+    }
+    free(heap);
+
+    // heapsort neighbours into increasing order of distance
+    for (i=nfound-1; i>0; i--) {
+        dtmp = dist2[0]; dist2[0] = dist2[i]; dist2[i] = dtmp;
+        itmp = ids[0]; ids[0] = ids[i]; ids[i] = itmp;
+        nb_sift_down(ids, dist2, i, 0);
+    }
+    return nfound;
+}
+
 void qt_free_position(Position *pos) {
     free(pos);
 }
@@ -1,6 +1,8 @@
 """ Cython wrapper quadtree """
 
-from libc.math cimport isnan
+import numpy as np
+cimport cython
+from libc.math cimport isnan, sqrt, INFINITY
 
 cdef extern from "quadtree.h":
 
@@ -52,6 +54,7 @@ cdef extern from "quadtree.h":
     NonleafNode *qt_insert(NodePtrUnion, Position, int*)
     void qt_free_node(NodePtrUnion)
     Pool *qt_search_within(NodePtrUnion, Bbox*)
+    int qt_nearest(NodePtrUnion, double, double, int, int*, double*) nogil
     char *pool_pop(Pool*, int)
 
 cdef class QuadTree:
@@ -130,3 +133,71 @@ cdef class QuadTree:
         qt_free_bbox(bbox)
         return out
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def nearest(self, x, y, int k=1):
+        """ Find the *k* positions nearest to each of a set of query points,
+        by Euclidean distance. The search releases the GIL, so that queries
+        may be divided between threads.
+
+        Parameters
+        ----------
+        x, y : array-like
+            query point coordinates
+        k : int, optional
+            number of neighbours (default 1)
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            (n, k) arrays of position indices and distances, ordered by
+            increasing distance. When the tree contains fewer than *k*
+            positions, indices are padded with -1 and distances with inf.
+        """
+        cdef double[::1] xv = np.ascontiguousarray(x, dtype=np.float64).ravel()
+        cdef double[::1] yv = np.ascontiguousarray(y, dtype=np.float64).ravel()
+        cdef int n = xv.shape[0]
+        cdef int ndup = sum(len(v) for v in self.duplicates.values())
+        cdef int kq = min(k, self.count-ndup)
+        cdef int i, j
+        cdef int failed = 0
+
+        if yv.shape[0] != n:
+            raise ValueError("x and y must have equal length")
+        if k < 0:
+            raise ValueError("k must be non-negative")
+
+        # duplicate positions are not stored in the tree, so the k nearest
+        # stored positions are found and expanded to include their duplicates
+        ids = np.full((n, max(kq, 1)), -1, dtype=np.int32)
+        dist = np.full((n, max(kq, 1)), INFINITY, dtype=np.float64)
+        cdef int[:,::1] idv = ids
+        cdef double[:,::1] dv = dist
+        if kq != 0:
+            with nogil:
+                for i in range(n):
+                    if qt_nearest(self.root, xv[i], yv[i], kq,
+                                  &idv[i,0], &dv[i,0]) < 0:
+                        failed = 1
+                        break
+                    for j in range(kq):
+                        dv[i,j] = sqrt(dv[i,j])
+            if failed:
+                raise MemoryError()
+
+        indices = np.full((n, k), -1, dtype=np.intp)
+        distances = np.full((n, k), np.inf, dtype=np.float64)
+        if not self.duplicates:
+            indices[:,:kq] = ids[:,:kq]
+            distances[:,:kq] = dist[:,:kq]
+        else:
+            for i in range(n):
+                row = []
+                for j in range(kq):
+                    row.append((idv[i,j], dv[i,j]))
+                    for idup in self.duplicates.get(idv[i,j], ()):
+                        row.append((idup, dv[i,j]))
+                row = row[:k]
+                indices[i,:len(row)] = [r[0] for r in row]
+                distances[i,:len(row)] = [r[1] for r in row]
+        return indices, distances
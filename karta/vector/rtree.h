@@ -2,6 +2,7 @@
 
 #include <stdlib.h>
 #include <stdio.h>
+#include <math.h>
 #include "linkedlist.h"
 #include "pool.h"
 
@@ -10,10 +11,10 @@ typedef enum { LINEAR, QUADRATIC } Strategy;
 typedef enum { LEAF, NONLEAF } NodeType;
 
 typedef struct BoundingBox {
-    float xmin;
-    float ymin;
-    float xmax;
-    float ymax;
+    double xmin;
+    double ymin;
+    double xmax;
+    double ymax;
 } Bbox;
 
 typedef struct RTreeNode {
@@ -32,14 +33,6 @@ union ChildUnionTag {
     Bbox* bbox;
 } ChildUnion;
 
-float minf(float a, float b) {
-    return (a >= b) ? b : a;
-}
-
-float maxf(float a, float b) {
-    return (a >= b) ? a : b;
-}
-
 // forward declarations
 Node* rt_insert(Node*, Bbox*, int);
 Node* rt_choose_leaf(Node*, Bbox*);
@@ -47,11 +40,12 @@ Node* rt_split(Node*);
 Node* rt_split_nonleaf(Node*);
 Node* rt_split_leaf(Node*);
 int rt_adjust_tree(Node*, Node*, Node**, Node**);
-float volume_expanded(Bbox*, Bbox*);
+double volume_expanded(Bbox*, Bbox*);
 int linear_pick_seeds(int, Bbox**, int*, int*);
 int linear_pick_next(int, Bbox**, Node*, Node*, int*, int*);
 int is_within(Bbox*, Bbox*);
 int is_overlapping(Bbox*, Bbox*);
+int rt_tighten_bbox(Node*);
 
 // new_node allocates a new node struct
 Node* rt_new_node(NodeType type, Strategy strategy, int maxchildren, Node* parent) {
@@ -68,12 +62,11 @@ Node* rt_new_node(NodeType type, Strategy strategy, int maxchildren, Node* paren
     node->children = malloc((maxchildren+1) * sizeof(ChildUnion));
     node->indices = malloc((maxchildren+1) * sizeof(int));
 
-    // TODO: use NaN values
     node->bbox = malloc(sizeof(Bbox));
-    node->bbox->xmin = 1e38;
-    node->bbox->xmax = -1e38;
-    node->bbox->ymin = 1e38;
-    node->bbox->ymax = -1e38;
+    node->bbox->xmin = HUGE_VAL;
+    node->bbox->xmax = -HUGE_VAL;
+    node->bbox->ymin = HUGE_VAL;
+    node->bbox->ymax = -HUGE_VAL;
     return node;
 }
 
@@ -88,14 +81,15 @@ void rt_free(Node *node) {
         for (i=0; i!=node->count; i++) {
             free(((Bbox**) node->children)[i]);
         }
-        free(node->indices);
-        free(node->bbox);
-        free(node);
     } else if (node->type == NONLEAF) {
         for (i=0; i!=node->count; i++) {
             rt_free(((Node**) node->children)[i]);
         }
     }
+    free(node->children);
+    free(node->indices);
+    free(node->bbox);
+    free(node);
 }
 
 void print_bbox(Bbox *bb) {
@@ -209,10 +203,10 @@ Node* rt_insert(Node *root, Bbox *bbox, int index) {
     leaf->indices[leaf->count] = index;
     leaf->count++;
 
-    leaf->bbox->xmin = minf(leaf->bbox->xmin, bbox->xmin);
-    leaf->bbox->xmax = maxf(leaf->bbox->xmax, bbox->xmax);
-    leaf->bbox->ymin = minf(leaf->bbox->ymin, bbox->ymin);
-    leaf->bbox->ymax = maxf(leaf->bbox->ymax, bbox->ymax);
+    leaf->bbox->xmin = fmin(leaf->bbox->xmin, bbox->xmin);
+    leaf->bbox->xmax = fmax(leaf->bbox->xmax, bbox->xmax);
+    leaf->bbox->ymin = fmin(leaf->bbox->ymin, bbox->ymin);
+    leaf->bbox->ymax = fmax(leaf->bbox->ymax, bbox->ymax);
 
     if (leaf->count > leaf->maxchildren) {
         sibling = rt_split(leaf);
@@ -231,10 +225,111 @@ Node* rt_insert(Node *root, Bbox *bbox, int index) {
     return returned_root;
 }
 
+// an item to be packed into a node during bulk loading
+typedef struct PackEntryStruct {
+    double cx;
+    double cy;
+    char *child;
+    int index;
+} PackEntry;
+
+int compare_cx(const void *a, const void *b) {
+    double d = ((PackEntry*) a)->cx - ((PackEntry*) b)->cx;
+    return (d > 0) - (d < 0);
+}
+
+int compare_cy(const void *a, const void *b) {
+    double d = ((PackEntry*) a)->cy - ((PackEntry*) b)->cy;
+    return (d > 0) - (d < 0);
+}
+
+// pack entries into nodes with the Sort-Tile-Recursive method: entries are
+// sorted by x, divided into vertical slices, and each slice is sorted by y and
+// divided into nodes of up to maxchildren. Returns the number of nodes written
+// to *nodes*
+int str_pack(PackEntry *entries, int n, int maxchildren, NodeType type,
+             Strategy strategy, Node **nodes) {
+    int nnodes = (n + maxchildren - 1) / maxchildren;
+    int nslices = (int) ceil(sqrt((double) nnodes));
+    int slicesize = nslices * maxchildren;
+    int i0, j0, j, len, jend;
+    int count = 0;
+    Node *node;
+
+    qsort(entries, n, sizeof(PackEntry), compare_cx);
+    for (i0=0; i0<n; i0+=slicesize) {
+        len = (n-i0 < slicesize) ? n-i0 : slicesize;
+        qsort(entries+i0, len, sizeof(PackEntry), compare_cy);
+        for (j0=i0; j0<i0+len; j0+=maxchildren) {
+            node = rt_new_node(type, strategy, maxchildren, NULL);
+            jend = (j0+maxchildren < i0+len) ? j0+maxchildren : i0+len;
+            for (j=j0; j<jend; j++) {
+                node->children[node->count] = entries[j].child;
+                if (type == LEAF) {
+                    node->indices[node->count] = entries[j].index;
+                } else {
+                    ((Node*) entries[j].child)->parent = node;
+                }
+                node->count++;
+            }
+            rt_tighten_bbox(node);
+            nodes[count] = node;
+            count++;
+        }
+    }
+    return count;
+}
+
+// construct a packed tree from *n* bounding boxes stored as consecutive
+// (xmin, ymin, xmax, ymax) values, returning the root node. Item indices are
+// positions in the array. Packing sorts the items, so construction is
+// O(n log n), and the nodes are nearly full with little overlap.
+Node* rt_bulk_load(double *bboxes, int n, int maxchildren, Strategy strategy) {
+    int i, count;
+    Bbox *bb;
+    Node *root;
+    PackEntry *entries;
+    Node **nodes;
+
+    if (n == 0) {
+        return rt_new_node(LEAF, strategy, maxchildren, NULL);
+    }
+
+    entries = malloc(n * sizeof(PackEntry));
+    nodes = malloc(n * sizeof(Node*));
+    for (i=0; i!=n; i++) {
+        bb = rt_new_bbox();
+        bb->xmin = bboxes[4*i];
+        bb->ymin = bboxes[4*i+1];
+        bb->xmax = bboxes[4*i+2];
+        bb->ymax = bboxes[4*i+3];
+        entries[i].cx = 0.5*(bboxes[4*i] + bboxes[4*i+2]);
+        entries[i].cy = 0.5*(bboxes[4*i+1] + bboxes[4*i+3]);
+        entries[i].child = (char*) bb;
+        entries[i].index = i;
+    }
+
+    count = str_pack(entries, n, maxchildren, LEAF, strategy, nodes);
+    while (count > 1) {
+        for (i=0; i!=count; i++) {
+            entries[i].cx = 0.5*(nodes[i]->bbox->xmin + nodes[i]->bbox->xmax);
+            entries[i].cy = 0.5*(nodes[i]->bbox->ymin + nodes[i]->bbox->ymax);
+            entries[i].child = (char*) nodes[i];
+            entries[i].index = -1;
+        }
+        count = str_pack(entries, count, maxchildren, NONLEAF, strategy, nodes);
+    }
+
+    root = nodes[0];
+    free(entries);
+    free(nodes);
+    return root;
+}
+
 // chose a leaf node below node in which to place bbox
 Node* rt_choose_leaf(Node *node, Bbox *bbox) {
     int i, iminexpanded;
-    float vol, cur_vol;
+    double vol, cur_vol;
     while (node->type != LEAF) {
         iminexpanded = 0;
         vol = volume_expanded(((Node**) node->children)[0]->bbox, bbox);
@@ -257,7 +352,7 @@ Node* rt_choose_leaf(Node *node, Bbox *bbox) {
 int rt_adjust_tree(Node *node, Node *sibling, Node **outnode, Node **outsibling) {
     int i, ret = 0;
     int addretval = 0;
-    float xmin, xmax, ymin, ymax;
+    double xmin, xmax, ymin, ymax;
     Node *parent;
     while (node->parent != NULL) { // while not the root node
         // make sure the parent's bbox is up to date
@@ -276,10 +371,10 @@ int rt_adjust_tree(Node *node, Node *sibling, Node **outnode, Node **outsibling)
             i = 0;
         }
         while (i != parent->count) {
-            xmin = minf(xmin, ((Node**) parent->children)[i]->bbox->xmin);
-            xmax = maxf(xmax, ((Node**) parent->children)[i]->bbox->xmax);
-            ymin = minf(ymin, ((Node**) parent->children)[i]->bbox->ymin);
-            ymax = maxf(ymax, ((Node**) parent->children)[i]->bbox->ymax);
+            xmin = fmin(xmin, ((Node**) parent->children)[i]->bbox->xmin);
+            xmax = fmax(xmax, ((Node**) parent->children)[i]->bbox->xmax);
+            ymin = fmin(ymin, ((Node**) parent->children)[i]->bbox->ymin);
+            ymax = fmax(ymax, ((Node**) parent->children)[i]->bbox->ymax);
             i++;
         }
         parent->bbox->xmin = xmin;
@@ -321,13 +416,13 @@ int rt_tighten_bbox(Node *node) {
         node->bbox->ymin = ((Bbox**) node->children)[0]->ymin;
         node->bbox->ymax = ((Bbox**) node->children)[0]->ymax;
         for (i=1; i!=node->count; i++) {
-            node->bbox->xmin = minf(node->bbox->xmin,
+            node->bbox->xmin = fmin(node->bbox->xmin,
                                     ((Bbox*) node->children[i])->xmin);
-            node->bbox->xmax = maxf(node->bbox->xmax,
+            node->bbox->xmax = fmax(node->bbox->xmax,
                                     ((Bbox*) node->children[i])->xmax);
-            node->bbox->ymin = minf(node->bbox->ymin,
+            node->bbox->ymin = fmin(node->bbox->ymin,
                                     ((Bbox*) node->children[i])->ymin);
-            node->bbox->ymax = maxf(node->bbox->ymax,
+            node->bbox->ymax = fmax(node->bbox->ymax,
                                     ((Bbox*) node->children[i])->ymax);
         }
     } else if (node->type == NONLEAF) {
@@ -336,13 +431,13 @@ int rt_tighten_bbox(Node *node) {
         node->bbox->ymin = ((Node**) node->children)[0]->bbox->ymin;
         node->bbox->ymax = ((Node**) node->children)[0]->bbox->ymax;
         for (i=1; i!=node->count; i++) {
-            node->bbox->xmin = minf(node->bbox->xmin,
+            node->bbox->xmin = fmin(node->bbox->xmin,
                                     ((Node**) node->children)[i]->bbox->xmin);
-            node->bbox->xmax = maxf(node->bbox->xmax,
+            node->bbox->xmax = fmax(node->bbox->xmax,
                                     ((Node**) node->children)[i]->bbox->xmax);
-            node->bbox->ymin = minf(node->bbox->ymin,
+            node->bbox->ymin = fmin(node->bbox->ymin,
                                     ((Node**) node->children)[i]->bbox->ymin);
-            node->bbox->ymax = maxf(node->bbox->ymax,
+            node->bbox->ymax = fmax(node->bbox->ymax,
                                     ((Node**) node->children)[i]->bbox->ymax);
         }
 
@@ -454,10 +549,10 @@ Node* rt_split_leaf(Node *node) {
         // after the index pool is popped, it's contents are correct
         // somehow at the next iteration, the final value is getting messed up
 
-        target->bbox->xmin = minf(target->bbox->xmin, bbox->xmin);
-        target->bbox->xmax = maxf(target->bbox->xmax, bbox->xmax);
-        target->bbox->ymin = minf(target->bbox->ymin, bbox->ymin);
-        target->bbox->ymax = maxf(target->bbox->ymax, bbox->ymax);
+        target->bbox->xmin = fmin(target->bbox->xmin, bbox->xmin);
+        target->bbox->xmax = fmax(target->bbox->xmax, bbox->xmax);
+        target->bbox->ymin = fmin(target->bbox->ymin, bbox->ymin);
+        target->bbox->ymax = fmax(target->bbox->ymax, bbox->ymax);
 
         // prevent either node from having fewer than 2 children
         if ((pool->count + node->count) == 2) {
@@ -568,10 +663,10 @@ Node* rt_split_nonleaf(Node *node) {
 
         tmpnode->children[tmpnode->count] = (char*) fosternode;
         tmpnode->count++;
-        tmpnode->bbox->xmin = minf(tmpnode->bbox->xmin, fosternode->bbox->xmin);
-        tmpnode->bbox->xmax = maxf(tmpnode->bbox->xmax, fosternode->bbox->xmax);
-        tmpnode->bbox->ymin = minf(tmpnode->bbox->ymin, fosternode->bbox->ymin);
-        tmpnode->bbox->ymax = maxf(tmpnode->bbox->ymax, fosternode->bbox->ymax);
+        tmpnode->bbox->xmin = fmin(tmpnode->bbox->xmin, fosternode->bbox->xmin);
+        tmpnode->bbox->xmax = fmax(tmpnode->bbox->xmax, fosternode->bbox->xmax);
+        tmpnode->bbox->ymin = fmin(tmpnode->bbox->ymin, fosternode->bbox->ymin);
+        tmpnode->bbox->ymax = fmax(tmpnode->bbox->ymax, fosternode->bbox->ymax);
 
         // prevent either node from having fewer than 2 children
         if ((node_pool->count + node->count) == 2) {
@@ -593,16 +688,16 @@ Node* rt_split_nonleaf(Node *node) {
 }
 
 Bbox* union_bbox(Bbox **bboxes, int nbboxes) {
-    float xmin = bboxes[0]->xmin;
-    float xmax = bboxes[0]->xmax;
-    float ymin = bboxes[0]->ymin;
-    float ymax = bboxes[0]->ymax;
+    double xmin = bboxes[0]->xmin;
+    double xmax = bboxes[0]->xmax;
+    double ymin = bboxes[0]->ymin;
+    double ymax = bboxes[0]->ymax;
     int i;
     for (i=0; i!=nbboxes; i++) {
-        xmin = minf(xmin, bboxes[i]->xmin);
-        xmax = maxf(xmax, bboxes[i]->xmax);
-        ymin = minf(ymin, bboxes[i]->ymin);
-        ymax = maxf(ymax, bboxes[i]->ymax);
+        xmin = fmin(xmin, bboxes[i]->xmin);
+        xmax = fmax(xmax, bboxes[i]->xmax);
+        ymin = fmin(ymin, bboxes[i]->ymin);
+        ymax = fmax(ymax, bboxes[i]->ymax);
     }
     Bbox* bb = rt_new_bbox();
     bb->xmin = xmin;
@@ -617,10 +712,10 @@ Bbox* union_bbox(Bbox **bboxes, int nbboxes) {
 int linear_pick_seeds(int nbboxes, Bbox **bboxes, int *seed0, int *seed1) {
     int iminxmax = 0, imaxxmin = 0;
     int iminymax = 0, imaxymin = 0;
-    float minxmin = bboxes[0]->xmin;
-    float maxxmax = bboxes[0]->xmax;
-    float minymin = bboxes[0]->ymin;
-    float maxymax = bboxes[0]->ymax;
+    double minxmin = bboxes[0]->xmin;
+    double maxxmax = bboxes[0]->xmax;
+    double minymin = bboxes[0]->ymin;
+    double maxymax = bboxes[0]->ymax;
     int i;
     for (i=1; i!=nbboxes; i++) {
         if (bboxes[i]->xmin > bboxes[imaxxmin]->xmin) {
@@ -634,16 +729,16 @@ int linear_pick_seeds(int nbboxes, Bbox **bboxes, int *seed0, int *seed1) {
             iminymax = i;
         }
 
-        minxmin = minf(minxmin, bboxes[i]->xmin);
-        maxxmax = maxf(maxxmax, bboxes[i]->xmax);
-        minymin = minf(minymin, bboxes[i]->ymin);
-        maxymax = maxf(maxymax, bboxes[i]->ymax);
+        minxmin = fmin(minxmin, bboxes[i]->xmin);
+        maxxmax = fmax(maxxmax, bboxes[i]->xmax);
+        minymin = fmin(minymin, bboxes[i]->ymin);
+        maxymax = fmax(maxymax, bboxes[i]->ymax);
     }
     if ((maxxmax == minxmin) || (maxymax == minymin)) {
         return 1;
     }
-    float xrat = (bboxes[imaxxmin]->xmin - bboxes[iminxmax]->xmax) / (maxxmax - minxmin);
-    float yrat = (bboxes[imaxymin]->ymin - bboxes[iminymax]->ymax) / (maxymax - minymin);
+    double xrat = (bboxes[imaxxmin]->xmin - bboxes[iminxmax]->xmax) / (maxxmax - minxmin);
+    double yrat = (bboxes[imaxymin]->ymin - bboxes[iminymax]->ymax) / (maxymax - minymin);
     if (xrat > yrat) {
         *seed0 = imaxxmin;
         *seed1 = iminxmax;
@@ -660,8 +755,8 @@ int linear_pick_next(int nbboxes, Bbox **bboxes, Node *node0, Node *node1,
                      int *inextchild, int *ibestnode) {
     *inextchild = nbboxes-1;
     Bbox *bbox = bboxes[nbboxes-1];
-    float v0 = volume_expanded(node0->bbox, bbox);
-    float v1 = volume_expanded(node1->bbox, bbox);
+    double v0 = volume_expanded(node0->bbox, bbox);
+    double v1 = volume_expanded(node1->bbox, bbox);
     if (v0 < v1) {
         *ibestnode = 0;
     } else {
@@ -672,12 +767,12 @@ int linear_pick_next(int nbboxes, Bbox **bboxes, Node *node0, Node *node1,
 
 // volume_expanded returns the volume that bbox0 would be expanded by if it
 // were merged with bbox1
-float volume_expanded(Bbox *bbox0, Bbox *bbox1) {
-    float v_original = (bbox0->xmax - bbox0->xmin) * (bbox0->ymax - bbox0->ymin);
-    float v_new = (maxf(bbox0->xmax, bbox1->xmax) -
-                    minf(bbox0->xmin, bbox1->xmin)) *
-                  (maxf(bbox0->ymax, bbox1->ymax) -
-                    minf(bbox0->ymin, bbox1->ymin));
+double volume_expanded(Bbox *bbox0, Bbox *bbox1) {
+    double v_original = (bbox0->xmax - bbox0->xmin) * (bbox0->ymax - bbox0->ymin);
+    double v_new = (fmax(bbox0->xmax, bbox1->xmax) -
+                    fmin(bbox0->xmin, bbox1->xmin)) *
+                  (fmax(bbox0->ymax, bbox1->ymax) -
+                    fmin(bbox0->ymin, bbox1->ymin));
     return v_new - v_original;
 }
 
@@ -690,10 +785,10 @@ int is_within(Bbox *outerbb, Bbox *testbb) {
     }
 }
 
-float bbox_intersection_area(Bbox *bb0, Bbox *bb1) {
-    float dx = 0, dy = 0;
-    dx = maxf(minf(bb0->xmax, bb1->xmax) - maxf(bb0->xmin, bb1->xmin), 0.0);
-    dy = maxf(minf(bb0->ymax, bb1->ymax) - maxf(bb0->ymin, bb1->ymin), 0.0);
+double bbox_intersection_area(Bbox *bb0, Bbox *bb1) {
+    double dx = 0, dy = 0;
+    dx = fmax(fmin(bb0->xmax, bb1->xmax) - fmax(bb0->xmin, bb1->xmin), 0.0);
+    dy = fmax(fmin(bb0->ymax, bb1->ymax) - fmax(bb0->ymin, bb1->ymin), 0.0);
     return dx * dy;
 }
 
@@ -704,3 +799,146 @@ int is_overlapping(Bbox *bb, Bbox *testbb) {
         return 0;
     }
 }
+
+// A flattened tree, stored in breadth-first order in arrays so that it can be
+// searched in place after being written to and read from a file. Node 0 is the
+// root. For each node, node_info holds (type, index of first child, number of
+// children), and the children are node indices for nonleaf nodes and item
+// indices for leaf nodes.
+typedef struct FlatRTreeStruct {
+    int nnodes;
+    const double *node_bboxes;
+    const double *item_bboxes;
+    const int *node_info;
+    const int *children;
+} FlatTree;
+
+// count the nodes and child links in a tree
+void rt_count(Node *node, int *nnodes, int *nchildren) {
+    int i;
+    (*nnodes)++;
+    *nchildren += node->count;
+    if (node->type == NONLEAF) {
+        for (i=0; i!=node->count; i++) {
+            rt_count(((Node**) node->children)[i], nnodes, nchildren);
+        }
+    }
+}
+
+// write a tree with *nnodes* nodes to arrays sized using rt_count. Returns 0 on
+// success or 1 if memory cannot be allocated
+int rt_flatten(Node *root, int nnodes, double *node_bboxes, double *item_bboxes,
+               int *node_info, int *children) {
+    Node **queue = malloc(nnodes * sizeof(Node*));
+    Node *node;
+    Bbox *bb;
+    int k, i, idx;
+    int nqueued = 1;
+    int nlinks = 0;
+    if (queue == NULL) {
+        return 1;
+    }
+    queue[0] = root;
+    for (k=0; k!=nnodes; k++) {
+        node = queue[k];
+        node_bboxes[4*k] = node->bbox->xmin;
+        node_bboxes[4*k+1] = node->bbox->ymin;
+        node_bboxes[4*k+2] = node->bbox->xmax;
+        node_bboxes[4*k+3] = node->bbox->ymax;
+        node_info[3*k] = node->type;
+        node_info[3*k+1] = nlinks;
+        node_info[3*k+2] = node->count;
+        for (i=0; i!=node->count; i++) {
+            if (node->type == LEAF) {
+                idx = node->indices[i];
+                bb = ((Bbox**) node->children)[i];
+                item_bboxes[4*idx] = bb->xmin;
+                item_bboxes[4*idx+1] = bb->ymin;
+                item_bboxes[4*idx+2] = bb->xmax;
+                item_bboxes[4*idx+3] = bb->ymax;
+                children[nlinks] = idx;
+            } else {
+                queue[nqueued] = ((Node**) node->children)[i];
+                children[nlinks] = nqueued;
+                nqueued++;
+            }
+            nlinks++;
+        }
+    }
+    free(queue);
+    return 0;
+}
+
+// append a value to a growable int array
+int int_array_append(int **array, int *count, int *size, int value) {
+    int *a;
+    if (*count == *size) {
+        a = realloc(*array, 2*(*size)*sizeof(int));
+        if (a == NULL) {
+            return 1;
+        }
+        *array = a;
+        *size *= 2;
+    }
+    (*array)[*count] = value;
+    (*count)++;
+    return 0;
+}
+
+// search a flattened tree for items within (overlapping == 0) or overlapping
+// (overlapping == 1) a bbox. Returns an allocated array of *nfound* item
+// indices, or NULL if memory cannot be allocated. The search stops after
+// *max_results* items when max_results is non-negative.
+int *rt_flat_search(FlatTree *tree, Bbox *bbox, int max_results, int overlapping,
+                    int *nfound) {
+    int stacksize = 64, nstack = 0;
+    int outsize = 16;
+    int *stack = malloc(stacksize * sizeof(int));
+    int *out = malloc(outsize * sizeof(int));
+    int k, i, child, type, first, count, match;
+    int err = 0;
+
+    *nfound = 0;
+    if ((stack == NULL) || (out == NULL)) {
+        free(stack);
+        free(out);
+        return NULL;
+    }
+    if (tree->nnodes != 0) {
+        err = int_array_append(&stack, &nstack, &stacksize, 0);
+    }
+    while ((nstack != 0) && (*nfound != max_results) && (err == 0)) {
+        nstack--;
+        k = stack[nstack];
+        type = tree->node_info[3*k];
+        first = tree->node_info[3*k+1];
+        count = tree->node_info[3*k+2];
+        for (i=first; i!=first+count; i++) {
+            child = tree->children[i];
+            if (type == LEAF) {
+                if (overlapping) {
+                    match = is_overlapping(bbox, (Bbox*) &tree->item_bboxes[4*child]);
+                } else {
+                    match = is_within(bbox, (Bbox*) &tree->item_bboxes[4*child]);
+                }
+                if (match == 1) {
+                    err = int_array_append(&out, nfound, &outsize, child);
+                    if ((err != 0) || (*nfound == max_results)) {
+                        break;
+                    }
+                }
+            } else if (is_overlapping(bbox, (Bbox*) &tree->node_bboxes[4*child]) == 1) {
+                err = int_array_append(&stack, &nstack, &stacksize, child);
+                if (err != 0) {
+                    break;
+                }
+            }
+        }
+    }
+    free(stack);
+    if (err != 0) {
+        free(out);
+        return NULL;
+    }
+    return out;
+}
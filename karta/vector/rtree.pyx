@@ -1,5 +1,9 @@
 """ Cython wrapper for rtree """
 
+import mmap
+import numpy as np
+from libc.stdlib cimport free
+
 cdef extern from "rtree.h":
 
     cdef enum Strategy:
@@ -9,14 +13,15 @@ cdef extern from "rtree.h":
         LEAF, NONLEAF
 
     cdef struct BoundingBox:
-        float xmin
-        float ymin
-        float xmax
-        float ymax
+        double xmin
+        double ymin
+        double xmax
+        double ymax
     ctypedef BoundingBox Bbox
 
     cdef struct RTreeNode:
         int count
+        int maxchildren
         Bbox* bbox
     ctypedef RTreeNode Node
 
@@ -25,75 +30,296 @@ cdef extern from "rtree.h":
         int count
     ctypedef PointerPool Pool
 
+    cdef struct FlatRTreeStruct:
+        int nnodes
+        const double *node_bboxes
+        const double *item_bboxes
+        const int *node_info
+        const int *children
+    ctypedef FlatRTreeStruct FlatTree
+
     Node* rt_new_node(NodeType, Strategy, int, Node*)
     Node* rt_insert(Node*, Bbox*, int)
+    Node* rt_bulk_load(double*, int, int, Strategy)
     Bbox* rt_new_bbox()
     void rt_free(Node*)
     void print_bbox(Bbox*)
     Pool *rt_search_within(Node*, Bbox*, int)
     Pool *rt_search_overlapping(Node*, Bbox*, int)
 
+    void rt_count(Node*, int*, int*)
+    int rt_flatten(Node*, int, double*, double*, int*, int*)
+    int *rt_flat_search(FlatTree*, Bbox*, int, int, int*)
+
     char *pool_pop(Pool*, int)
     void pool_destroy(Pool*)
 
+# Serialized trees begin with this marker and a header of four little-endian
+# int64 values (nodes, items, child links, maxchildren), followed by the node
+# bboxes, item bboxes, node info, and child link arrays.
+MAGIC = b"KRTREE01"
+
+def _check_flat_tree(nnodes, nitems, node_info, children):
+    """ Raise ValueError unless the flattened tree arrays describe a tree that
+    can be searched without reading out of bounds. Nodes must be stored in
+    breadth-first order, as written by `RTree.to_bytes`. """
+    if nnodes == 0:
+        if len(children) != 0:
+            raise ValueError("serialized RTree has child links but no nodes")
+        return
+    info = np.asarray(node_info).reshape(nnodes, 3)
+    types = info[:,0]
+    first = info[:,1]
+    count = info[:,2]
+    cdef int leaf_type = LEAF, nonleaf_type = NONLEAF
+    if np.any((types != leaf_type) & (types != nonleaf_type)):
+        raise ValueError("serialized RTree has invalid node types")
+    if np.any(count < 0) or np.sum(count, dtype=np.int64) != len(children):
+        raise ValueError("serialized RTree has invalid child counts")
+    starts = np.concatenate([[0], np.cumsum(count[:-1], dtype=np.int64)])
+    if np.any(first != starts):
+        raise ValueError("serialized RTree has invalid child offsets")
+    # parents precede their children, so searches terminate
+    parent = np.repeat(np.arange(nnodes), count)
+    leaf = types[parent] == leaf_type
+    children = np.asarray(children)
+    if np.any(leaf & ((children < 0) | (children >= nitems))):
+        raise ValueError("serialized RTree has invalid item indices")
+    if np.any(~leaf & ((children <= parent) | (children >= nnodes))):
+        raise ValueError("serialized RTree has invalid node indices")
+    return
+
 cdef class RTree:
+    """ R-tree index of geometry bounding boxes, stored in double precision.
+
+    Parameters
+    ----------
+    geometries : list
+        items with a `bbox()` method
+    maxchildren : int, optional
+        maximum number of children per node, at least 4 (default 50)
+    packed : bool, optional
+        if True (default), build a packed tree from all bounding boxes at once
+        using Sort-Tile-Recursive loading. If False, insert items one at a time.
+
+    Trees can be written to a buffer with `to_bytes()` or to a file with
+    `save()`, and read back with `from_bytes()` or `load()`. Trees that are read
+    back are searched in place, without being rebuilt.
+    """
     cdef int count
+    cdef int maxchildren
     cdef Node* root
+    cdef FlatTree flat
+    cdef object _arrays
 
-    def __init__(self, list geometries, maxchildren=50):
-        self.root = NULL
-        cdef int i = 0
-        cdef object geom
+    def __init__(self, list geometries, int maxchildren=50, bint packed=True):
+        cdef int i
+        cdef Bbox *bb
         cdef Node* root
 
-        root = rt_new_node(LEAF, LINEAR, maxchildren, NULL)
-        for geom in geometries:
+        bboxes = np.empty((len(geometries), 4), dtype=np.float64)
+        for i, geom in enumerate(geometries):
             if not hasattr(geom, "bbox"):
                 raise AttributeError("cannot construct R-tree index from items "
                                      "missing a `bbox` attribute")
             _bb = geom.bbox()
+            if len(_bb) == 6:
+                _bb = (_bb[0], _bb[1], _bb[3], _bb[4])
+            bboxes[i] = _bb
+
+        if packed:
+            self._bulk_load(bboxes, maxchildren)
+            return
+
+        if maxchildren < 4:
+            raise ValueError("maxchildren must be at least 4")
+        root = rt_new_node(LEAF, LINEAR, maxchildren, NULL)
+        for i in range(len(bboxes)):
             bb = rt_new_bbox()
-            bb.xmin = _bb[0]
-            bb.ymin = _bb[1]
-            bb.xmax = _bb[2]
-            bb.ymax = _bb[3]
+            bb.xmin = bboxes[i,0]
+            bb.ymin = bboxes[i,1]
+            bb.xmax = bboxes[i,2]
+            bb.ymax = bboxes[i,3]
             root = rt_insert(root, bb, i)
-            i += 1
 
-        self.count = i
+        self.count = len(bboxes)
+        self.maxchildren = maxchildren
         self.root = root
         return
 
+    @classmethod
+    def from_bboxes(cls, bboxes, int maxchildren=50):
+        """ Construct a packed R-tree from an array of bounding boxes.
+
+        Parameters
+        ----------
+        bboxes : array-like
+            (n, 4) array of (xmin, ymin, xmax, ymax) rows. Search results are
+            indices of rows.
+        maxchildren : int, optional
+            maximum number of children per node, at least 4 (default 50)
+
+        Returns
+        -------
+        RTree
+        """
+        cdef RTree tree = RTree.__new__(RTree)
+        tree._bulk_load(bboxes, maxchildren)
+        return tree
+
+    cdef _bulk_load(self, bboxes, int maxchildren):
+        cdef double[:,::1] bb = np.ascontiguousarray(bboxes, dtype=np.float64)
+        cdef int n = bb.shape[0]
+        if bb.shape[1] != 4:
+            raise ValueError("bounding boxes must be an (n, 4) array")
+        if maxchildren < 4:
+            raise ValueError("maxchildren must be at least 4")
+        if n == 0:
+            self.root = rt_bulk_load(NULL, 0, maxchildren, LINEAR)
+        else:
+            self.root = rt_bulk_load(&bb[0,0], n, maxchildren, LINEAR)
+        self.count = n
+        self.maxchildren = maxchildren
+        return
+
     def __dealloc__(self):
         if self.root != NULL:
             rt_free(self.root)
 
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        return (RTree.from_bytes, (self.to_bytes(),))
+
     @property
     def bbox(self):
-        return (self.root.bbox.xmin, self.root.bbox.ymin,
-                self.root.bbox.xmax, self.root.bbox.ymax)
+        if self.root != NULL:
+            return (self.root.bbox.xmin, self.root.bbox.ymin,
+                    self.root.bbox.xmax, self.root.bbox.ymax)
+        return tuple(self._arrays[0][:4])
 
-    def search_within(self, bbox, int max_results=-1):
-        """ Return a list of geometries that are within a bounding box. """
-        cdef Pool* result
-        cdef Bbox* bb = rt_new_bbox()
-        cdef list out = []
+    def _flat_arrays(self):
+        """ Return the (node_bboxes, item_bboxes, node_info, children) arrays
+        of the flattened tree """
+        cdef int nnodes = 0
+        cdef int nchildren = 0
+        cdef double[::1] node_bboxes
+        cdef double[::1] item_bboxes
+        cdef int[::1] node_info
+        cdef int[::1] children
+        if self.root == NULL:
+            return self._arrays
 
-        bb.xmin = bbox[0]
-        bb.ymin = bbox[1]
-        bb.xmax = bbox[2]
-        bb.ymax = bbox[3]
+        rt_count(self.root, &nnodes, &nchildren)
+        arrays = (np.zeros(4*nnodes, dtype=np.float64),
+                  np.zeros(4*self.count+1, dtype=np.float64),
+                  np.zeros(3*nnodes, dtype=np.intc),
+                  np.zeros(nchildren+1, dtype=np.intc))
+        node_bboxes, item_bboxes, node_info, children = arrays
+        if rt_flatten(self.root, nnodes, &node_bboxes[0], &item_bboxes[0],
+                      &node_info[0], &children[0]) != 0:
+            raise MemoryError()
+        return (arrays[0], arrays[1][:4*self.count], arrays[2],
+                arrays[3][:nchildren])
 
-        result = rt_search_within(self.root, bb, max_results)
-        while result.count != 0:
-            out.append((<int*> pool_pop(result, result.count-1))[0])
-        pool_destroy(result)
-        return out
+    def to_bytes(self):
+        """ Serialize the tree to a compact binary buffer, which can be read
+        with `from_bytes`.
 
-    def search_overlapping(self, bbox, int max_results=-1):
-        """ Return a list of geometries that are within a bounding box. """
+        Returns
+        -------
+        bytes
+        """
+        node_bboxes, item_bboxes, node_info, children = self._flat_arrays()
+        header = np.array([len(node_bboxes)//4, self.count, len(children),
+                           self.maxchildren], dtype="<i8")
+        parts = [MAGIC, header.tobytes(),
+                 node_bboxes.astype("<f8").tobytes(),
+                 item_bboxes.astype("<f8").tobytes(),
+                 node_info.astype("<i4").tobytes(),
+                 children.astype("<i4").tobytes()]
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """ Read a tree serialized by `to_bytes`. The tree is searched in place,
+        so *buf* may be a memory-mapped file.
+
+        Parameters
+        ----------
+        buf : bytes-like object
+
+        Returns
+        -------
+        RTree
+        """
+        cdef RTree tree = RTree.__new__(RTree)
+        cdef const double[::1] node_bboxes
+        cdef const double[::1] item_bboxes
+        cdef const int[::1] node_info
+        cdef const int[::1] children
+        cdef int nnodes, nitems, nchildren
+
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError("buffer does not contain a serialized RTree")
+        offset = len(MAGIC)
+        if len(buf) < offset + 32:
+            raise ValueError("serialized RTree has inconsistent size")
+        header = np.frombuffer(buf, dtype="<i8", count=4, offset=offset)
+        if np.any(header < 0) or np.any(header > np.iinfo(np.intc).max):
+            raise ValueError("serialized RTree has an invalid header")
+        nnodes, nitems, nchildren, maxchildren = header
+        offset += 32
+        sizes = [("<f8", 4*nnodes), ("<f8", 4*nitems), ("<i4", 3*nnodes),
+                 ("<i4", nchildren)]
+        if offset + sum(np.dtype(t).itemsize*n for t, n in sizes) != len(buf):
+            raise ValueError("serialized RTree has inconsistent size")
+
+        arrays = []
+        for t, n in sizes:
+            a = np.frombuffer(buf, dtype=t, count=n, offset=offset)
+            arrays.append(np.ascontiguousarray(a, dtype=np.dtype(t).newbyteorder("=")))
+            offset += a.nbytes
+        _check_flat_tree(nnodes, nitems, arrays[2], arrays[3])
+        node_bboxes, item_bboxes, node_info, children = arrays
+
+        tree._arrays = tuple(arrays)
+        tree.count = nitems
+        tree.maxchildren = maxchildren
+        tree.flat.nnodes = nnodes
+        if nnodes != 0:
+            tree.flat.node_bboxes = &node_bboxes[0]
+            tree.flat.node_info = &node_info[0]
+        if nitems != 0:
+            tree.flat.item_bboxes = &item_bboxes[0]
+        if nchildren != 0:
+            tree.flat.children = &children[0]
+        return tree
+
+    def save(self, path):
+        """ Write the serialized tree to a file """
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+        return
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        """ Read a tree written by `save`. By default, the file is memory-mapped
+        rather than read, so that loading is immediate and pages are read as
+        searches require them. """
+        with open(path, "rb") as f:
+            if use_mmap:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+        return cls.from_bytes(buf)
+
+    cdef list _search(self, bbox, int max_results, int overlapping):
         cdef Pool* result
-        cdef Bbox* bb = rt_new_bbox()
+        cdef Bbox bb
+        cdef int *found
+        cdef int nfound, i
         cdef list out = []
 
         bb.xmin = bbox[0]
@@ -101,9 +327,27 @@ cdef class RTree:
         bb.xmax = bbox[2]
         bb.ymax = bbox[3]
 
-        result = rt_search_overlapping(self.root, bb, max_results)
-        while result.count != 0:
-            out.append((<int*> pool_pop(result, result.count-1))[0])
-        pool_destroy(result)
+        if self.root != NULL:
+            if overlapping:
+                result = rt_search_overlapping(self.root, &bb, max_results)
+            else:
+                result = rt_search_within(self.root, &bb, max_results)
+            while result.count != 0:
+                out.append((<int*> pool_pop(result, result.count-1))[0])
+            pool_destroy(result)
+        else:
+            found = rt_flat_search(&self.flat, &bb, max_results, overlapping,
+                                   &nfound)
+            if found == NULL:
+                raise MemoryError()
+            out = [found[i] for i in range(nfound)]
+            free(found)
         return out
 
+    def search_within(self, bbox, int max_results=-1):
+        """ Return a list of geometries that are within a bounding box. """
+        return self._search(bbox, max_results, 0)
+
+    def search_overlapping(self, bbox, int max_results=-1):
+        """ Return a list of geometries that overlap a bounding box. """
+        return self._search(bbox, max_results, 1)
@@ -1,10 +1,41 @@
 import sys
+import os
+import shutil
+import tempfile
 from ez_setup import use_setuptools
 use_setuptools()
 from os.path import exists
+from distutils.errors import CompileError, LinkError
 from setuptools import setup, Extension
 from setuptools.command.build_ext import build_ext as _build_ext
 
+# Extensions that divide work between threads with OpenMP when the compiler
+# supports it, and run serially otherwise
+OPENMP_EXTENSIONS = ["karta.raster.crfuncs"]
+
+def openmp_flags(compiler):
+    """ Return compile and link arguments enabling OpenMP, or None if
+    *compiler* cannot build an OpenMP program. """
+    if compiler.compiler_type == "msvc":
+        flags = (["/openmp"], [])
+    else:
+        flags = (["-fopenmp"], ["-fopenmp"])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmpdir, "openmp_check.c")
+        with open(src, "w") as f:
+            f.write("#include <omp.h>\n"
+                    "int main(void) { return omp_get_max_threads() < 1; }\n")
+        objects = compiler.compile([src], output_dir=tmpdir,
+                                   extra_postargs=flags[0])
+        compiler.link_executable(objects, "openmp_check", output_dir=tmpdir,
+                                 extra_postargs=flags[1])
+    except (CompileError, LinkError):
+        return None
+    finally:
+        shutil.rmtree(tmpdir)
+    return flags
+
 class build_ext(_build_ext):
 
     # solution taken from http://stackoverflow.com/questions/19919905/ \
@@ -50,6 +81,19 @@ class build_ext(_build_ext):
                                     "Cython required for install".format(src))
         return
 
+    def build_extensions(self):
+        """ Adds OpenMP flags to OPENMP_EXTENSIONS if they can be used """
+        flags = openmp_flags(self.compiler)
+        if flags is None:
+            print("OpenMP not available: threaded raster sampling will run "
+                  "serially")
+        else:
+            for ext in self.extensions:
+                if ext.name in OPENMP_EXTENSIONS:
+                    ext.extra_compile_args = ext.extra_compile_args + flags[0]
+                    ext.extra_link_args = ext.extra_link_args + flags[1]
+        _build_ext.build_extensions(self)
+
 # File extension is added to sources at overloaded build_ext.run()
 extensions = [
         Extension("karta.raster.crfuncs", ["karta/raster/crfuncs.pyx"]),
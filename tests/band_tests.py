@@ -2,7 +2,10 @@ import unittest
 import numpy as np
 import numpy.testing as npt
 
-from karta.raster import SimpleBand, CompressedBand
+import copy
+import tempfile
+from karta.raster import SimpleBand, CompressedBand, MmapBand, ChunkCache
+from karta.raster import RegularGrid
 from karta.raster.band import BandIndexer
 
 class GenericBandTests(object):
@@ -54,6 +57,59 @@ class GenericBandTests(object):
         band = self.type((1024, 1024), np.float64, initval=0.0)
         self.assertTrue(band is not None)
 
+    def test_chunkstats(self):
+        band = self.type((300, 500), np.float64, initval=-1.0, **self.initkwargs)
+        stats = band.chunkstats
+        stats.nodata = -1.0
+        self.assertEqual(stats.summary(band), (None, None, 0.0, 0, 150000))
+
+        np.random.seed(0)
+        d = np.random.rand(100, 200)
+        d[5,5] = np.nan
+        d[6,6] = -1.0
+        band.setblock(50, 250, d)
+        valid = d[~np.isnan(d) & (d != -1.0)]
+        vmin, vmax, total, count, nodatacount = stats.summary(band)
+        self.assertEqual((vmin, vmax, count, nodatacount),
+                         (valid.min(), valid.max(), 19998, 150000-19998))
+        self.assertAlmostEqual(total, valid.sum())
+
+        # changing nodata recomputes statistics from the band
+        stats.nodata = np.nan
+        self.assertEqual(stats.summary(band)[:4:3], (-1.0, 149999))
+        return
+
+    def test_chunkstats_has_data(self):
+        band = self.type((300, 500), np.int16, initval=-1, **self.initkwargs)
+        band.chunkstats.nodata = -1
+        band.setblock(260, 270, np.full((3, 3), 5, dtype=np.int16))
+        self.assertFalse(band.chunkstats.has_data(band, 0, 0, 100, 100))
+        self.assertTrue(band.chunkstats.has_data(band, 255, 265, 10, 10))
+        self.assertFalse(band.chunkstats.has_data(band, 250, 250, 10, 19))
+        self.assertTrue(band.chunkstats.has_data(band, 250, 250, 10, 19,
+                                                 exact=False))
+        return
+
+    def test_write_through_getblock(self):
+        band = self.type((64, 64), np.float64, initval=0.0, **self.initkwargs)
+        grid = RegularGrid((0, 0, 1, 1, 0, 0), bands=[band], nodata_value=-1)
+        self.assertEqual(grid.max(), 0.0)
+
+        # blocks are either copies or read-only, so that writes cannot bypass
+        # the statistics kept by setblock
+        block = band.getblock(0, 0, 64, 64)
+        try:
+            block += 3.0
+        except ValueError:
+            pass
+        self.assertEqual(grid.max(), 0.0)
+        npt.assert_equal(band.getblock(0, 0, 64, 64), 0.0)
+
+        grid[:,:] += 3.0
+        self.assertEqual(grid.max(), 3.0)
+        self.assertEqual(grid.min(), 3.0)
+        return
+
 
 class SimpleBandTests(unittest.TestCase, GenericBandTests):
 
@@ -68,6 +124,126 @@ class CompressedBandTests(unittest.TestCase, GenericBandTests):
         self.type = CompressedBand
         self.initkwargs = dict(chunksize=(256, 256))
 
+class CachedCompressedBandTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = CompressedBand
+        self.initkwargs = dict(chunksize=(256, 256), cache=ChunkCache())
+
+    def test_repeated_reads_hit_cache(self):
+        cache = ChunkCache()
+        band = CompressedBand((512, 512), np.float64, chunksize=(256, 256),
+                              cache=cache)
+        band.setblock(0, 0, np.arange(512*512, dtype=np.float64).reshape(512, 512))
+        first = band.getblock(100, 100, 200, 200)
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+        second = band.getblock(100, 100, 200, 200)
+        self.assertEqual((cache.hits, cache.misses), (4, 4))
+        npt.assert_equal(first, second)
+
+    def test_setblock_invalidates(self):
+        cache = ChunkCache()
+        band = CompressedBand((512, 512), np.float64, chunksize=(256, 256),
+                              cache=cache)
+        band.setblock(0, 0, np.zeros((512, 512)))
+        band.getblock(0, 0, 512, 512)
+        band.setblock(10, 10, np.ones((2, 2)))
+        self.assertEqual(band.getblock(10, 10, 1, 1)[0], 1.0)
+        self.assertEqual(np.sum(band.getblock(0, 0, 512, 512)), 4.0)
+
+    def test_eviction_respects_budget(self):
+        chunkbytes = 64*64*8
+        cache = ChunkCache(maxbytes=2*chunkbytes)
+        band = CompressedBand((256, 64), np.float64, chunksize=(64, 64),
+                              cache=cache)
+        band.setblock(0, 0, np.ones((256, 64)))
+        band.getblock(0, 0, 256, 64)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2*chunkbytes)
+        self.assertEqual(cache.evictions, 2)
+
+        # most recently used chunks are retained
+        cache.reset_counters()
+        band.getblock(192, 0, 64, 64)
+        self.assertEqual(cache.hits, 1)
+        band.getblock(0, 0, 64, 64)
+        self.assertEqual(cache.misses, 1)
+
+    def test_shared_cache(self):
+        cache = ChunkCache()
+        band1 = CompressedBand((16, 16), np.float32, cache=cache)
+        band2 = CompressedBand((16, 16), np.float32, cache=cache)
+        band1.setblock(0, 0, np.ones((16, 16)))
+        band2.setblock(0, 0, 2*np.ones((16, 16)))
+        npt.assert_equal(band1.getblock(0, 0, 16, 16), 1.0)
+        npt.assert_equal(band2.getblock(0, 0, 16, 16), 2.0)
+        self.assertEqual(len(cache), 2)
+
+    def test_integer_cache(self):
+        band = CompressedBand((16, 16), np.float32, cache=1024*1024)
+        self.assertEqual(band.cache.maxbytes, 1024*1024)
+
+    def test_deepcopy_independent(self):
+        band = CompressedBand((16, 16), np.float32, cache=ChunkCache())
+        band.setblock(0, 0, np.ones((16, 16)))
+        band.getblock(0, 0, 16, 16)
+        band2 = copy.deepcopy(band)
+        self.assertTrue(band2.cache is band.cache)
+        band2.setblock(0, 0, np.zeros((16, 16)))
+        npt.assert_equal(band.getblock(0, 0, 16, 16), 1.0)
+        npt.assert_equal(band2.getblock(0, 0, 16, 16), 0.0)
+
+class ThreadedCompressedBandTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = CompressedBand
+        self.initkwargs = dict(chunksize=(128, 128), nthreads=4)
+
+    def test_threaded_matches_serial(self):
+        x, y = np.meshgrid(np.arange(700), np.arange(500))
+        d = x**2+np.sqrt(y)
+        serial = CompressedBand((600, 800), np.float64, chunksize=(64, 64),
+                                nthreads=1)
+        threaded = CompressedBand((600, 800), np.float64, chunksize=(64, 64),
+                                  nthreads=4, cache=ChunkCache())
+        serial.setblock(37, 51, d)
+        threaded.setblock(37, 51, d)
+        npt.assert_equal(serial.getblock(0, 0, 600, 800),
+                         threaded.getblock(0, 0, 600, 800))
+        npt.assert_equal(serial.getblock(100, 13, 250, 311),
+                         threaded.getblock(100, 13, 250, 311))
+
+class MmapBandTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = MmapBand
+        self.initkwargs = dict()
+
+    def test_initval_filled(self):
+        band = MmapBand((64, 32), np.float32, initval=np.nan)
+        self.assertTrue(np.all(np.isnan(band.getblock(0, 0, 64, 32))))
+
+    def test_file_roundtrip(self):
+        with tempfile.NamedTemporaryFile(suffix=".dat") as f:
+            band = MmapBand((128, 64), np.int16, initval=0, filename=f.name)
+            band.setblock(10, 20, np.full((5, 5), 7, dtype=np.int16))
+            band.flush()
+            del band
+
+            band = MmapBand((128, 64), np.int16, filename=f.name, mode="r")
+            self.assertEqual(np.sum(band.getblock(0, 0, 128, 64)), 175)
+            self.assertEqual(band.getblock(12, 22, 1, 1)[0], 7)
+            del band
+
+    def test_grid_copy(self):
+        grid = RegularGrid((0, 0, 1, 1, 0, 0), values=np.ones((16, 16)),
+                           bandclass=MmapBand)
+        grid2 = grid.copy()
+        grid2[:,:] = 2.0
+        self.assertTrue(isinstance(grid2.bands[0], MmapBand))
+        npt.assert_equal(grid[:,:], 1.0)
+        npt.assert_equal(grid2[:,:], 2.0)
+
 class BandIndexerTests(unittest.TestCase):
 
     def test_get_set_typeerror(self):
@@ -47,5 +47,77 @@ class TestCrfuncs(unittest.TestCase):
         self.assertEqual(arr[22, 32], -999.0)
         self.assertEqual(np.sum(np.abs(Zorig[arr!=-999] - arr[arr!=-999])), 0.0)
 
+    def test_sample_bilinear_multiband(self):
+        np.random.seed(42)
+        Z = np.random.randint(0, 200, (20, 30, 3)).astype(np.uint8)
+        Z.flags.writeable = False
+        I = np.r_[np.random.rand(50)*19, [0.0, 19.0, 19.5, -0.5]]
+        J = np.r_[np.random.rand(50)*29, [0.0, 29.0, 3.0, 3.0]]
+        res = crfuncs.sample_bilinear(I, J, Z, -1.0)
+        self.assertEqual(res.shape, (54, 3))
+        for k in range(3):
+            single = crfuncs.sample_bilinear(I, J, Z[:,:,k], -1.0)
+            self.assertTrue(np.array_equal(res[:,k], single[:,0]))
+        i0 = np.floor(I[:50]).astype(int)
+        j0 = np.floor(J[:50]).astype(int)
+        ti = (I[:50] - i0)[:,np.newaxis]
+        tj = (J[:50] - j0)[:,np.newaxis]
+        Zf = Z.astype(np.float64)
+        expected = Zf[i0,j0]*(1-ti)*(1-tj) + Zf[i0+1,j0]*ti*(1-tj) \
+                 + Zf[i0,j0+1]*(1-ti)*tj + Zf[i0+1,j0+1]*ti*tj
+        self.assertTrue(np.allclose(res[:50], expected))
+        self.assertTrue(np.array_equal(res[50], Zf[0,0]))
+        self.assertTrue(np.array_equal(res[51], Zf[19,29]))
+        self.assertTrue(np.all(res[52:] == -1.0))
+        return
+
+    def test_sample_bicubic(self):
+        # cubic convolution reproduces quadratic surfaces away from edges
+        y, x = np.mgrid[0:40, 0:50].astype(np.float64)
+        Z = (0.3*x**2 + 0.2*x*y - 0.1*y**2 + x).astype(np.float32)
+        np.random.seed(42)
+        I = np.random.rand(100)*30 + 5
+        J = np.random.rand(100)*40 + 5
+        res = crfuncs.sample_bicubic(I, J, Z, np.nan)[:,0]
+        self.assertTrue(np.allclose(res, 0.3*J**2 + 0.2*J*I - 0.1*I**2 + J,
+                                    rtol=1e-5))
+        res = crfuncs.sample_bicubic([0.0, 39.0, 2.0, -0.1], [0.0, 49.0, 3.0, 2.0],
+                                     Z, np.nan)[:,0]
+        self.assertEqual(list(res[:3]), [Z[0,0], Z[39,49], Z[2,3]])
+        self.assertTrue(np.isnan(res[3]))
+        return
+
+    def test_sample_bicubic_threaded(self):
+        np.random.seed(49)
+        Z = np.random.rand(60, 80, 3)
+        I = np.random.rand(20000)*59
+        J = np.random.rand(20000)*79
+        for sample in (crfuncs.sample_bilinear, crfuncs.sample_bicubic):
+            serial = sample(I, J, Z, np.nan, nthreads=1)
+            threaded = sample(I, J, Z, np.nan, nthreads=4)
+            self.assertTrue(np.array_equal(serial, threaded))
+        return
+
+    def test_sample_dtypes(self):
+        np.random.seed(49)
+        Z = np.random.randint(0, 100, (30, 40, 2))
+        I = np.random.rand(200)*29
+        J = np.random.rand(200)*39
+        for sample in (crfuncs.sample_bilinear, crfuncs.sample_bicubic):
+            expected = sample(I, J, Z.astype(np.float64), np.nan)
+            for dtype in (np.uint8, np.uint16, np.uint32, np.uint64, np.int8,
+                          np.int16, np.int32, np.int64, np.float32):
+                # strided views are read without a copy
+                Zt = np.zeros((30, 80, 2), dtype=dtype)[:,::2]
+                Zt[...] = Z
+                self.assertTrue(np.allclose(sample(I, J, Zt, np.nan), expected))
+
+            with self.assertRaises(TypeError):
+                sample(I, J, Z.astype(np.bool_), np.nan)
+            with self.assertRaises(TypeError):
+                sample(I, J, Z.astype(np.float64).byteswap().newbyteorder(),
+                       np.nan)
+        return
+
 if __name__ == "__main__":
     unittest.main()
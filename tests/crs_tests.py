@@ -270,6 +270,60 @@ class TestCRS(unittest.TestCase):
         self.assertAlmostEqual(lng, -107.50062798611111, places=3)
         self.assertAlmostEqual(lat, 43.13996053333333, places=3)
 
+class TestTransformerCache(unittest.TestCase):
+
+    def test_cache_hits(self):
+        cache = crs.TransformerCache()
+        t1 = cache.get(crs.LonLatWGS84, crs.NSIDCNorth)
+        t2 = cache.get(crs.LonLatWGS84, crs.NSIDCNorth)
+        cache.get(crs.NSIDCNorth, crs.LonLatWGS84)
+        self.assertTrue(t1 is t2)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(cache), 2)
+
+        cache.reset_counters()
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hit_ratio, 0.0)
+
+    def test_cache_eviction(self):
+        cache = crs.TransformerCache(maxsize=1)
+        cache.get(crs.LonLatWGS84, crs.NSIDCNorth)
+        cache.get(crs.LonLatWGS84, crs.NSIDCSouth)
+        cache.get(crs.LonLatWGS84, crs.NSIDCNorth)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.misses, 3)
+
+    def test_transform_uses_cache(self):
+        crs.LonLatWGS84.transform(crs.UPSNorth, -45.0, 70.0)
+        hits = crs.TRANSFORMERS.hits
+        for _ in range(5):
+            crs.LonLatWGS84.transform(crs.UPSNorth, -45.0, 70.0)
+        self.assertEqual(crs.TRANSFORMERS.hits, hits+5)
+
+    def test_transform_inplace(self):
+        x = np.linspace(-180, 180, 50)
+        y = np.linspace(60, 89, 50)
+        expected = crs.LonLatWGS84.transform(crs.NSIDCNorth, x, y)
+        xout, yout = crs.LonLatWGS84.transform_inplace(crs.NSIDCNorth, x, y)
+        self.assertTrue(xout is x)
+        self.assertTrue(np.allclose(x, expected[0]))
+        self.assertTrue(np.allclose(y, expected[1]))
+
+        crs.NSIDCNorth.transform_inplace(crs.LonLatWGS84, x, y)
+        self.assertTrue(np.allclose(y, np.linspace(60, 89, 50)))
+
+    def test_transform_inplace_requires_float64(self):
+        x = np.arange(10, dtype=np.float32)
+        y = np.arange(10, dtype=np.float32)
+        with self.assertRaises(ValueError):
+            crs.LonLatWGS84.transform_inplace(crs.NSIDCNorth, x, y)
+        x = np.arange(20, dtype=np.float64)[::2]
+        y = np.arange(10, dtype=np.float64)
+        with self.assertRaises(ValueError):
+            crs.LonLatWGS84.transform_inplace(crs.NSIDCNorth, x, y)
+
 class TestGeodesyFuncs(unittest.TestCase):
 
     def assertTuplesAlmostEqual(self, a, b, tol=1e-8):
@@ -337,6 +391,79 @@ class TestGeodesyFuncs(unittest.TestCase):
         self.assertAlmostEqual(baz, baz_, places=4)
         self.assertAlmostEqual(d, d_, places=4)
 
+    def test_EllipsoidalForward_vectorized(self):
+        np.random.seed(43)
+        x = 360*np.random.rand(500) - 180
+        y = 180*np.random.rand(500) - 90
+        az = 360*np.random.rand(500) - 180
+        d = 2e7*np.random.rand(500)
+        x1, y1, baz = crs.LonLatWGS84.forward(x, y, az, d)
+        x1_, y1_, baz_ = geodesy.ellipsoidal_forward(6378137.0, 6356752.314245,
+                                                     x, y, az, d)
+        self.assertTrue(np.allclose(x1, x1_, atol=1e-4))
+        self.assertTrue(np.allclose(y1, y1_, atol=1e-4))
+        self.assertTrue(np.allclose(baz, baz_, atol=1e-4))
+
+    def test_EllipsoidalInverse_vectorized(self):
+        np.random.seed(43)
+        x1 = 360*np.random.rand(500) - 180
+        y1 = 178*np.random.rand(500) - 89
+        x2 = 360*np.random.rand(500) - 180
+        y2 = 178*np.random.rand(500) - 89
+        # meridional, equatorial, and nearly antipodal geodesics
+        x2[:10] = x1[:10]
+        y1[10:20] = y2[10:20] = 0.0
+        x2[20:30] = x1[20:30] + 179.9999
+        y2[20:30] = -y1[20:30] + 0.0001
+
+        az_, baz_, d_ = geodesy.ellipsoidal_inverse(6378137.0, 6356752.314245,
+                                                    x1, y1, x2, y2)
+        for i in range(500):
+            az, baz, d = geodesy.ellipsoidal_inverse(6378137.0, 6356752.314245,
+                                                     x1[i], y1[i], x2[i], y2[i])
+            self.assertAlmostEqual(az, az_[i], places=8)
+            self.assertAlmostEqual(baz, baz_[i], places=8)
+            self.assertAlmostEqual(d, d_[i], places=4)
+
+    def test_EllipsoidalInverse_vectorized_failure(self):
+        # the astroid guess cannot be bracketed for this nearly antipodal pair
+        x1, y1, x2, y2 = 0.0, 10.0, 179.99, -10.0
+        with self.assertRaises(ValueError):
+            geodesy.ellipsoidal_inverse(6378137.0, 6356752.314245,
+                                        x1, y1, x2, y2)
+        with self.assertRaises(ValueError):
+            geodesy.ellipsoidal_inverse(6378137.0, 6356752.314245,
+                                        np.array([0.0, x1]),
+                                        np.array([0.0, y1]),
+                                        np.array([1.0, x2]),
+                                        np.array([1.0, y2]))
+
+    def test_EllipsoidalInverse_broadcast(self):
+        x = np.array([-120.0, 4.0, 65.0, 170.0])
+        y = np.array([48.0, -20.0, 0.0, 71.0])
+        _, _, d = geodesy.ellipsoidal_inverse(6378137.0, 6356752.314245,
+                                              x[:,np.newaxis], y[:,np.newaxis],
+                                              x, y)
+        self.assertEqual(d.shape, (4, 4))
+        self.assertTrue(np.allclose(np.diag(d), 0.0))
+        self.assertTrue(np.allclose(d, d.T))
+        _, _, d12 = geodesy.ellipsoidal_inverse(6378137.0, 6356752.314245,
+                                                x[1], y[1], x[2], y[2])
+        self.assertAlmostEqual(d[1,2], d12, places=4)
+
+    def test_EllipsoidalArea_vectorized(self):
+        np.random.seed(43)
+        x1 = 360*np.random.rand(200) - 180
+        y1 = 178*np.random.rand(200) - 89
+        x2 = x1 + 20*np.random.rand(200) - 10
+        y2 = y1 + 20*np.random.rand(200) - 10
+        y2 = np.clip(y2, -89, 89)
+        S_ = geodesy.ellipsoidal_area(6378137.0, 6356752.314245, x1, y1, x2, y2)
+        for i in range(200):
+            S = geodesy.ellipsoidal_area(6378137.0, 6356752.314245,
+                                         x1[i], y1[i], x2[i], y2[i])
+            self.assertAlmostEqual(S, S_[i], delta=1e-9*abs(S))
+
     def test_brent1(self):
         def forsythe(x):
             return x**3 - 2*x - 5
@@ -8,6 +8,7 @@ import numpy as np
 from karta.vector.geometry import (Point, Line, Polygon,
                                    Multipoint, Multiline, Multipolygon)
 from karta.vector.geometry import affine_matrix, _flatten
+from karta import geodesy
 from karta.crs import (Cartesian, SphericalEarth, ProjectedCRS,
                        LonLatWGS84, NSIDCNorth, NSIDCSouth, GallPetersEqualArea)
 from karta.errors import CRSError
@@ -499,6 +500,44 @@ class TestGeometryAnalysis(unittest.TestCase):
         self.assertAlmostEqual(kp.area, np.pi, places=6)
         return
 
+    def test_line_length_lonlat(self):
+        np.random.seed(49)
+        x = np.cumsum(np.random.rand(500)) - 120
+        y = 40 + np.cumsum(np.random.rand(500) - 0.5)
+        line = Line(zip(x, y), crs=LonLatWGS84)
+        d = sum(LonLatWGS84.inverse(x[i], y[i], x[i+1], y[i+1])[2]
+                for i in range(len(x)-1))
+        self.assertAlmostEqual(line.length, d, places=4)
+        self.assertEqual(Line([(3.0, 4.0)], crs=LonLatWGS84).length, 0.0)
+        return
+
+    def test_poly_area_lonlat(self):
+        r = np.linspace(0, 2*np.pi, 500, endpoint=False)
+        x = 10*np.cos(r)
+        y = 40 + 10*np.sin(r)
+        for crs in (LonLatWGS84, SphericalEarth):
+            a, b = crs.ellipsoid.a, crs.ellipsoid.b
+            poly = Polygon(zip(x, y), crs=crs)
+            if a == b:
+                area = sum(geodesy.spherical_area(a, x[i-1], y[i-1], x[i], y[i])
+                           for i in range(len(x)))
+            else:
+                area = sum(geodesy.ellipsoidal_area(a, b, x[i-1], y[i-1], x[i], y[i])
+                           for i in range(len(x)))
+            self.assertAlmostEqual(poly.area, abs(area), delta=1e-9*abs(area))
+            perimeter = sum(crs.inverse(x[i-1], y[i-1], x[i], y[i])[2]
+                            for i in range(len(x)))
+            self.assertAlmostEqual(poly.perimeter, perimeter, places=4)
+        return
+
+    def test_poly_centroid_circle(self):
+        r = np.linspace(0, 2*np.pi, 1000, endpoint=False)
+        poly = Polygon(zip(3 + 2*np.cos(r), -1 + 2*np.sin(r)))
+        c = poly.centroid
+        self.assertAlmostEqual(c.x, 3.0)
+        self.assertAlmostEqual(c.y, -1.0)
+        return
+
     def test_to_points_cartesian(self):
         line = Line([(0.0, 0.0), (4.0, 3.0), (1.0, 7.0)])
         points = line.to_points(1.0)
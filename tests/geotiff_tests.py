@@ -1,11 +1,20 @@
 import unittest
 import os.path
+import shutil
+import tempfile
 import numpy as np
 from test_helper import TMPDATA
 
+try:
+    import osgeo.gdal
+except ImportError:
+    raise unittest.SkipTest("GDAL is not installed")
 import karta
 from karta.raster import _gdal
 
+UTM7 = karta.crs.ProjectedCRS("+proj=utm +zone=7 +north +datum=WGS84",
+                              "UTM 7N (WGS 84)")
+
 class GdalTests(unittest.TestCase):
 
     def test_numpy_type_coercion(self):
@@ -99,6 +108,105 @@ class GdalTests(unittest.TestCase):
         return
 
 
+class GdalStreamingWriteTests(unittest.TestCase):
+
+    def setUp(self):
+        v = np.dstack([peaks(500)[:300,:], 2*peaks(500)[:300,:]])
+        self.grid = karta.RegularGrid([15.0, 15.0, 30.0, 30.0, 0.0, 0.0], v,
+                                      crs=UTM7)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_overviews(self, fpath, iband):
+        """ Return the overviews of a band in a file, keyed by factor """
+        ds = osgeo.gdal.Open(fpath)
+        band = ds.GetRasterBand(iband)
+        overviews = {}
+        for j in range(band.GetOverviewCount()):
+            ov = band.GetOverview(j).ReadAsArray()
+            overviews[int(round(float(band.YSize) / ov.shape[0]))] = ov
+        ds = None
+        return overviews
+
+    def test_write_small_windows(self):
+        fpath = os.path.join(self.tmpdir, "test_windows.tif")
+        self.grid.to_geotiff(fpath, compress=None, max_memory=500*8*7)
+        gnew = karta.read_geotiff(fpath)
+        self.assertTrue(np.all(self.grid[:,:,:] == gnew[:,:,:]))
+
+    def test_write_tiled_threaded(self):
+        fpath = os.path.join(self.tmpdir, "test_tiled.tif")
+        self.grid.to_geotiff(fpath, compress="DEFLATE", tiled=True,
+                             nthreads=2, max_memory=256*256*8)
+        gnew = karta.read_geotiff(fpath)
+        self.assertTrue(np.all(self.grid[:,:,:] == gnew[:,:,:]))
+
+    def test_write_tiled_windows_2d(self):
+        # windows of 64x64 blocks split both axes, with partial windows at the
+        # trailing edges
+        fpath = os.path.join(self.tmpdir, "test_tiled_2d.tif")
+        self.grid.to_geotiff(fpath, compress=None, tiled=True,
+                             BLOCKXSIZE=64, BLOCKYSIZE=64,
+                             max_memory=64*128*8)
+        ds = osgeo.gdal.Open(fpath)
+        self.assertEqual(ds.GetRasterBand(1).GetBlockSize(), [64, 64])
+        for i in range(2):
+            values = ds.GetRasterBand(i+1).ReadAsArray()
+            self.assertTrue(np.all(values == self.grid[::-1,:,i]))
+        ds = None
+
+    def test_write_overviews(self):
+        fpath = os.path.join(self.tmpdir, "test_overviews.tif")
+        self.grid.to_geotiff(fpath, compress=None, overviews=[2, 4],
+                             max_memory=500*8*16)
+        for i in range(2):
+            overviews = self.read_overviews(fpath, i+1)
+            self.assertEqual(sorted(overviews), [2, 4])
+            top = self.grid[::-1,:,i]
+            for f in (2, 4):
+                self.assertEqual(overviews[f].shape, (300//f, 500//f))
+                expected = top.reshape(300//f, f, 500//f, f).mean(axis=(1, 3))
+                self.assertTrue(np.allclose(overviews[f], expected))
+
+    def test_write_overviews_nearest(self):
+        fpath = os.path.join(self.tmpdir, "test_overviews_nearest.tif")
+        # factors are out of order, and windows are small
+        self.grid.to_geotiff(fpath, compress=None, overviews=[4, 2],
+                             overview_method="nearest", max_memory=500*8*16)
+        overviews = self.read_overviews(fpath, 1)
+        top = self.grid[::-1,:,0]
+        self.assertTrue(np.all(overviews[2] == top[1::2, 1::2]))
+        self.assertTrue(np.all(overviews[4] == top[2::4, 2::4]))
+
+    def test_write_overviews_partial_blocks(self):
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=np.arange(35.0).reshape(5, 7), crs=UTM7)
+        fpath = os.path.join(self.tmpdir, "test_overviews_partial.tif")
+        grid.to_geotiff(fpath, compress=None, overviews=[2])
+        ov = self.read_overviews(fpath, 1)[2]
+        top = grid[::-1,:,0]
+        self.assertEqual(ov.shape, (3, 4))
+        self.assertEqual(ov[0,0], top[:2,:2].mean())
+        self.assertEqual(ov[2,3], top[4,6])
+        self.assertEqual(ov[2,0], top[4,:2].mean())
+
+    def test_downsample_average_nodata(self):
+        a = np.array([[1.0, 3.0, 5.0],
+                      [np.nan, 5.0, 7.0]])
+        ds = _gdal._downsample(a, 2, "average", np.nan)
+        self.assertEqual(ds.shape, (1, 2))
+        self.assertEqual(ds[0,0], 3.0)
+        self.assertEqual(ds[0,1], 6.0)
+
+    def test_downsample_nearest_centre(self):
+        a = np.arange(42).reshape(6, 7)
+        ds = _gdal._downsample(a, 4, "nearest", -1)
+        self.assertEqual(ds.tolist(), [[16, 20], [37, 41]])
+        ds = _gdal._downsample(a, 3, "nearest", -1)
+        self.assertEqual(ds.tolist(), [[8, 11, 13], [29, 32, 34]])
+
 class GdalVirtualArrayTests(unittest.TestCase):
 
     def setUp(self):
@@ -133,6 +241,88 @@ class GdalVirtualArrayTests(unittest.TestCase):
         self.assertEqual(i, 100)
         return
 
+    def test_setblock_readonly_virtual(self):
+        with self.assertRaises(IOError):
+            self.grid.bands[0].setblock(0, 0, np.zeros((2, 2)))
+
+    def test_write_virtual(self):
+        fpath = os.path.join(TMPDATA, "test_update.tif")
+        karta.RegularGrid(self.grid.transform, values=self.grid[:,:],
+                          crs=self.grid.crs).to_geotiff(fpath, compress=None)
+
+        grid = karta.read_geotiff(fpath, in_memory=False, update=True)
+        grid[20:30, 100:250] = -1.0
+        self.assertTrue(np.all(grid[20:30, 100:250] == -1.0))
+        expected = grid[:,:]
+        for band in grid.bands:
+            band.close()
+
+        gnew = karta.read_geotiff(fpath)
+        self.assertTrue(np.all(gnew[:,:] == expected))
+        return
+
+class GdalFileBandUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmpdir, "test_update.tif")
+        self.values = peaks(500)[:300,:]
+        grid = karta.RegularGrid([15.0, 15.0, 30.0, 30.0, 0.0, 0.0],
+                                 values=self.values, crs=UTM7)
+        grid.to_geotiff(self.fpath, compress=None, tiled=True,
+                        BLOCKXSIZE=64, BLOCKYSIZE=64)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_file(self):
+        """ Return the first band of the file as it is on disk, bottom row
+        first """
+        ds = osgeo.gdal.Open(self.fpath)
+        values = ds.GetRasterBand(1).ReadAsArray()[::-1]
+        ds = None
+        return values
+
+    def test_flush_partial_blocks(self):
+        grid = karta.read_geotiff(self.fpath, in_memory=False, update=True)
+        band = grid.bands[0]
+        # spans partial and whole 64x64 blocks, and the trailing edges
+        band.setblock(50, 30, np.full((200, 150), -1.0))
+        band.setblock(290, 480, np.full((10, 20), -2.0))
+        expected = self.values.copy()
+        expected[50:250, 30:180] = -1.0
+        expected[290:300, 480:500] = -2.0
+
+        self.assertTrue(np.all(band.getblock(0, 0, 300, 500) == expected))
+        self.assertTrue(np.all(self.read_file() == self.values))
+        band.flush()
+        self.assertTrue(np.all(self.read_file() == expected))
+        self.assertTrue(np.all(band.getblock(0, 0, 300, 500) == expected))
+        band.close()
+
+    def test_flush_when_cache_full(self):
+        ds = osgeo.gdal.Open(self.fpath, osgeo.gdal.GA_Update)
+        # room for about four blocks
+        band = _gdal.GdalFileBand(ds.GetRasterBand(1), ds, update=True,
+                                  cache=4*64*64*8)
+        expected = self.values.copy()
+        for i in range(0, 300, 64):
+            for j in range(0, 500, 64):
+                expected[i:i+10, j:j+10] = i + j
+                band.setblock(i, j, np.full((10, 10), float(i+j)))
+                self.assertTrue(band._dirtybytes <= 5*64*64*8)
+        self.assertTrue(np.all(band.getblock(0, 0, 300, 500) == expected))
+        band.close()
+        ds = None
+        self.assertTrue(np.all(self.read_file() == expected))
+
+    def test_readonly_flush(self):
+        grid = karta.read_geotiff(self.fpath, in_memory=False)
+        with self.assertRaises(IOError):
+            grid.bands[0].setblock(0, 0, np.zeros((2, 2)))
+        grid.bands[0].close()
+        self.assertTrue(np.all(self.read_file() == self.values))
+
 def peaks(n=49):
     """ 2d peaks function of MATLAB logo fame. """
     X, Y = np.meshgrid(np.linspace(-3, 3, n), np.linspace(-3, 3, n))
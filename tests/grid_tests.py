@@ -151,6 +151,23 @@ class RegularGridTests(unittest.TestCase):
         self.assertEqual(np.nansum(grid3_mosaic[:,:,1]), 920)
         self.assertEqual(np.nansum(grid3_mosaic[:,:,2]), 1288)
 
+    def test_merge_chunked(self):
+        np.random.seed(49)
+        grids = []
+        for i in range(5):
+            values = np.random.rand(12, 10, 2)
+            values[np.random.rand(12, 10, 2) < 0.1] = np.nan
+            grids.append(RegularGrid([np.random.randint(-10, 10),
+                                      np.random.randint(-10, 10), 1, 1, 0, 0],
+                                     values=values))
+        weights = [1, 2, 3, 4, 5]
+        expected = karta.raster.merge(grids, weights=weights)
+        mosaic = karta.raster.merge(grids, weights=weights, chunksize=(4, 3),
+                                    bandclass=karta.raster.MmapBand)
+        self.assertEqual(mosaic.transform, expected.transform)
+        self.assertTrue(isinstance(mosaic.bands[0], karta.raster.MmapBand))
+        npt.assert_array_equal(mosaic[:,:], expected[:,:])
+
     def test_align_origin(self):
         xx, yy = np.meshgrid(np.linspace(0, 1, 50), np.linspace(0, 1, 30))
         zz = 2.0*xx**2 - 3.0*yy**2
@@ -312,6 +329,135 @@ class RegularGridTests(unittest.TestCase):
                          [0.16326530612244894, 0.48979591836734693,
                           0.63265306122448983, 0.74052478134110788])
 
+    def test_sample_chunked(self):
+        from karta.raster.band import CompressedBand, SimpleBand, ChunkCache
+        np.random.seed(42)
+        values = np.dstack([np.random.rand(300, 400), np.random.rand(300, 400)])
+        simple = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values,
+                             bandclass=SimpleBand)
+        chunked = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values,
+                              bandclass=CompressedBand)
+        x = np.r_[np.random.rand(500)*410 - 5, np.arange(0, 400, 32)]
+        y = np.r_[np.random.rand(500)*310 - 5, np.arange(0, 300, 24)]
+
+        res = chunked.sample_nearest(x, y)
+        self.assertTrue(np.array_equal(res, simple.sample_nearest(x, y),
+                                       equal_nan=True))
+        i, j = chunked.indices(x[500:], y[500:])
+        self.assertTrue(np.array_equal(res[:,500:], values[i,j,:].T))
+
+        res = chunked.sample_bilinear(x, y)
+        self.assertTrue(np.array_equal(res, simple.sample_bilinear(x, y),
+                                       equal_nan=True))
+        return
+
+    def test_sample_reads_touched_chunks(self):
+        from karta.raster.band import CompressedBand, ChunkCache
+        cache = ChunkCache()
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                           bands=[CompressedBand((1024, 1024), np.float64,
+                                                 chunksize=(128, 128),
+                                                 cache=cache)])
+        grid[:,:] = np.arange(1024*1024, dtype=np.float64).reshape(1024, 1024)
+        # points in two opposite corner chunks
+        res = grid.sample_nearest(np.array([10.5, 20.5, 1000.5]),
+                                  np.array([5.5, 15.5, 1010.5]))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(list(res[0]), [5*1024+10.0, 15*1024+20.0,
+                                        1010*1024+1000.0])
+        return
+
+    def test_build_overviews_mean(self):
+        values = np.arange(10*14, dtype=np.float64).reshape(10, 14)
+        values[0,0] = np.nan
+        grid = RegularGrid([0.0, 0.0, 1.0, 2.0, 0.0, 0.0], values=values)
+        ovs = grid.build_overviews(levels=(2, 4), method="mean",
+                                   chunksize=(4, 8))
+        self.assertEqual(sorted(ovs), [2, 4])
+        self.assertEqual(ovs[2].size, (5, 7))
+        self.assertEqual(ovs[4].size, (3, 4))
+        self.assertEqual(ovs[4].transform, (0.0, 0.0, 4.0, 8.0, 0.0, 0.0))
+        self.assertEqual(ovs[2][0,0], np.mean([1, 14, 15]))
+        self.assertEqual(ovs[2][3,5], values[6:8,10:12].mean())
+        # partial cells at the trailing edges
+        self.assertEqual(ovs[4][2,3], values[8:10,12:14].mean())
+        return
+
+    def test_build_overviews_mode(self):
+        values = np.array([[1, 1, 2, 2],
+                           [3, 1, 2, 3],
+                           [0, 0, 5, 6],
+                           [0, 4, 6, 5]], dtype=np.int16)
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values,
+                           nodata_value=0)
+        ov = grid.build_overviews(levels=(2,), method="mode")[2]
+        self.assertEqual(ov[:,:,0].dtype, np.int16)
+        self.assertEqual(ov[:,:,0].tolist(), [[1, 2], [4, 5]])
+        return
+
+    def test_overviews_strided_index(self):
+        from karta.raster.band import CompressedBand, ChunkCache
+        values = np.random.rand(64, 48)
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values)
+        grid.build_overviews(levels=(2, 4), method="nearest")
+
+        # reads come from the coarse level without touching the full bands
+        cache = ChunkCache()
+        grid.bands[0]._cache = cache
+        self.assertTrue(np.array_equal(grid[::8,4:41:4,0], values[::8,4:41:4]))
+        self.assertTrue(np.array_equal(grid[2::6,::2,0], values[2::6,::2]))
+        self.assertEqual(cache.misses, 0)
+        self.assertTrue(np.array_equal(grid[1::4,::4,0], values[1::4,::4]))
+
+        # assigning values discards the overviews
+        grid[:,:] = 0.0
+        self.assertEqual(grid.overviews, {})
+        self.assertTrue(np.all(grid[::4,::4] == 0.0))
+        return
+
+    def test_overviews_resample(self):
+        xx, yy = np.meshgrid(np.arange(256.0), np.arange(256.0))
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                           values=2.0*xx - 3.0*yy)
+        direct = grid.resample(8.0, 8.0, method="linear")
+        grid.build_overviews(levels=(2, 4, 16), method="mean")
+        self.assertTrue(grid._overview_level(8.0, 8.0) is grid.overviews[4])
+        self.assertTrue(grid._overview_level(1.5, 8.0) is grid)
+        fromov = grid.resample(8.0, 8.0, method="linear")
+        self.assertEqual(fromov.transform, direct.transform)
+        # block means of a linear function are exact
+        self.assertTrue(np.allclose(fromov[:,:], direct[:,:]))
+        self.assertTrue(np.allclose(
+            grid.resample(8.0, 8.0, method="linear", use_overviews=False)[:,:],
+            direct[:,:]))
+
+        x = np.array([1.2, 100.5, 254.9])
+        y = np.array([1.2, 50.5, 3.0])
+        res = grid.sample(x, y, method="bilinear", resolution=5.0)
+        self.assertTrue(np.allclose(res, grid.sample(x, y, method="bilinear")))
+        return
+
+    def test_sample_bicubic(self):
+        y, x = np.mgrid[0:20, 0:30].astype(np.float64)
+        values = np.dstack([x**2 + y, 2*x - y])
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values)
+        res = grid.sample(np.array([10.5, 12.25, 40.0]),
+                          np.array([5.5, 8.75, 5.0]), method="bicubic")
+        self.assertEqual(res.shape, (2, 3))
+        self.assertAlmostEqual(res[0,0], 10**2 + 5)
+        self.assertAlmostEqual(res[0,1], 11.75**2 + 8.25)
+        self.assertTrue(np.isnan(res[0,2]))
+        self.assertAlmostEqual(res[1,1], 2*11.75 - 8.25)
+        return
+
+    def test_sample_bilinear_native_dtype(self):
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                           values=np.array([[0, 200], [200, 100]], dtype=np.uint8))
+        res = grid.sample_bilinear(np.array([1.0, 1.25]), np.array([1.0, 1.0]))
+        self.assertEqual(res.dtype, np.uint8)
+        self.assertEqual(list(res[0]), [125, 137])
+        return
+
     def test_sample_multipoint(self):
         grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
                            values=np.array([[0, 1], [1, 0.5]]))
@@ -386,6 +532,45 @@ class RegularGridTests(unittest.TestCase):
         self.assertTrue(np.isnan(minmax[0]))
         self.assertTrue(np.isnan(minmax[1]))
 
+    def test_minmax_chunkstats(self):
+        from karta.raster.band import CompressedBand, ChunkCache
+        cache = ChunkCache()
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                           bands=[CompressedBand((600, 500), np.float32,
+                                                 chunksize=(128, 128),
+                                                 initval=np.nan, cache=cache)])
+        np.random.seed(1)
+        values = np.random.rand(200, 300).astype(np.float32)
+        grid[100:300,150:450] = values
+        cache.reset_counters()
+        self.assertEqual(grid.minmax(), (values.min(), values.max()))
+        self.assertEqual(grid.max(), values.max())
+        self.assertEqual(grid.min(), values.min())
+        self.assertTrue(grid.has_data(256, 384, 128, 128))
+        self.assertFalse(grid.has_data(300, 0, 300, 128))
+        self.assertEqual(cache.misses, 0)
+        # only the three chunks that straddle the window edge are read
+        self.assertFalse(grid.has_data(0, 0, 100, 500))
+        self.assertEqual(cache.misses, 3)
+
+        grid.set_nodata_value(-1.0)
+        self.assertEqual(grid.minmax(), (values.min(), values.max()))
+        grid[0,0] = -5.0
+        self.assertEqual(grid.min(), -5.0)
+        return
+
+    def test_minmax_multiband_nodata(self):
+        values = np.dstack([np.array([[1.0, 2.0], [np.nan, 4.0]]),
+                            np.array([[5.0, np.nan], [7.0, 0.5]])])
+        grid = RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values)
+        # cells valid in every band
+        self.assertEqual(grid.min(), 0.5)
+        self.assertEqual(grid.max(), 5.0)
+        self.assertEqual(grid.minmax(), (0.5, 7.0))
+        self.assertTrue(grid.has_data(0, 0, 1, 1))
+        self.assertFalse(grid.has_data(0, 1, 1, 1))
+        return
+
     def test_minmax(self):
         mx = self.rast.max()
         self.assertEqual(mx, 8.075173545159231)
@@ -535,8 +720,87 @@ class RegularGridTests(unittest.TestCase):
                            values=np.arange(1e6).reshape(1000, 1000),
                            crs=karta.crs.Cartesian)
         masked_grid = grid.mask_by_poly(poly)
+        self.assertEqual(int(np.nansum(masked_grid[:,:])), 104948029546)
+
+    def test_mask_poly_inverted_orientation(self):
+        # masks on inverted grids are the flipped masks of upright grids
+        t = -np.linspace(0, 2*np.pi, 200)
+        xp = ((2+np.cos(7*t)) * np.cos(t+0.3) + 4) * 12
+        yp = ((2+np.cos(7*t)) * np.sin(t+0.2) + 4) * 12
+        poly = karta.Polygon(zip(xp, yp), crs=karta.crs.Cartesian)
+        grid = RegularGrid([0.0, 100, 0.1, -0.1, 0.0, 0.0],
+                           values=np.arange(1e6).reshape(1000, 1000)[::-1],
+                           crs=karta.crs.Cartesian)
+        masked_grid = grid.mask_by_poly(poly)
         self.assertEqual(int(np.nansum(masked_grid[:,:])), 97048730546)
 
+        upright = RegularGrid([0.0, 0.0, 0.1, 0.1, 0.0, 0.0],
+                              values=np.zeros((1000, 1000)),
+                              crs=karta.crs.Cartesian)
+        self.assertTrue(np.all(masked_grid.data_mask ==
+                               upright.mask_by_poly(poly).data_mask[::-1]))
+
+    def test_mask_poly_skewed(self):
+        # a polygon masks the same cells as its image in grid index space
+        T = [3.0, 2.0, 0.7, 0.4, 0.2, -0.1]
+        t = -np.linspace(0, 2*np.pi, 50)
+        I = 30 + 20*np.sin(t) + 5*np.cos(3*t)
+        J = 30 + 20*np.cos(t)
+        x = T[0] + J*T[2] + I*T[4]
+        y = T[1] + I*T[3] + J*T[5]
+        mask = karta.raster.mask_poly(x, y, 64, 64, T)
+        expected = karta.raster.mask_poly(J, I, 64, 64, [0, 0, 1, 1, 0, 0])
+        self.assertTrue(mask.sum() > 1000)
+        self.assertTrue(np.all(mask == expected))
+
+    def test_mask_poly_holes(self):
+        hole = karta.Polygon([(3, 3), (3, 6), (6, 6), (6, 3)])
+        poly = karta.Polygon([(0, 0), (10, 0), (10, 10), (0, 10)], subs=[hole])
+        grid = RegularGrid([0, 0, 1, 1, 0, 0], values=np.ones((12, 12)))
+        masked_grid = grid.mask_by_poly(poly)
+        self.assertEqual(masked_grid.data_mask.sum(), 91)
+        self.assertFalse(np.any(masked_grid.data_mask[3:6,3:6]))
+
+    def test_zonal_stats(self):
+        np.random.seed(49)
+        values = np.random.rand(60, 80)
+        values[np.random.rand(60, 80) < 0.1] = np.nan
+        grid = RegularGrid([0, 0, 1, 1, 0, 0], values=values,
+                           crs=karta.crs.Cartesian)
+        t = -np.linspace(0, 2*np.pi, 40)
+        polys = [[list(zip(20+15*np.cos(t), 30+15*np.sin(t))),
+                  [(15, 25), (15, 35), (25, 35), (25, 25)]],
+                 [list(zip(50+20*np.cos(t), 20+10*np.sin(t)))],
+                 [[(100, 100), (110, 100), (110, 110), (100, 110)]]]
+        mp = karta.Multipolygon(polys, crs=karta.crs.Cartesian)
+
+        stats = ("count", "sum", "mean", "min", "max", "std")
+        result = grid.zonal_stats(mp, stats=stats, chunksize=(16, 24))
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result.fields, set(stats))
+        for i in range(2):
+            v = grid.mask_by_poly(mp[i])[:,:,0]
+            v = v[~np.isnan(v)]
+            npt.assert_allclose(result[i], [len(v), v.sum(), v.mean(), v.min(),
+                                            v.max(), v.std()])
+        self.assertEqual(result[2][0], 0)
+        self.assertTrue(np.all(np.isnan(result[2][2:])))
+
+        # the same result without a spatial index
+        result2 = grid.zonal_stats([mp[i] for i in range(3)], stats=stats)
+        npt.assert_allclose(np.array(result2[:2]), np.array(result[:2]))
+
+    def test_rasterize_ids(self):
+        poly1 = karta.Polygon([(0, 0), (6, 0), (6, 6), (0, 6)])
+        poly2 = karta.Polygon([(4, 4), (10, 4), (10, 10), (4, 10)])
+        ids = karta.raster.rasterize([poly1, poly2], 10, 10,
+                                     [0, 0, 1, 1, 0, 0], ids=[3, 7])
+        self.assertEqual(ids.dtype, np.int32)
+        self.assertTrue(np.all(ids[4:,4:] == 7))
+        self.assertTrue(np.all(ids[:4,:6] == 3))
+        self.assertEqual(np.sum(ids == 3), 36-4)
+        self.assertEqual(np.sum(ids == 0), 100-36-32)
+
     def test_mask_multipoly(self):
         t = -np.linspace(0, 2*np.pi, 200)
 
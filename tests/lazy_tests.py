@@ -0,0 +1,138 @@
+""" Unit tests for deferred raster expressions """
+
+import threading
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from karta import RegularGrid
+from karta.raster import SimpleBand
+from karta.raster.lazy import LazyGrid
+
+class RecordingBand(SimpleBand):
+    """ SimpleBand that records the windows read from it """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingBand, self).__init__(*args, **kwargs)
+        self.reads = []
+
+    def getblock(self, yoff, xoff, ny, nx):
+        self.reads.append((yoff, xoff, ny, nx))
+        return super(RecordingBand, self).getblock(yoff, xoff, ny, nx)
+
+class LazyGridTests(unittest.TestCase):
+
+    def setUp(self):
+        T = (0.0, 0.0, 10.0, 10.0, 0.0, 0.0)
+        self.a = RegularGrid(T, values=np.random.random((150, 200)))
+        self.b = RegularGrid(T, values=np.random.random((150, 200)))
+        self.c = RegularGrid(T, values=np.arange(30000, dtype=np.int32).reshape(150, 200))
+
+    def test_lazy_type(self):
+        expr = self.a.lazy() + self.b
+        self.assertTrue(isinstance(expr, LazyGrid))
+        self.assertEqual(expr.size, (150, 200))
+        self.assertEqual(expr.transform, self.a.transform)
+
+    def test_arithmetic(self):
+        expr = (self.a.lazy() + self.b - self.c) * 2.0 / 3.0
+        expected = (self.a[:,:] + self.b[:,:] - self.c[:,:]) * 2.0 / 3.0
+        npt.assert_allclose(expr.evaluate(chunksize=(64, 48))[:,:], expected)
+        npt.assert_allclose(expr[20:70, 5:190], expected[20:70, 5:190])
+
+    def test_reads_only_requested_window(self):
+        T = self.a.transform
+        bands = []
+        for grid in (self.a, self.b):
+            band = RecordingBand((150, 200), np.float64)
+            band.setblock(0, 0, grid[:,:,0])
+            bands.append(band)
+        a = RegularGrid(T, bands=bands[:1])
+        b = RegularGrid(T, bands=bands[1:])
+
+        expr = a.lazy() + b
+        self.assertEqual(bands[0].reads, [])
+        self.assertEqual(bands[1].reads, [])
+
+        result = expr[20:40, 30:60]
+        npt.assert_allclose(result, self.a[20:40, 30:60] + self.b[20:40, 30:60])
+        for band in bands:
+            self.assertNotEqual(band.reads, [])
+            for yoff, xoff, ny, nx in band.reads:
+                self.assertTrue(20 <= yoff and yoff+ny <= 40)
+                self.assertTrue(30 <= xoff and xoff+nx <= 60)
+
+    def test_reflected_arithmetic(self):
+        expr = 1.0 - self.a.lazy()
+        npt.assert_allclose(expr[:,:], 1.0 - self.a[:,:])
+
+    def test_nodata_propagates(self):
+        self.a[10, 12] = np.nan
+        expr = self.a.lazy() + self.b
+        result = expr.evaluate(chunksize=(32, 32))
+        self.assertTrue(np.isnan(result[10, 12]))
+        self.assertEqual(np.sum(np.isnan(result[:,:])), 1)
+
+    def test_integer_nodata(self):
+        expr = self.c.lazy().apply(lambda v: v+1)
+        self.assertEqual(expr.dtype, np.int32)
+        self.assertEqual(expr.nodata, self.c.nodata)
+        npt.assert_equal(expr[:,:], self.c[:,:]+1)
+
+    def test_apply_matches_eager(self):
+        expr = self.a.lazy().apply(np.sqrt)
+        npt.assert_allclose(expr[:,:], self.a.apply(np.sqrt)[:,:])
+
+    def test_focal_mean(self):
+        def mean3(w):
+            return sum(w[1+i:w.shape[0]-1+i, 1+j:w.shape[1]-1+j]
+                       for i in (-1, 0, 1) for j in (-1, 0, 1)) / 9.0
+        expr = self.a.lazy().focal(mean3, 1)
+        result = expr.evaluate(chunksize=(40, 70))
+
+        v = self.a[:,:,0]
+        padded = np.pad(v, 1, "constant", constant_values=np.nan)
+        expected = mean3(padded)
+        npt.assert_allclose(result[:,:,0], expected)
+        self.assertTrue(np.isnan(result[0, 5]))
+        self.assertFalse(np.isnan(result[1, 1]))
+
+    def test_threaded_evaluate(self):
+        expr = self.a.lazy() * self.b
+        result = expr.evaluate(chunksize=(32, 32), nthreads=3,
+                               bandclass=SimpleBand)
+        self.assertTrue(isinstance(result.bands[0], SimpleBand))
+        npt.assert_allclose(result[:,:], self.a[:,:]*self.b[:,:])
+
+    def test_threaded_evaluate_threaded_bands(self):
+        # band reads in evaluate's workers must not wait on the pool that the
+        # workers belong to
+        from karta.raster import CompressedBand
+        band = CompressedBand((256, 256), np.float64, chunksize=(64, 64),
+                              nthreads=4)
+        band.setblock(0, 0, np.arange(256*256, dtype=np.float64).reshape(256, 256))
+        grid = RegularGrid((0.0, 0.0, 1.0, 1.0, 0.0, 0.0), bands=[band])
+        result = []
+        worker = threading.Thread(target=lambda: result.append(
+            (grid.lazy()*2).evaluate(chunksize=(128, 128), nthreads=4)))
+        worker.daemon = True
+        worker.start()
+        worker.join(60)
+        self.assertFalse(worker.is_alive())
+        npt.assert_array_equal(result[0][:,:], grid[:,:]*2)
+
+    def test_mismatched_structure(self):
+        other = RegularGrid((5.0, 0.0, 10.0, 10.0, 0.0, 0.0),
+                            values=np.zeros((150, 200)))
+        with self.assertRaises(ValueError):
+            self.a.lazy() + other
+
+    def test_multiband_broadcast(self):
+        T = self.a.transform
+        g3 = RegularGrid(T, values=np.random.random((150, 200, 3)))
+        expr = g3.lazy() - self.a
+        self.assertEqual(expr.nbands, 3)
+        npt.assert_allclose(expr[:,:,:], g3[:,:,:] - self.a[:,:])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -68,6 +68,36 @@ class TestQuadTree(unittest.TestCase):
         self.assertEqual(len(indices_within), 11)
         return
 
+    def test_quadtree_nearest(self):
+        np.random.seed(49)
+        vertices = np.random.rand(2000, 2)
+        quadtree = QuadTree(CoordString(vertices), leaf_capacity=20)
+        q = np.random.rand(100, 2)
+        indices, distances = quadtree.nearest(q[:,0], q[:,1], 6)
+        self.assertEqual(indices.shape, (100, 6))
+
+        d = np.sqrt(((vertices[np.newaxis,:,:] - q[:,np.newaxis,:])**2).sum(axis=2))
+        self.assertTrue(np.allclose(distances, np.sort(d, axis=1)[:,:6]))
+        self.assertTrue(np.allclose(d[np.arange(100)[:,np.newaxis], indices],
+                                    distances))
+        return
+
+    def test_quadtree_nearest_duplicates(self):
+        vertices = [(3.0, 4.0) for _ in range(11)] + [(5.0, 5.0), (1.0, 1.0)]
+        quadtree = QuadTree(CoordString(vertices), leaf_capacity=10)
+        indices, distances = quadtree.nearest([3.1], [4.0], 12)
+        self.assertEqual(sorted(indices[0,:11]), list(range(11)))
+        self.assertEqual(indices[0,11], 11)
+        self.assertTrue(np.allclose(distances[0,:11], 0.1))
+        return
+
+    def test_quadtree_nearest_too_few(self):
+        quadtree = QuadTree(CoordString([(0.0, 0.0), (1.0, 1.0)]))
+        indices, distances = quadtree.nearest([0.2], [0.1], 4)
+        self.assertEqual(list(indices[0]), [0, 1, -1, -1])
+        self.assertTrue(np.all(np.isinf(distances[0,2:])))
+        return
+
 class TestGeometryWithQuadTree(unittest.TestCase):
 
     def test_within_radius(self):
@@ -87,6 +117,34 @@ class TestGeometryWithQuadTree(unittest.TestCase):
             self.assertTrue(subset[i] in subset_noindex)
         return
 
+    def test_multipoint_nearest(self):
+        np.random.seed(42)
+        vertices = np.random.rand(1000, 2)
+        mp = karta.Multipoint(vertices)
+        q = np.random.rand(50, 2)
+        indices, distances = mp.nearest(q, k=3)
+        indices_threaded, distances_threaded = mp.nearest(q, k=3, nthreads=3)
+        self.assertTrue(np.array_equal(indices, indices_threaded))
+        self.assertTrue(np.array_equal(distances, distances_threaded))
+        indices_threaded, distances_threaded = mp.nearest(q, k=3, nthreads=64)
+        self.assertTrue(np.array_equal(indices, indices_threaded))
+        self.assertTrue(np.array_equal(distances, distances_threaded))
+        for i in range(50):
+            d = mp.flat_distances_to(karta.Point(q[i]))
+            self.assertEqual(indices[i,0], np.argmin(d))
+            self.assertTrue(np.allclose(distances[i], np.sort(d)[:3]))
+
+        indices, _ = mp.nearest(karta.Multipoint(q[:5]), k=1)
+        self.assertEqual(list(indices[:,0]), [mp.nearest_vertex_to(karta.Point(v))
+                                              for v in q[:5]])
+        return
+
+    def test_multipoint_nearest_geographical(self):
+        mp = karta.Multipoint([(0.0, 30.0), (3.0, 35.0)], crs=karta.crs.LonLatWGS84)
+        with self.assertRaises(karta.errors.CRSError):
+            mp.nearest([(1.0, 31.0)])
+        return
+
     def test_polygon_contains(self):
         """ Search for points contained within a polygon, using a quadtree. """
         crs = karta.crs.SphericalEarth
@@ -108,5 +166,91 @@ class TestGeometryWithQuadTree(unittest.TestCase):
             self.assertTrue(contained[i] in contained_noindex)
         return
 
+class LazyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.vertices = np.random.rand(2000, 2)
+
+    def test_index_built_on_first_query(self):
+        mp = karta.Multipoint(self.vertices)
+        self.assertTrue(mp._index is None)
+        mp.within_bbox((0.2, 0.2, 0.4, 0.4))
+        self.assertTrue(isinstance(mp._index, QuadTree))
+        return
+
+    def test_no_index(self):
+        mp = karta.Multipoint(self.vertices, build_index=False)
+        self.assertFalse(hasattr(mp, "quadtree"))
+        self.assertEqual(len(mp.within_bbox((0.2, 0.2, 0.4, 0.4))),
+                         np.sum(np.all((self.vertices >= 0.2) &
+                                       (self.vertices <= 0.4), axis=1)))
+        return
+
+    def test_subset_shares_index(self):
+        mp = karta.Multipoint(self.vertices)
+        mp.quadtree
+        subset = mp.within_bbox((0.1, 0.1, 0.7, 0.8))
+        fresh = karta.Multipoint(subset.vertices())
+        self.assertTrue(fresh._index is None)
+        self.assertTrue(subset._index is not None)
+        self.assertFalse(isinstance(subset._index, QuadTree))
+
+        bbox = (0.3, 0.2, 0.5, 0.6)
+        self.assertEqual(sorted(subset.quadtree.search_within(*bbox)),
+                         sorted(fresh.quadtree.search_within(*bbox)))
+
+        q = np.random.rand(20, 2)
+        idx_shared, d_shared = subset.nearest(q, k=4)
+        idx_fresh, d_fresh = fresh.nearest(q, k=4)
+        self.assertTrue(np.allclose(d_shared, d_fresh))
+        self.assertTrue(np.array_equal(idx_shared, idx_fresh))
+
+        sliced = subset[::3]
+        self.assertEqual(sorted(sliced.quadtree.search_within(*bbox)),
+                         sorted(karta.Multipoint(sliced.vertices())
+                                     .quadtree.search_within(*bbox)))
+        return
+
+    def test_subset_index_memory(self):
+        # subset indexes hold arrays sized by the subset, not by the parent
+        mp = karta.Multipoint(self.vertices)
+        mp.quadtree
+        subsets = [mp[i:i+3] for i in range(0, 2000, 7)]
+        for i, subset in enumerate(subsets):
+            self.assertEqual(sorted(subset.within_bbox((0, 0, 1, 1)).vertices()
+                                    .tolist()),
+                             sorted(self.vertices[7*i:7*i+3].tolist()))
+            self.assertFalse(isinstance(subset._index, QuadTree))
+            arrays = [a for a in vars(subset._index).values()
+                      if isinstance(a, np.ndarray)]
+            self.assertTrue(all(a.size <= 3 for a in arrays))
+        return
+
+    def test_negative_stride_slice(self):
+        mp = karta.Multipoint(self.vertices)
+        mp.quadtree
+        subset = mp.within_bbox((0.1, 0.1, 0.7, 0.8))
+        sliced = subset[::-2]
+        bbox = (0.3, 0.2, 0.5, 0.6)
+        self.assertEqual(len(sliced.within_bbox(bbox)),
+                         len(karta.Multipoint(sliced.vertices(),
+                                              build_index=False)
+                             .within_bbox(bbox)))
+        return
+
+    def test_multiline_subset_shares_index(self):
+        lines = [[(x, y), (x+0.05, y+0.02)] for x, y in self.vertices[:500]]
+        ml = karta.Multiline(lines)
+        self.assertTrue(ml._index is None)
+        subset = ml.touching_bbox((0.0, 0.0, 0.6, 0.6))
+        self.assertTrue(subset._index is not None)
+        bbox = (0.2, 0.3, 0.4, 0.5)
+        indices = ml.rtree.search_overlapping((0.0, 0.0, 0.6, 0.6))
+        fresh = karta.Multiline([lines[i] for i in indices])
+        self.assertEqual(sorted(subset.rtree.search_overlapping(bbox)),
+                         sorted(fresh.rtree.search_overlapping(bbox)))
+        return
+
 if __name__ == "__main__":
     unittest.main()
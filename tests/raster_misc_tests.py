@@ -1,9 +1,11 @@
+import threading
 import unittest
 import numpy as np
 import numpy.testing as npt
 import karta
 from karta import RegularGrid
 from karta.raster import misc
+from karta.raster.lazy import LazyGrid
 
 class RasterMiscTests(unittest.TestCase):
 
@@ -136,6 +138,79 @@ class RasterMiscTests(unittest.TestCase):
             np.nansum(np.abs((g[:,:]/g.max() + div[:,:]/div.max()))) < 1.32
         )
 
+class ChunkedRasterMiscTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        z = 100*np.random.rand(37, 53)
+        z[np.random.rand(37, 53) < 0.05] = -9999
+        self.grid = RegularGrid((0, 0, 2.0, 3.0, 0, 0), values=z,
+                                nodata_value=-9999)
+        self.D = np.where(self.grid.data_mask,
+                          self.grid[:,:,0].astype(np.float32), np.nan)
+
+    def test_slope(self):
+        expected = misc._slope(self.D, self.grid.resolution)
+        slope = misc.slope(self.grid, chunksize=(7, 9), nthreads=3)
+        npt.assert_array_equal(slope[:,:,0], expected)
+
+    def test_aspect(self):
+        expected = misc._aspect(self.D, self.grid.resolution)
+        aspect = misc.aspect(self.grid, chunksize=(7, 9), nthreads=3)
+        npt.assert_array_equal(aspect[:,:,0], expected)
+
+    def test_gradient(self):
+        ex, ey = misc._grad(self.D, self.grid.resolution)
+        gx, gy = misc.gradient(self.grid, chunksize=(7, 9), nthreads=3)
+        npt.assert_array_equal(gx[:,:,0], ex)
+        npt.assert_array_equal(gy[:,:,0], ey)
+
+    def test_divergence(self):
+        z = self.grid[:,:,0]
+        twoband = RegularGrid(self.grid.transform, np.dstack([z, 2*z]))
+        expected = misc._div(z, 2*z, self.grid.resolution)
+        div = misc.divergence(twoband, chunksize=(7, 9), nthreads=3)
+        npt.assert_array_equal(div[:,:,0], expected)
+
+    def test_hillshade(self):
+        expected = misc.hillshade(self.grid, chunksize=(64, 64))
+        hs = misc.hillshade(self.grid, chunksize=(7, 9), nthreads=3)
+        npt.assert_array_equal(hs[:,:,0], expected[:,:,0])
+
+    def test_slope_threaded_bands(self):
+        # threaded functions reading multithreaded CompressedBands
+        from karta.raster import CompressedBand
+        band = CompressedBand((128, 96), np.float64, chunksize=(32, 32),
+                              nthreads=3)
+        band.setblock(0, 0, np.random.rand(128, 96))
+        grid = RegularGrid((0, 0, 2.0, 3.0, 0, 0), bands=[band])
+        D = grid[:,:,0].astype(np.float32)
+        result = []
+        worker = threading.Thread(target=lambda: result.append(
+            misc.slope(grid, chunksize=(64, 64), nthreads=3)))
+        worker.daemon = True
+        worker.start()
+        worker.join(60)
+        self.assertFalse(worker.is_alive())
+        npt.assert_array_equal(result[0][:,:,0], misc._slope(D, grid.resolution))
+
+    def test_slope_lazy(self):
+        expr = misc.slope(self.grid.lazy())
+        self.assertTrue(isinstance(expr, LazyGrid))
+        npt.assert_array_equal(expr[:,:,0],
+                               misc._slope(self.D, self.grid.resolution))
+
+    def test_chunked_percentile(self):
+        band = karta.raster.SimpleBand((300, 200), np.float64)
+        values = np.random.randn(300, 200)
+        values[np.random.rand(300, 200) < 0.1] = np.nan
+        values[:50] = 1.0
+        band.setblock(0, 0, values)
+        expected = np.percentile(values[~np.isnan(values)], [2, 50, 98])
+        q = misc._chunked_percentile(band, [2, 50, 98], (64, 64),
+                                     maxvalues=100)
+        npt.assert_array_equal(q, expected)
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -1,7 +1,11 @@
 import unittest
+import os
 import sys
+import pickle
+import shutil
+import tempfile
 import ctypes
-from ctypes import c_int, c_float, pointer
+from ctypes import c_int, c_double, pointer
 import numpy as np
 
 import karta
@@ -13,8 +17,8 @@ class TestGeom(object):
         self.bbox = bbox
 
 class BBOX(ctypes.Structure):
-    _fields_ = [("xmin", c_float), ("ymin", c_float),
-                ("xmax", c_float), ("ymax", c_float)]
+    _fields_ = [("xmin", c_double), ("ymin", c_double),
+                ("xmax", c_double), ("ymax", c_double)]
 
 class CRTreeTests(unittest.TestCase):
 
@@ -55,7 +59,7 @@ class CRTreeTests(unittest.TestCase):
 
     @unittest.skipIf(sys.platform.startswith("win"), "false positive on Windows")
     def test_bbox_intersection_area(self):
-        self.rt.bbox_intersection_area.restype = c_float
+        self.rt.bbox_intersection_area.restype = c_double
         bbox1 = pointer(BBOX(0.0, 0.0, 1.0, 1.0))
         bbox2 = pointer(BBOX(0.5, 0.5, 1.5, 1.5))
         self.assertAlmostEqual(self.rt.bbox_intersection_area(bbox1, bbox2), 0.25, places=6)
@@ -109,5 +113,164 @@ class RTreeTests(unittest.TestCase):
         self.assertEqual(len(corner_geoms), 143)
         return
 
+class PackedRTreeTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(49)
+        centers = np.random.rand(5000, 2) * 100
+        halfwidths = np.random.rand(5000, 2)
+        self.bboxes = np.hstack([centers-halfwidths, centers+halfwidths])
+
+    def brute_overlapping(self, bbox):
+        b = self.bboxes
+        dx = np.minimum(b[:,2], bbox[2]) - np.maximum(b[:,0], bbox[0])
+        dy = np.minimum(b[:,3], bbox[3]) - np.maximum(b[:,1], bbox[1])
+        return list(np.nonzero((dx > 0) & (dy > 0))[0])
+
+    def brute_within(self, bbox):
+        b = self.bboxes
+        return list(np.nonzero((b[:,0] > bbox[0]) & (b[:,2] <= bbox[2]) &
+                               (b[:,1] > bbox[1]) & (b[:,3] <= bbox[3]))[0])
+
+    def test_from_bboxes(self):
+        rtree = RTree.from_bboxes(self.bboxes, maxchildren=16)
+        self.assertEqual(len(rtree), 5000)
+        for x, y in np.random.rand(50, 2) * 90:
+            bbox = (x, y, x+10, y+10)
+            self.assertEqual(sorted(rtree.search_overlapping(bbox)),
+                             self.brute_overlapping(bbox))
+            self.assertEqual(sorted(rtree.search_within(bbox)),
+                             self.brute_within(bbox))
+        return
+
+    def test_packed_from_geometries(self):
+        geoms = [karta.Line([(b[0], b[1]), (b[2], b[3])]) for b in self.bboxes[:500]]
+        rtree = RTree(geoms, maxchildren=10)
+        self.assertEqual(len(rtree), 500)
+        self.assertEqual(sorted(rtree.search_within((0, 0, 50, 50))),
+                         [i for i in self.brute_within((0, 0, 50, 50)) if i < 500])
+        return
+
+    def test_from_bboxes_empty(self):
+        rtree = RTree.from_bboxes(np.empty((0, 4)))
+        self.assertEqual(len(rtree), 0)
+        self.assertEqual(rtree.search_overlapping((0, 0, 1, 1)), [])
+        return
+
+    def test_from_bboxes_invalid(self):
+        with self.assertRaises(ValueError):
+            RTree.from_bboxes(np.zeros((3, 3)))
+        with self.assertRaises(ValueError):
+            RTree.from_bboxes(self.bboxes, maxchildren=2)
+        return
+
+    def test_double_precision(self):
+        bboxes = np.array([[5000000.3, 5000000.3, 5000000.4, 5000000.4],
+                           [5000000.6, 5000000.6, 5000000.7, 5000000.7]])
+        rtree = RTree.from_bboxes(bboxes)
+        self.assertEqual(rtree.search_overlapping((5000000.0, 5000000.0,
+                                                   5000000.2, 5000000.2)), [])
+        self.assertEqual(rtree.search_within((5000000.25, 5000000.25,
+                                              5000000.45, 5000000.45)), [0])
+        return
+
+class SerializedRTreeTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(49)
+        centers = np.random.rand(3000, 2) * 100
+        halfwidths = np.random.rand(3000, 2)
+        self.rtree = RTree.from_bboxes(np.hstack([centers-halfwidths,
+                                                  centers+halfwidths]),
+                                       maxchildren=8)
+
+    def assertSameSearches(self, rtree):
+        self.assertEqual(len(rtree), len(self.rtree))
+        self.assertEqual(rtree.bbox, self.rtree.bbox)
+        for x, y in np.random.rand(20, 2) * 90:
+            bbox = (x, y, x+10, y+10)
+            self.assertEqual(sorted(rtree.search_overlapping(bbox)),
+                             sorted(self.rtree.search_overlapping(bbox)))
+            self.assertEqual(sorted(rtree.search_within(bbox)),
+                             sorted(self.rtree.search_within(bbox)))
+
+    def test_bytes_roundtrip(self):
+        buf = self.rtree.to_bytes()
+        rtree = RTree.from_bytes(buf)
+        self.assertSameSearches(rtree)
+        self.assertEqual(rtree.to_bytes(), buf)
+        return
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "rtree_test.rtree")
+            self.rtree.save(path)
+            self.assertSameSearches(RTree.load(path))
+            self.assertSameSearches(RTree.load(path, use_mmap=False))
+        finally:
+            shutil.rmtree(tmpdir)
+        return
+
+    def test_pickle(self):
+        self.assertSameSearches(pickle.loads(pickle.dumps(self.rtree)))
+        return
+
+    def test_unpacked_roundtrip(self):
+        geoms = [karta.Line([(0, 0), (1, 1)]), karta.Line([(2, 2), (3, 4)])]
+        rtree = RTree.from_bytes(RTree(geoms, packed=False).to_bytes())
+        self.assertEqual(sorted(rtree.search_overlapping((0.5, 0.5, 2.5, 2.5))),
+                         [0, 1])
+        return
+
+    def test_invalid_buffer(self):
+        buf = self.rtree.to_bytes()
+        with self.assertRaises(ValueError):
+            RTree.from_bytes(buf[:-4])
+        with self.assertRaises(ValueError):
+            RTree.from_bytes(b"not an rtree" + buf)
+        with self.assertRaises(ValueError):
+            RTree.from_bytes(buf[:20])
+        return
+
+    def test_corrupt_buffer(self):
+        buf = self.rtree.to_bytes()
+        nnodes, nitems, nchildren, _ = np.frombuffer(buf, dtype="<i8", count=4,
+                                                     offset=8)
+        children_offset = len(buf) - 4*nchildren
+        info_offset = children_offset - 12*nnodes
+
+        def corrupt(offset, dtype, value):
+            a = np.frombuffer(buf, dtype=np.uint8).copy()
+            a[offset:offset+np.dtype(dtype).itemsize] = \
+                    np.array([value], dtype=dtype).view(np.uint8)
+            return a.tobytes()
+
+        cases = [corrupt(8, "<i8", -1),                   # node count
+                 corrupt(8, "<i8", nnodes+1),             # node count
+                 corrupt(24, "<i8", 2**40),               # child count
+                 corrupt(info_offset, "<i4", 7),          # node type
+                 corrupt(info_offset+4, "<i4", 3),        # root child offset
+                 corrupt(info_offset+8, "<i4", 10**6),    # root child count
+                 corrupt(children_offset, "<i4", nnodes), # root child index
+                 corrupt(children_offset, "<i4", 0),      # cycle to the root
+                 corrupt(len(buf)-4, "<i4", nitems),      # leaf item index
+                 corrupt(len(buf)-4, "<i4", -1)]          # leaf item index
+        for case in cases:
+            with self.assertRaises(ValueError):
+                RTree.from_bytes(case)
+
+        # arbitrary corruption of the tree structure is rejected or leaves a
+        # tree that can be searched
+        np.random.seed(49)
+        for offset in np.random.randint(info_offset, len(buf)-4, 200):
+            try:
+                rtree = RTree.from_bytes(corrupt(offset, "<i4",
+                                                 np.random.randint(-5, 4000)))
+            except ValueError:
+                continue
+            rtree.search_overlapping((0, 0, 100, 100))
+        return
+
 if __name__ == "__main__":
     unittest.main()
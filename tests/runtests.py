@@ -18,6 +18,7 @@ from grid_tests import *
 from band_tests import *
 from coordgen_tests import *
 from raster_misc_tests import *
+from lazy_tests import *
 
 # Vector operations
 from vector_predicate_tests import *
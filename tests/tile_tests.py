@@ -1,6 +1,14 @@
 import unittest
-from karta.tile import Tile, tile_from_point
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import zlib
+import numpy as np
+from karta.tile import Tile, tile_from_point, tiles_covering, render_tiles
 from karta.vector.geometry import Point
+from karta.raster.grid import RegularGrid
 from karta.crs import LonLatWGS84
 
 class TileTests(unittest.TestCase):
@@ -33,5 +41,87 @@ class TileTests(unittest.TestCase):
         self.assertAlmostEqual(bbox[3], 85.05112877, places=7)
         return
 
+    def test_tiles_covering(self):
+        self.assertEqual(tiles_covering((-180, -90, 180, 90), 0), [Tile(0, 0, 0)])
+        tiles = tiles_covering((-10, -10, 10, 10), 1)
+        self.assertEqual(tiles, [Tile(1, 0, 0), Tile(1, 1, 0),
+                                 Tile(1, 0, 1), Tile(1, 1, 1)])
+        tiles = tiles_covering((60, -30.001, 60.001, -30), 12)
+        self.assertEqual(tiles, [tile_from_point(Point((60.0005, -30.0005),
+                                                       crs=LonLatWGS84), 12)])
+        return
+
+def decode_png(data):
+    """ Return the pixels of an 8-bit PNG written by render_tiles """
+    self_chunks = {}
+    pos = 8
+    while pos < len(data):
+        n, = struct.unpack(">I", data[pos:pos+4])
+        self_chunks[data[pos+4:pos+8]] = data[pos+8:pos+8+n]
+        pos += n + 12
+    nx, ny, _, colortype = struct.unpack(">IIBB", self_chunks[b"IHDR"][:10])
+    nchannels = {4: 2, 6: 4}[colortype]
+    raw = np.frombuffer(zlib.decompress(self_chunks[b"IDAT"]), dtype=np.uint8)
+    return raw.reshape(ny, nx*nchannels+1)[:,1:].reshape(ny, nx, nchannels)
+
+class RenderTilesTests(unittest.TestCase):
+
+    def setUp(self):
+        # a quarter of the world, increasing eastward
+        lon = np.arange(0.0, 90.0, 0.25) + 0.125
+        values = np.tile(lon, (340, 1))
+        self.grid = RegularGrid((0.0, 0.0, 0.25, 0.25, 0.0, 0.0),
+                                values=values, crs=LonLatWGS84)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_render_directory(self):
+        path = os.path.join(self.tmpdir, "tiles")
+        stats = render_tiles(self.grid, range(3), path, vmin=0, vmax=90,
+                             tilesize=64)
+        self.assertEqual(sorted(stats), [0, 1, 2])
+        self.assertEqual(stats[2]["tiles"], 2)
+        self.assertEqual(stats[2]["written"], 2)
+        self.assertTrue(stats[2]["tiles_per_second"] > 0)
+        self.assertEqual(self.grid.overviews, {})
+        self.assertTrue(os.path.isfile(os.path.join(path, "2", "2", "0.png")))
+        self.assertTrue(os.path.isfile(os.path.join(path, "2", "2", "1.png")))
+
+        with open(os.path.join(path, "1", "1", "0.png"), "rb") as f:
+            pixels = decode_png(f.read())
+        self.assertEqual(pixels.shape, (64, 64, 2))
+        # the tile covers longitudes 0-180 and latitudes 0-85.05, so the grid
+        # fills the left half below the first row
+        self.assertTrue(np.all(pixels[1:,:31,1] == 255))
+        self.assertTrue(np.all(pixels[0,:,1] == 0))
+        self.assertTrue(np.all(pixels[:,33:,1] == 0))
+        self.assertTrue(np.all(np.diff(pixels[10,:31,0].astype(int)) >= 0))
+        self.assertAlmostEqual(pixels[10,15,0], 255*(15.5/64*180)/90, delta=2)
+        return
+
+    def test_render_mbtiles_parallel(self):
+        paths = [os.path.join(self.tmpdir, "tiles{0}.mbtiles".format(n))
+                 for n in (1, 2)]
+        for n, path in zip((1, 2), paths):
+            render_tiles(self.grid, [1, 3], path, format="mbtiles",
+                         tilesize=64, nprocesses=n)
+
+        rows = []
+        for path in paths:
+            conn = sqlite3.connect(path)
+            rows.append(conn.execute("SELECT * FROM tiles ORDER BY "
+                                     "zoom_level, tile_column, tile_row").fetchall())
+            metadata = dict(conn.execute("SELECT * FROM metadata").fetchall())
+            conn.close()
+        self.assertEqual(rows[0], rows[1])
+        self.assertEqual([r[:3] for r in rows[0] if r[0] == 1], [(1, 1, 1)])
+        self.assertEqual(len([r for r in rows[0] if r[0] == 3]), 8)
+        self.assertEqual(metadata["minzoom"], "1")
+        self.assertEqual(metadata["maxzoom"], "3")
+        self.assertEqual(metadata["format"], "png")
+        return
+
 if __name__ == "__main__":
     unittest.main()
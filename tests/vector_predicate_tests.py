@@ -54,6 +54,38 @@ class TestBinaryPredicates(unittest.TestCase):
         self.assertEqual(line0.intersections(line1), Multipoint([(1.5, 1.5)]))
         return
 
+    def test_line_intersections_many(self):
+        # compare the gridded search with testing every pair of segments
+        from karta.vector.intersection import all_intersections, intersection
+        np.random.seed(49)
+        for _ in range(5):
+            va = np.cumsum(np.random.randn(200, 2), axis=0)
+            vb = np.cumsum(np.random.randn(150, 2), axis=0)
+            expected = []
+            for i in range(len(va)-1):
+                for j in range(len(vb)-1):
+                    xi, yi = intersection(va[i,0], va[i+1,0], vb[j,0], vb[j+1,0],
+                                          va[i,1], va[i+1,1], vb[j,1], vb[j+1,1])
+                    if not np.isnan(xi):
+                        expected.append((xi, yi))
+            result = all_intersections(Line(va)._vertices, Line(vb)._vertices)
+            self.assertEqual(result, expected)
+        return
+
+    def test_line_intersections_long_segments(self):
+        # segments spanning the whole grid fall back to testing every pair
+        from karta.vector.intersection import all_intersections, _candidate_pairs
+        x = np.where(np.arange(401) % 2 == 0, 0.0, 1.0)
+        a = Line(np.c_[x, x + 1e-3])._vertices
+        b = Line(np.c_[x, x - 1e-3])._vertices
+        self.assertEqual(all_intersections(a, b), [])
+        segs = np.c_[x[:-1], x[:-1], x[1:], x[1:]]
+        self.assertTrue(_candidate_pairs(segs, segs) is None)
+
+        c = Line(np.c_[x, 1.0 - x])._vertices
+        self.assertEqual(len(all_intersections(a, c)), 400*400)
+        return
+
     def test_line_intersection2(self):
         # test lines that have overlapping bounding boxes, but don't cross
         #   -----
@@ -189,6 +221,81 @@ class TestBinaryPredicates(unittest.TestCase):
         self.assertFalse(p.contains(Point((45, 75), crs=SphericalEarth)))
         return
 
+    def test_poly_contains_many(self):
+        theta = np.linspace(0, 2*np.pi, 361)[:-1]
+        r = 10*np.sin(theta*8) + 15
+        hole = Polygon(zip(3*np.cos(theta[::-10]) + 25,
+                           3*np.sin(theta[::-10]) + 25))
+        polygon = Polygon(zip(np.cos(theta)*r + 25, np.sin(theta)*r + 25),
+                          subs=[hole])
+        np.random.seed(42)
+        x = np.random.random(2000) * 50
+        y = np.random.random(2000) * 50
+        expected = [polygon.contains(Point((x_, y_))) for x_, y_ in zip(x, y)]
+        self.assertEqual(list(polygon.contains_many(x, y)), expected)
+        return
+
+    def test_poly_contains_many_edges(self):
+        # points on edges and vertices, with and without an edge index
+        from karta.vector import contains
+        square = Polygon([(0,0), (1,0), (1,1), (0,1)])
+        x, y = np.meshgrid(np.linspace(-0.5, 1.5, 9), np.linspace(-0.5, 1.5, 9))
+        x = x.ravel()
+        y = y.ravel()
+        expected = [square.contains(Point((x_, y_))) for x_, y_ in zip(x, y)]
+        self.assertEqual(list(square.contains_many(x, y)), expected)
+        self.assertEqual(list(contains.contains_many(x, y, square._vertices,
+                                                     index=True)), expected)
+        return
+
+    def test_prepared_poly_contains(self):
+        theta = np.linspace(0, 2*np.pi, 361)[:-1]
+        r = 10*np.sin(theta*8) + 15
+        hole = Polygon(zip(3*np.cos(theta[::-10]) + 25,
+                           3*np.sin(theta[::-10]) + 25))
+        polygon = Polygon(zip(np.cos(theta)*r + 25, np.sin(theta)*r + 25),
+                          subs=[hole])
+        prepared = polygon.prepare()
+        self.assertEqual(prepared.bbox(), polygon.bbox())
+        np.random.seed(42)
+        x = np.random.random(1000) * 50
+        y = np.random.random(1000) * 50
+        points = [Point((x_, y_)) for x_, y_ in zip(x, y)]
+        self.assertEqual([prepared.contains(pt) for pt in points],
+                         [polygon.contains(pt) for pt in points])
+        self.assertEqual(list(prepared.contains_many(x, y)),
+                         list(polygon.contains_many(x, y)))
+        return
+
+    def test_prepared_poly_contains_polar(self):
+        p = Polygon([(0, 80), (45, 80), (90, 80), (135, 80), (180, 80),
+                     (225, 80), (270, 80), (315, 80)],
+                    crs=SphericalEarth).prepare()
+        self.assertTrue(p.contains(Point((45, 85), crs=SphericalEarth)))
+        self.assertFalse(p.contains(Point((45, 75), crs=SphericalEarth)))
+        return
+
+    def test_prepared_poly_intersects(self):
+        from karta.vector import intersection
+        np.random.seed(49)
+        theta = np.linspace(0, 2*np.pi, 200, endpoint=False)
+        r = 5 + 3*np.random.random(200)
+        polygon = Polygon(zip(r*np.cos(theta), r*np.sin(theta)))
+        prepared = polygon.prepare()
+        for _ in range(200):
+            line = Line(np.cumsum(np.random.randn(5, 2), axis=0)
+                        + 16*np.random.random(2) - 8)
+            expected = len(intersection.all_intersections(polygon._vertices,
+                                                          line._vertices)) != 0
+            self.assertEqual(prepared.intersects(line), expected)
+
+        square = Polygon([(0,0), (1,0), (1,1), (0,1)]).prepare()
+        self.assertTrue(square.intersects(Line([(0.5, 0.5), (0.5, 2)])))
+        self.assertTrue(square.intersects(Polygon([(1,1), (2,1), (2,2)])))
+        self.assertFalse(square.intersects(Line([(0.2, 0.2), (0.8, 0.8)])))
+        self.assertFalse(square.intersects(Line([(2, 0.5), (3, 0.5)])))
+        return
+
     def test_within_distance(self):
         line = Line([(0,0), (1,1), (3,1)])
         pt = Point((1,1.5))